@@ -0,0 +1,117 @@
+import asyncio
+import io
+import os
+import tarfile
+import threading
+import zipfile
+from typing import Iterable
+
+from bandwidth import Transfer
+from metrics import TRANSFERRED_BYTES, stage
+from sanic.response import ResponseStream
+
+CHUNK_SIZE = 1048576
+# Chunks buffered between the archiving thread and the response.
+QUEUE_SIZE = 8
+
+
+class ArchiveCancelled(Exception):
+    pass
+
+
+class _QueueWriter(io.RawIOBase):
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        queue: asyncio.Queue,
+        cancelled: threading.Event,
+    ):
+        self._loop = loop
+        self._queue = queue
+        self._cancelled = cancelled
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self._cancelled.is_set():
+            raise ArchiveCancelled()
+
+        asyncio.run_coroutine_threadsafe(
+            self._queue.put(bytes(data)), self._loop
+        ).result()
+        return len(data)
+
+
+def _write_archive(fileobj, root: str, paths: Iterable[str], ext: str) -> None:
+    if ext == "tar.gz":
+        with tarfile.open(fileobj=fileobj, mode="w|gz") as tar:
+            for path in paths:
+                tar.add(path, os.path.relpath(path, root))
+        return
+
+    with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as archive:
+        for path in paths:
+            archive.write(path, os.path.relpath(path, root))
+            if os.path.isdir(path) and not os.path.islink(path):
+                for current, dirs, files in os.walk(path):
+                    for name in dirs + files:
+                        archive.write(
+                            os.path.join(current, name),
+                            os.path.relpath(os.path.join(current, name), root),
+                        )
+
+
+def stream_archive(
+    root: str,
+    paths: list[str],
+    ext: str,
+    filename: str,
+    location: str,
+    transfer: Transfer,
+) -> ResponseStream:
+    """
+    Streams a zip or tar.gz archive of `paths`, named relative to `root`,
+    while it is being built in the executor. Callers leave out the internal
+    folders of a location root. Nothing touches the disk and the
+    archiving thread stops as soon as the client goes away. The bytes sent are
+    counted as downloaded from `location`, at the rate `transfer` allows.
+    """
+
+    async def streaming_fn(response) -> None:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+        cancelled = threading.Event()
+
+        def produce() -> None:
+            writer = io.BufferedWriter(_QueueWriter(loop, queue, cancelled), CHUNK_SIZE)
+            try:
+                _write_archive(writer, root, paths, ext)
+                writer.flush()
+            except ArchiveCancelled:
+                pass
+            finally:
+                if not cancelled.is_set():
+                    asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+
+        sent = 0
+        with stage("archive"):
+            async with transfer:
+                producer = loop.run_in_executor(None, produce)
+                try:
+                    while (chunk := await queue.get()) is not None:
+                        await transfer.throttle(len(chunk))
+                        await response.write(chunk)
+                        sent += len(chunk)
+                finally:
+                    cancelled.set()
+                    while not queue.empty():
+                        queue.get_nowait()
+                    await producer
+                    TRANSFERRED_BYTES.inc(sent, direction="download", location=location)
+
+    return ResponseStream(
+        streaming_fn,
+        headers={"Content-Disposition": f'Attachment; filename="{filename}"'},
+        content_type="application/zip" if ext == "zip" else "application/gzip",
+    )
@@ -1,10 +1,15 @@
+import time
+from collections import OrderedDict
 from functools import wraps
 from typing import Awaitable, Callable, Coroutine, TypedDict, Union
 
 import jwt
-from sanic.exceptions import Forbidden, InvalidUsage, Unauthorized
+from metrics import cache_lookup, stage
+from sanic.exceptions import Unauthorized
 from sanic.request import Request
 
+from .authorization import LocationIndex
+
 PermissionsDict = TypedDict(
     "PermissionsDict",
     {
@@ -30,40 +35,105 @@ JWTDict = TypedDict(
 )
 
 
+class TokenCache:
+    """
+    Bounded LRU of access tokens whose signature has already been verified.
+    Entries expire together with the token and are dropped for a user as
+    soon as their tokens get blacklisted.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, JWTDict] = OrderedDict()
+        self._by_uname: dict[str, set[str]] = {}
+
+    def get(self, token: str) -> Union[JWTDict, None]:
+        decoded = self._entries.get(token)
+        if decoded is None:
+            return None
+        if decoded["exp"] <= time.time():
+            self._remove(token)
+            return None
+
+        self._entries.move_to_end(token)
+        return decoded
+
+    def put(self, token: str, decoded: JWTDict) -> None:
+        if self.maxsize <= 0:
+            return
+
+        self._entries[token] = decoded
+        self._by_uname.setdefault(decoded["uname"], set()).add(token)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, uname: Union[str, None] = None) -> None:
+        if uname is None:
+            self._entries.clear()
+            self._by_uname.clear()
+            return
+
+        for token in self._by_uname.pop(uname, set()):
+            self._entries.pop(token, None)
+
+    def _remove(self, token: str) -> None:
+        decoded = self._entries.pop(token)
+        tokens = self._by_uname.get(decoded["uname"])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_uname[decoded["uname"]]
+
+
 async def _decode_token(
-    request: Request, return_value: bool = False
+    request: Request, return_value: bool = False, token: str = None
 ) -> Union[bool, str, JWTDict]:
-    if not request.token:
+    token = token or request.token
+    if not token:
         raise Unauthorized("Bearer authorization is required.", 401, "Bearer")
 
-    try:
-        decoded: JWTDict = jwt.decode(  # type: ignore
-            jwt=request.token,
-            key=request.app.config.ACCESS_TOKEN_SECRET,
-            algorithms=["HS256"],
-        )
-        is_blacklisted: bool = await request.app.ctx.tempdb.verify_jwt_blacklist(
-            decoded["uname"], decoded["iat"]
-        )
+    token_cache: TokenCache = request.app.ctx.token_cache
+    decoded = token_cache.get(token)
+    cache_lookup("jwt", decoded is not None)
+    if decoded is None:
+        try:
+            decoded = jwt.decode(  # type: ignore
+                jwt=token,
+                key=request.app.config.ACCESS_TOKEN_SECRET,
+                algorithms=["HS256"],
+            )
+        except jwt.exceptions.DecodeError:
+            raise Unauthorized(
+                "An error occurred while trying to decode the token.", 401
+            )
+        except jwt.exceptions.ExpiredSignatureError:
+            raise Unauthorized("This token has expired.", 401)
+
         if decoded["iss"] != "Bunsho":
             raise Unauthorized("Invalid token issuer.", 401)
-        if is_blacklisted:
-            raise Unauthorized("This token has been invalidated.", 401)
-        if return_value:
-            return decoded
-    except jwt.exceptions.DecodeError:
-        raise Unauthorized("An error occurred while trying to decode the token.", 401)
-    except jwt.exceptions.ExpiredSignatureError:
-        raise Unauthorized("This token has expired.", 401)
+        token_cache.put(token, decoded)
+
+    if request.app.ctx.tempdb.verify_jwt_blacklist(decoded["uname"], decoded["iat"]):
+        raise Unauthorized("This token has been invalidated.", 401)
+    await request.app.ctx.ratelimiter.limit_user(request, decoded["uname"])
+    if return_value:
+        return decoded
 
     return True
 
 
+async def authenticate(request: Request, token: str = None) -> JWTDict:
+    # For WebSockets, whose browser clients cannot set the Authorization
+    # header and send their token as the first message instead.
+    return await _decode_token(request, True, token)  # type: ignore
+
+
 def require_jwt(wrapped: Callable[..., Awaitable] = None, return_value: bool = False):
     def decorator(func: Callable[..., Awaitable]):
         @wraps(func)
         async def decorated_function(request: Request, *args, **kwargs):
-            auth_result = await _decode_token(request, return_value)
+            with stage("auth"):
+                auth_result = await _decode_token(request, return_value)
             if auth_result is True:
                 return await func(request, *args, **kwargs)
             if isinstance(auth_result, dict):
@@ -74,29 +144,19 @@ def require_jwt(wrapped: Callable[..., Awaitable] = None, return_value: bool = F
     return decorator(wrapped) if wrapped else decorator
 
 
-def check_authorized_dirs(wrapped: Callable[..., Coroutine]):
+def check_authorized_dirs(
+    wrapped: Callable[..., Coroutine] = None, permission: str = None
+):
     def decorator(func: Callable[..., Coroutine]):
         @wraps(func)
         async def decorated_function(request: Request, *args, **kwargs):
-            try:
-                location = request.app.config.LOCATIONS[int(kwargs["index"])]
-            except IndexError:
-                raise InvalidUsage("Location index was not provided.", 400)
-
-            jwt = kwargs["jwt"]
-            if (
-                isinstance(jwt["authorized_locations"], str)
-                and jwt["authorized_locations"] != "all"
-            ) or (
-                isinstance(jwt["authorized_locations"], list)
-                and location["name"] not in jwt["authorized_locations"]
-            ):
-                raise Forbidden(
-                    "Insufficient permissions to access this location.", 403
-                )
+            location_index: LocationIndex = request.app.config.LOCATION_INDEX
+            request.ctx.location = location_index.authorize(
+                kwargs["jwt"], int(kwargs["index"]), permission
+            )
 
             return await func(request, *args, **kwargs)
 
         return decorated_function
 
-    return decorator(wrapped)
+    return decorator(wrapped) if wrapped else decorator
@@ -0,0 +1,97 @@
+import os
+from typing import NamedTuple, Union
+
+from sanic.exceptions import Forbidden, InvalidUsage
+
+PERMISSIONS = ("admin", "write", "move", "delete", "share")
+PERMISSION_BITS = {name: 1 << bit for bit, name in enumerate(PERMISSIONS)}
+PERMISSION_ERRORS = {
+    "admin": "Insufficient permissions to perform administrator actions.",
+    "write": "Insufficient permissions to write files.",
+    "move": "Insufficient permissions to move files.",
+    "delete": "Insufficient permissions to delete files.",
+    "share": "Insufficient permissions to share files.",
+}
+
+
+class Location(NamedTuple):
+    index: int
+    name: str
+    dir: str
+
+
+class LocationIndex:
+    """
+    `LOCATIONS` compiled once per config load. Authorized locations and
+    permissions of a token are turned into bitmasks the first time they are
+    seen, so every later decision is a couple of integer operations.
+    """
+
+    def __init__(self, locations: list[dict]):
+        self.locations = tuple(
+            Location(index, location["name"], location["dir"])
+            for index, location in enumerate(locations)
+        )
+        self.by_name = {location.name: location for location in self.locations}
+        self._all = (1 << len(self.locations)) - 1
+        self._location_masks: dict[Union[str, tuple], int] = {}
+        self._permission_masks: dict[tuple, int] = {}
+
+    def __getitem__(self, index: int) -> Location:
+        if not 0 <= index < len(self.locations):
+            raise InvalidUsage("Location index was not provided.", 400)
+        return self.locations[index]
+
+    def locate(self, path: str) -> Union[Location, None]:
+        # The innermost location wins when locations are nested.
+        found = None
+        for location in self.locations:
+            root = os.path.normpath(location.dir)
+            if os.path.commonpath([root, path]) == root and (
+                found is None or len(root) > len(found.dir)
+            ):
+                found = location
+        return found
+
+    def location_mask(self, authorized_locations: Union[str, list]) -> int:
+        key = (
+            authorized_locations
+            if isinstance(authorized_locations, str)
+            else tuple(authorized_locations)
+        )
+        mask = self._location_masks.get(key)
+        if mask is None:
+            if isinstance(key, str):
+                mask = self._all if key == "all" else 0
+            else:
+                mask = 0
+                for name in key:
+                    if name in self.by_name:
+                        mask |= 1 << self.by_name[name].index
+            self._location_masks[key] = mask
+        return mask
+
+    def permission_mask(self, permissions: dict) -> int:
+        key = tuple(permissions.get(name, False) for name in PERMISSIONS)
+        mask = self._permission_masks.get(key)
+        if mask is None:
+            mask = 0
+            for name, granted in zip(PERMISSIONS, key):
+                if granted:
+                    mask |= PERMISSION_BITS[name]
+            self._permission_masks[key] = mask
+        return mask
+
+    def has_permission(self, jwt: dict, permission: str) -> bool:
+        return bool(
+            self.permission_mask(jwt["permissions"]) & PERMISSION_BITS[permission]
+        )
+
+    def authorize(self, jwt: dict, index: int, permission: str = None) -> Location:
+        location = self[index]
+        if not self.location_mask(jwt["authorized_locations"]) & (1 << index):
+            raise Forbidden("Insufficient permissions to access this location.", 403)
+        if permission and not self.has_permission(jwt, permission):
+            raise Forbidden(PERMISSION_ERRORS[permission], 403)
+
+        return location
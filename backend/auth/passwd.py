@@ -1,24 +1,107 @@
 import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Union
 
-from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
+from exceptions import ServerBusy
+from sanic.config import Config
 
+# Set inside every pool process so that the hasher is built only once. Argon2
+# itself is only imported there, the server processes never need it.
+_hasher: Any = None
 
-async def hash_passwd(passwd: str) -> str:
-    def _hash_passwd(passwd: str) -> str:
-        return PasswordHasher(salt_len=32).hash(passwd)
 
-    return await asyncio.get_running_loop().run_in_executor(None, _hash_passwd, passwd)
+def _init_hasher(time_cost: int, memory_cost: int, parallelism: int) -> None:
+    global _hasher
+    from argon2 import PasswordHasher
 
+    _hasher = PasswordHasher(
+        time_cost=time_cost,
+        memory_cost=memory_cost,
+        parallelism=parallelism,
+        salt_len=32,
+    )
 
-async def verify_passwd(hash_passwd: str, passwd: str) -> list[bool]:
-    def _verify_passwd(hash_passwd: str, passwd: str) -> list[bool]:
+
+def _hash_passwd(passwd: str) -> str:
+    return _hasher.hash(passwd)  # type: ignore
+
+
+def _verify_passwd(hash_passwd: str, passwd: str) -> list[bool]:
+    from argon2.exceptions import VerifyMismatchError
+
+    try:
+        _hasher.verify(hash_passwd, passwd)  # type: ignore
+        return [True, _hasher.check_needs_rehash(hash_passwd)]  # type: ignore
+    except VerifyMismatchError:
+        return [False, False]
+
+
+class PasswordPool:
+    """
+    Runs Argon2 in its own small process pool so that bursts of logins can
+    neither starve the default executor nor queue up without a bound.
+    """
+
+    def __init__(self):
+        self._executor: Union[ProcessPoolExecutor, None] = None
+        self._pid = 0
+        self._pending = 0
+        self.configure({})
+
+    def configure(self, config: Union[Config, dict]) -> None:
+        self.workers: int = config.get("ARGON2_WORKERS", 1)
+        self.max_queue: int = config.get("ARGON2_MAX_QUEUE", 32)
+        self.params: tuple[int, int, int] = (
+            config.get("ARGON2_TIME_COST", 2),
+            config.get("ARGON2_MEMORY_COST", 102400),
+            config.get("ARGON2_PARALLELISM", 8),
+        )
+        self.shutdown()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def shutdown(self) -> None:
+        if self._executor and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # A pool inherited from the main process through fork cannot be used.
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=_init_hasher,
+                initargs=self.params,
+            )
+            self._pid = os.getpid()
+        return self._executor
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        if self._pending >= self.max_queue:
+            raise ServerBusy(
+                "Too many logins are being processed, please try again later.", 5
+            )
+
+        self._pending += 1
         try:
-            PasswordHasher(salt_len=32).verify(hash_passwd, passwd)
-            return [True, PasswordHasher(salt_len=32).check_needs_rehash(hash_passwd)]
-        except VerifyMismatchError:
-            return [False, False]
+            return await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), func, *args
+            )
+        finally:
+            self._pending -= 1
 
-    return await asyncio.get_running_loop().run_in_executor(
-        None, _verify_passwd, hash_passwd, passwd
-    )
+
+pool = PasswordPool()
+
+
+async def hash_passwd(passwd: str) -> str:
+    return await pool.run(_hash_passwd, passwd)
+
+
+async def verify_passwd(hash_passwd: str, passwd: str) -> list[bool]:
+    return await pool.run(_verify_passwd, hash_passwd, passwd)
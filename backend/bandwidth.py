@@ -0,0 +1,142 @@
+import asyncio
+import math
+import os
+import time
+from collections import Counter
+from typing import Union
+
+from sanic.config import Config
+
+from database.ephemeral import EphemeralBackend
+
+# How far a transfer may get ahead of its rate after idling, in seconds.
+BURST_SECONDS = 0.25
+SYNC_INTERVAL = 1
+# Downloads through share links are limited together as this user.
+ANONYMOUS = ""
+
+
+class Transfer:
+    """
+    A token bucket for one running download or upload. Its rate is set by the
+    scheduler, which recomputes it whenever transfers start or stop.
+    """
+
+    def __init__(self, scheduler: "BandwidthScheduler", uname: str, permissions: dict):
+        self.uname = uname
+        self.permissions = permissions
+        self.rate = math.inf
+        self._scheduler = scheduler
+        self._allowance = 0.0
+        self._last = 0.0
+
+    async def __aenter__(self) -> "Transfer":
+        self._last = time.monotonic()
+        self._scheduler.add(self)
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        self._scheduler.remove(self)
+
+    async def throttle(self, nbytes: int) -> None:
+        if self.rate == math.inf:
+            return
+
+        now = time.monotonic()
+        self._allowance = min(
+            self._allowance + (now - self._last) * self.rate,
+            self.rate * BURST_SECONDS,
+        )
+        self._last = now
+        self._allowance -= nbytes
+        if self._allowance < 0:
+            await asyncio.sleep(-self._allowance / self.rate)
+
+
+class BandwidthScheduler:
+    """
+    Splits `BANDWIDTH_LIMIT` evenly across every running transfer, except that
+    no user gets more than their own limit. Whatever a capped user leaves over
+    goes to the others. Workers share how many transfers each user has running,
+    so the limits hold for the whole server and not per worker.
+    """
+
+    def __init__(self, config: Config):
+        self._config = config
+        self._transfers: dict[str, set[Transfer]] = {}
+        self._remote: Counter[str] = Counter()
+        self._published = False
+
+    def transfer(self, jwt: Union[dict, None]) -> Transfer:
+        if jwt is None:
+            return Transfer(self, ANONYMOUS, {})
+        return Transfer(self, jwt["uname"], jwt["permissions"])
+
+    def add(self, transfer: Transfer) -> None:
+        self._transfers.setdefault(transfer.uname, set()).add(transfer)
+        self.rebalance()
+
+    def remove(self, transfer: Transfer) -> None:
+        transfers = self._transfers.get(transfer.uname, set())
+        transfers.discard(transfer)
+        if not transfers:
+            self._transfers.pop(transfer.uname, None)
+        self.rebalance()
+
+    def user_limit(self, uname: str, permissions: dict) -> float:
+        users = self._config.get("USER_BANDWIDTH_LIMITS", {})
+        if uname in users:
+            return users[uname] or math.inf
+
+        tiers = [
+            limit
+            for permission, limit in self._config.get("BANDWIDTH_TIERS", {}).items()
+            if permissions.get(permission)
+        ]
+        if tiers:
+            return math.inf if 0 in tiers else max(tiers)
+        return self._config.get("USER_BANDWIDTH_LIMIT") or math.inf
+
+    def rebalance(self) -> None:
+        local = sum(len(transfers) for transfers in self._transfers.values())
+        if not local:
+            return
+
+        # This worker's part of the limits, by its share of the transfers.
+        capacity = (self._config.get("BANDWIDTH_LIMIT") or math.inf) * (
+            local / (local + sum(self._remote.values()))
+        )
+        groups = []
+        for uname, transfers in self._transfers.items():
+            count = len(transfers)
+            limit = self.user_limit(uname, next(iter(transfers)).permissions)
+            groups.append((limit / (count + self._remote[uname]), count, transfers))
+
+        # Water filling: users capped below the fair rate keep their cap and
+        # the others split the remaining capacity evenly between transfers.
+        groups.sort(key=lambda group: group[0])
+        for capped, count, transfers in groups:
+            rate = min(capped, capacity / local)
+            for transfer in transfers:
+                transfer.rate = rate
+            if rate != math.inf:
+                capacity -= rate * count
+            local -= count
+
+    async def sync_task(self, backend: EphemeralBackend) -> None:
+        pid = str(os.getpid())
+        while True:
+            counts = {
+                uname: len(transfers) for uname, transfers in self._transfers.items()
+            }
+            if counts or self._published:
+                await backend.set("bandwidth", pid, counts, SYNC_INTERVAL * 5)
+                self._published = bool(counts)
+
+            self._remote = Counter()
+            for worker, remote in backend.items("bandwidth"):
+                if worker != pid:
+                    self._remote.update(remote)
+            self.rebalance()
+
+            await asyncio.sleep(SYNC_INTERVAL)
@@ -0,0 +1,88 @@
+"""
+Measures the per-request cost of `_decode_token` with and without the
+verified-token cache. Run from the backend folder:
+
+    $ python -m benchmarks.auth_overhead --requests 100000
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import jwt
+import ujson
+from auth.authentication import TokenCache, _decode_token
+from database.ephemeral import MemoryBackend
+from database.tempdb import TempDBInterface
+
+
+class NoRateLimits:
+    # Left out, thousands of requests from one user would only hit the limit.
+    async def limit_user(self, request, uname: str) -> None:
+        pass
+
+
+def make_request(token: str, cache_size: int) -> SimpleNamespace:
+    return SimpleNamespace(
+        token=token,
+        app=SimpleNamespace(
+            config=SimpleNamespace(ACCESS_TOKEN_SECRET="benchmark"),
+            ctx=SimpleNamespace(
+                tempdb=TempDBInterface(MemoryBackend()),
+                token_cache=TokenCache(cache_size),
+                ratelimiter=NoRateLimits(),
+            ),
+        ),
+    )
+
+
+async def measure(token: str, cache_size: int, requests: int) -> float:
+    request = make_request(token, cache_size)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await _decode_token(request, True)  # type: ignore
+    return (time.perf_counter() - start) / requests
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=50000)
+    args = parser.parse_args()
+
+    token = jwt.encode(
+        {
+            "iat": datetime.now(tz=timezone.utc),
+            "exp": datetime.now(tz=timezone.utc) + timedelta(minutes=15),
+            "iss": "Bunsho",
+            "uname": "admin",
+            "authorized_locations": "all",
+            "permissions": {
+                "admin": True,
+                "write": True,
+                "move": True,
+                "delete": True,
+                "share": True,
+            },
+        },
+        "benchmark",
+        algorithm="HS256",
+    )
+    uncached = await measure(token, 0, args.requests)
+    cached = await measure(token, 4096, args.requests)
+    print(
+        ujson.dumps(
+            {
+                "requests": args.requests,
+                "uncached_us": round(uncached * 1e6, 3),
+                "cached_us": round(cached * 1e6, 3),
+                "speedup": round(uncached / cached, 2),
+            },
+            indent=4,
+        )
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
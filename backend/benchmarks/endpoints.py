@@ -0,0 +1,417 @@
+"""
+Starts Bunsho against a generated config, synthetic locations and a fresh
+database, drives concurrent load against its hot endpoints and prints the
+throughput, p50/p99 latency and memory of every scenario as JSON. Run from
+the backend folder:
+
+    $ python -m benchmarks.endpoints --concurrency 16 --output results.json
+
+Results are only comparable between runs on the same machine.
+"""
+
+import argparse
+import asyncio
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable, Union
+from urllib.parse import quote
+
+import ujson
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+CHUNK_SIZE = 262144
+SCENARIOS = ("login", "access-token", "ls", "download", "archive", "upload")
+
+
+class Response:
+    def __init__(self, status: int, headers: dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class Connection:
+    """
+    A minimal keep-alive HTTP/1.1 client, so that the benchmark has no
+    dependencies beyond what Bunsho itself needs.
+    """
+
+    def __init__(self, port: int):
+        self.port = port
+        self._reader: Union[asyncio.StreamReader, None] = None
+        self._writer: Union[asyncio.StreamWriter, None] = None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        headers: dict[str, str] = None,
+        body: Union[bytes, int] = b"",
+    ) -> Response:
+        """
+        Sends a request. An integer `body` streams that many bytes in chunks
+        instead of building the whole body in memory.
+        """
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(
+                "127.0.0.1", self.port
+            )
+
+        length = body if isinstance(body, int) else len(body)
+        head = f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: {length}\r\n"
+        for name, value in (headers or {}).items():
+            head += f"{name}: {value}\r\n"
+        self._writer.write(f"{head}\r\n".encode())
+        if isinstance(body, int):
+            chunk = b"\0" * CHUNK_SIZE
+            while body > 0:
+                self._writer.write(chunk[:body])
+                body -= CHUNK_SIZE
+                await self._writer.drain()
+        else:
+            self._writer.write(body)
+        await self._writer.drain()
+
+        status_line, *header_lines = (
+            (await self._reader.readuntil(b"\r\n\r\n")).decode().split("\r\n")
+        )
+        response_headers = {}
+        for line in header_lines:
+            if line:
+                name, _, value = line.partition(":")
+                response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get("transfer-encoding") == "chunked":
+            response_body = bytearray()
+            while size := int((await self._reader.readline()).strip(), 16):
+                response_body += await self._reader.readexactly(size)
+                await self._reader.readexactly(2)
+            await self._reader.readexactly(2)
+        else:
+            response_body = await self._reader.readexactly(
+                int(response_headers.get("content-length", 0))
+            )
+
+        if response_headers.get("connection") == "close":
+            await self.close()
+        return Response(
+            int(status_line.split()[1]), response_headers, bytes(response_body)
+        )
+
+    async def close(self) -> None:
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def generate_tree(root: str, files: int, file_size: int, large_size: int) -> None:
+    # A folder for listing and archiving, spread over a few subfolders.
+    for i in range(files):
+        folder = os.path.join(root, "tree", f"folder-{i % 8}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"file-{i}.txt"), "wb") as f:
+            f.write(os.urandom(file_size // 2).hex().encode())
+
+    with open(os.path.join(root, "large.bin"), "wb") as f:
+        for _ in range(0, large_size, CHUNK_SIZE):
+            f.write(os.urandom(CHUNK_SIZE))
+    os.makedirs(os.path.join(root, "uploads"))
+
+
+def start_server(
+    root: str, location: str, port: int, dev: bool, extra: dict = None
+) -> subprocess.Popen:
+    """
+    Starts the server with its database, temporary files and config in
+    `root`, serving `location`.
+    """
+    config = {
+        "DEV_MODE": dev,
+        "ENABLE_OPENAPI": False,
+        "HOST": "127.0.0.1",
+        "PORT": port,
+        "ACCESS_TOKEN_SECRET": "benchmark-access",
+        "REFRESH_TOKEN_SECRET": "benchmark-refresh",
+        "DATABASE_PATH": os.path.join(root, "bunsho.db"),
+        "TMP_FOLDER": os.path.join(root, "tmp"),
+        "LOCATIONS": [{"name": "Benchmark", "dir": location}],
+        # The scenarios send far more requests than any real client would.
+        "RATE_LIMITS": {"auth": None, "listing": None, "transfer": None},
+        **(extra or {}),
+    }
+    with open(os.path.join(root, "config.json"), "w", encoding="utf8") as f:
+        ujson.dump(config, f)
+
+    return subprocess.Popen(
+        [sys.executable, "main.py"],
+        cwd=BACKEND,
+        env={**os.environ, "BUNSHO_CONFIG": os.path.join(root, "config.json")},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BACKEND,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except FileNotFoundError:
+        commit = None
+
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def process_tree(pid: int) -> list[int]:
+    children: dict[int, list[int]] = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (FileNotFoundError, ProcessLookupError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+
+    pids = [pid]
+    for current in pids:
+        pids.extend(children.get(current, []))
+    return pids
+
+
+def memory(pid: int) -> dict[str, float]:
+    """Resident and peak resident memory in MB of the server and its children."""
+    totals = {"VmRSS": 0, "VmHWM": 0}
+    for current in process_tree(pid):
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    name, _, value = line.partition(":")
+                    if name in totals:
+                        totals[name] += int(value.split()[0])
+        except FileNotFoundError:
+            continue
+    return {
+        "rss_mb": round(totals["VmRSS"] / 1024, 1),
+        "peak_rss_mb": round(totals["VmHWM"] / 1024, 1),
+    }
+
+
+async def wait_until_ready(
+    port: int, server: subprocess.Popen, interval: float = 0.1
+) -> None:
+    for _ in range(int(30 / interval)):
+        if server.poll() is not None:
+            raise RuntimeError("The server exited before it started listening.")
+        try:
+            connection = Connection(port)
+            await connection.request("GET", "/api/core/ls/0/")
+            await connection.close()
+            return
+        except OSError:
+            await asyncio.sleep(interval)
+    raise RuntimeError("The server did not start in time.")
+
+
+async def login(connection: Connection) -> tuple[str, str]:
+    response = await connection.request(
+        "POST", "/api/auth/refresh-token", body=b'{"uname":"admin","passwd":"admin"}'
+    )
+    if response.status != 200:
+        raise RuntimeError(f"Logging in failed with status {response.status}.")
+    refresh_token = response.headers["set-cookie"].split(";")[0]
+    return refresh_token, ujson.loads(response.body)["access-token"]
+
+
+async def run_scenario(
+    port: int,
+    concurrency: int,
+    requests: int,
+    send: Callable[[Connection, int], Awaitable[tuple[Response, int]]],
+) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    transferred = 0
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors, transferred
+        connection = Connection(port)
+        try:
+            for i in counter:
+                start = time.perf_counter()
+                try:
+                    response, size = await send(connection, i)
+                except (OSError, asyncio.IncompleteReadError):
+                    await connection.close()
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+                if response.status >= 400:
+                    errors += 1
+                transferred += size
+        finally:
+            await connection.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "throughput_mb_s": round(transferred / elapsed / 1048576, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2)
+        if latencies
+        else None,
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2)
+        if latencies
+        else None,
+    }
+
+
+async def benchmark(
+    args: argparse.Namespace, port: int, server: subprocess.Popen
+) -> dict:
+    await wait_until_ready(port, server)
+    connection = Connection(port)
+    refresh_token, access_token = await login(connection)
+    await connection.close()
+    auth = {"Authorization": f"Bearer {access_token}"}
+
+    async def send_login(connection: Connection, _: int):
+        response = await connection.request(
+            "POST",
+            "/api/auth/refresh-token",
+            body=b'{"uname":"admin","passwd":"admin"}',
+        )
+        return response, 0
+
+    async def send_access_token(connection: Connection, _: int):
+        response = await connection.request(
+            "POST", "/api/auth/access-token", {"Cookie": refresh_token}
+        )
+        return response, 0
+
+    async def send_ls(connection: Connection, i: int):
+        response = await connection.request(
+            "GET", f"/api/core/ls/0/tree/folder-{i % 8}", auth
+        )
+        return response, len(response.body)
+
+    async def send_download(connection: Connection, _: int):
+        response = await connection.request(
+            "GET", "/api/download/single/0/large.bin", auth
+        )
+        return response, len(response.body)
+
+    async def send_archive(connection: Connection, _: int):
+        response = await connection.request(
+            "GET", "/api/download/folder/0/tree?ext=zip", auth
+        )
+        return response, len(response.body)
+
+    async def send_upload(connection: Connection, i: int):
+        response = await connection.request(
+            "POST",
+            "/api/upload/file-metadata",
+            auth,
+            ujson.dumps(
+                {"location": "Benchmark", "folder": "uploads", "filename": f"{i}.bin"}
+            ).encode(),
+        )
+        if response.status != 200:
+            return response, 0
+        response = await connection.request(
+            "PUT",
+            f"/api/upload/file?uuid={quote(ujson.loads(response.body)['uuid'])}",
+            auth,
+            args.upload_size,
+        )
+        return response, args.upload_size
+
+    senders = {
+        "login": send_login,
+        "access-token": send_access_token,
+        "ls": send_ls,
+        "download": send_download,
+        "archive": send_archive,
+        "upload": send_upload,
+    }
+    results = {}
+    for name in args.scenarios:
+        # Password hashing is deliberately slow, so fewer logins are enough.
+        requests = max(args.requests // 20, 1) if name == "login" else args.requests
+        if name in ("download", "archive", "upload"):
+            requests = max(args.requests // 10, 1)
+        results[name] = {
+            **await run_scenario(port, args.concurrency, requests, senders[name]),
+            **memory(server.pid),
+        }
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--files", type=int, default=400)
+    parser.add_argument("--file-size", type=int, default=16384)
+    parser.add_argument("--large-size", type=int, default=67108864)
+    parser.add_argument("--upload-size", type=int, default=16777216)
+    parser.add_argument("--dev", action="store_true", help="Run a single worker.")
+    parser.add_argument("--output", help="Write the results to a file as well.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bunsho-benchmark-") as root:
+        location = os.path.join(root, "location")
+        generate_tree(location, args.files, args.file_size, args.large_size)
+        port = free_port()
+        server = start_server(
+            root, location, port, args.dev, {"REQUEST_MAX_SIZE": args.upload_size * 2}
+        )
+        try:
+            scenarios = asyncio.run(benchmark(args, port, server))
+        finally:
+            server.terminate()
+            server.wait(30)
+
+    results = {
+        **environment(),
+        "workers": 1 if args.dev else os.cpu_count(),
+        "scenarios": scenarios,
+    }
+    output = ujson.dumps(results, indent=4)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
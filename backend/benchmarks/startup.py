@@ -0,0 +1,108 @@
+"""
+Reports where the server's startup time goes: the slowest imports of
+`main.py` and how long a restart takes, from launching the process until a
+request is answered, as systemd would see it. Run from the backend folder:
+
+    $ python -m benchmarks.startup --runs 5
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import ujson
+
+from benchmarks.endpoints import (
+    BACKEND,
+    environment,
+    free_port,
+    start_server,
+    wait_until_ready,
+)
+
+
+def import_times(top: int) -> list[dict]:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND,
+        capture_output=True,
+        text=True,
+    ).stderr
+
+    # Modules are listed after everything they import, so the direct imports
+    # of main.py are the least indented lines right before it. Their own
+    # imports are included in their cumulative time.
+    modules = []
+    for line in stderr.splitlines():
+        _, cumulative, name = line.split("|") if line.count("|") == 2 else ("", "", "")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = len(name) - len(name.lstrip())
+        if depth == 1 and name.strip() == "main":
+            break
+        if depth == 1:
+            modules = []
+        elif depth == 3:
+            modules.append({"module": name.strip(), "ms": int(cumulative) / 1000})
+
+    modules.sort(key=lambda module: module["ms"], reverse=True)
+    return modules[:top]
+
+
+def restart(root: str, location: str, dev: bool) -> dict:
+    port = free_port()
+    start = time.perf_counter()
+    server = start_server(root, location, port, dev)
+    try:
+        asyncio.run(wait_until_ready(port, server, 0.01))
+        ready = time.perf_counter() - start
+    finally:
+        stopping = time.perf_counter()
+        server.terminate()
+        server.wait(30)
+    return {
+        "ready_ms": ready * 1000,
+        "stop_ms": (time.perf_counter() - stopping) * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--dev", action="store_true", help="Run a single worker.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bunsho-benchmark-") as root:
+        location = os.path.join(root, "location")
+        os.makedirs(location)
+        # The first start also creates the database and the frontend cache.
+        first = restart(root, location, args.dev)
+        runs = [restart(root, location, args.dev) for _ in range(args.runs)]
+
+    print(
+        ujson.dumps(
+            {
+                **environment(),
+                "first_start_ms": round(first["ready_ms"], 1),
+                "restart_to_ready_ms": {
+                    "median": round(statistics.median(i["ready_ms"] for i in runs), 1),
+                    "max": round(max(i["ready_ms"] for i in runs), 1),
+                },
+                "stop_ms": round(statistics.median(i["stop_ms"] for i in runs), 1),
+                "imports": import_times(args.top),
+            },
+            indent=4,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import asyncio
+import gzip
+from typing import Iterable, Union
+
+from sanic import Sanic
+from sanic.request import Request
+from sanic.response import HTTPResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/vnd.bunsho.",
+    "application/msgpack",
+    "application/x-msgpack",
+    "application/javascript",
+    "application/xml",
+    "application/wasm",
+    "image/svg+xml",
+)
+
+
+def available_encodings() -> list[str]:
+    # Ordered by preference when the client accepts several of them.
+    encodings = []
+    if zstandard:
+        encodings.append("zstd")
+    if brotli:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def is_compressible(content_type: Union[str, None]) -> bool:
+    return bool(content_type) and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def negotiate(
+    accept_encoding: Union[str, None], offered: Iterable[str]
+) -> Union[str, None]:
+    if not accept_encoding:
+        return None
+
+    accepted: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    best = None
+    best_quality = 0.0
+    for encoding in offered:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data: bytes, encoding: str, best: bool = False) -> bytes:
+    """
+    Compresses `data`. `best` trades a lot of CPU time for the smallest
+    output, which only pays off for content that is compressed once.
+    """
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=19 if best else 3).compress(data)
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if best else 4)
+    if encoding == "gzip":
+        return gzip.compress(data, 9 if best else 6, mtime=0)
+    raise ValueError(f"Unknown content encoding: {encoding}")
+
+
+class ResponseCompression:
+    """
+    Compresses large API responses with the best encoding the client
+    accepts. Bodies above `COMPRESSION_OFFLOAD_SIZE` are compressed in the
+    executor so that the event loop keeps serving other requests.
+    """
+
+    def __init__(self, app: Sanic):
+        self._app = app
+        app.register_middleware(self.compress_response, "response")
+
+    async def compress_response(self, request: Request, response: HTTPResponse) -> None:
+        config = self._app.config
+        body = getattr(response, "body", None)
+        if (
+            not config.get("COMPRESS_RESPONSES", True)
+            or not request.path.startswith("/api/")
+            or not isinstance(body, bytes)
+            or len(body) < config.get("COMPRESSION_MIN_SIZE", 1024)
+            or "Content-Encoding" in response.headers
+            or not is_compressible(response.content_type)
+        ):
+            return
+
+        encoding = negotiate(
+            request.headers.get("Accept-Encoding"), available_encodings()
+        )
+        if not encoding:
+            return
+
+        if len(body) >= config.get("COMPRESSION_OFFLOAD_SIZE", 65536):
+            compressed = await asyncio.get_running_loop().run_in_executor(
+                None, compress, body, encoding
+            )
+        else:
+            compressed = compress(body, encoding)
+
+        response.body = compressed
+        response.headers["Content-Encoding"] = encoding
+        response.headers.pop("Content-Length", None)
+        vary = response.headers.get("Vary")
+        response.headers["Vary"] = (
+            f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+        )
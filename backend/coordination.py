@@ -0,0 +1,66 @@
+import asyncio
+import fcntl
+import os
+from typing import Any, Awaitable, Callable
+
+from sanic import Sanic
+from sanic.log import logger
+
+from database.ephemeral import EphemeralBackend
+from utils import BunshoConfig, load_config
+
+
+class Coordinator:
+    """
+    Keeps the `fast=True` workers in agreement. Config reloads and cache
+    invalidations are broadcast over the ephemeral backend, and periodic
+    maintenance tasks only run in the worker that holds their leader lock.
+    """
+
+    def __init__(self, app: Sanic, backend: EphemeralBackend):
+        self._app = app
+        self._backend = backend
+        self._invalidators: dict[str, list[Callable[[Any], Any]]] = {}
+        backend.subscribe("config", self._on_config)
+        backend.subscribe("invalidate", self._on_invalidate)
+
+    async def reload_config(self) -> None:
+        # Parsed and validated once here, the other workers only apply it.
+        await self._backend.publish(
+            "config", {"origin": os.getpid(), "config": load_config()}
+        )
+
+    def on_invalidate(self, cache: str, callback: Callable[[Any], Any]) -> None:
+        self._invalidators.setdefault(cache, []).append(callback)
+
+    async def invalidate(self, cache: str, key: Any = None) -> None:
+        await self._backend.publish("invalidate", {"cache": cache, "key": key})
+
+    def _on_config(self, message: dict) -> None:
+        self._app.update_config(BunshoConfig(message["config"]))
+        logger.info(
+            f"[Worker]: Reloaded configuration (requested by {message['origin']})"
+        )
+        self._on_invalidate({"cache": "config", "key": None})
+
+    def _on_invalidate(self, message: dict) -> None:
+        for callback in self._invalidators.get(message["cache"], []):
+            callback(message["key"])
+
+    async def leader_task(
+        self, name: str, task: Callable[[], Awaitable], retry_interval: float = 5
+    ) -> None:
+        lock_path = os.path.join(self._app.ctx.tmp_folder, f"{name}.lock")
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(retry_interval)
+
+            logger.info(f"[Worker]: Became the leader for {name}")
+            await task()
+        finally:
+            os.close(fd)
@@ -1,4 +1,5 @@
+from .ephemeral import EphemeralServer
 from .interface import SQLiteInterface
 from .tempdb import TempDBInterface
 
-__all__ = ["SQLiteInterface", "TempDBInterface"]
+__all__ = ["EphemeralServer", "SQLiteInterface", "TempDBInterface"]
@@ -0,0 +1,318 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Optional, Union
+
+import ujson
+from sanic.log import logger
+
+STREAM_LIMIT = 16 * 1024 * 1024
+
+
+class MemoryStore:
+    def __init__(self):
+        self._data: dict[str, dict[str, tuple[Any, Optional[float]]]] = {}
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        entry = self._data.get(namespace, {}).get(key)
+        if entry is None:
+            return default
+        if entry[1] is not None and entry[1] <= time.time():
+            del self._data[namespace][key]
+            return default
+        return entry[0]
+
+    def set(
+        self, namespace: str, key: str, value: Any, expiry: Optional[float] = None
+    ) -> None:
+        self._data.setdefault(namespace, {})[key] = (value, expiry)
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._data.get(namespace, {}).pop(key, None)
+
+    def incr(
+        self, namespace: str, key: str, amount: int, expiry: Optional[float] = None
+    ) -> int:
+        # Increments commute, so every replica ends up with the same count no
+        # matter in which order the workers' increments reach it.
+        value = self.get(namespace, key)
+        if value is None:
+            self.set(namespace, key, amount, expiry)
+            return amount
+        self._data[namespace][key] = (value + amount, self._data[namespace][key][1])
+        return value + amount
+
+    def items(self, namespace: str) -> list[tuple[str, Any]]:
+        now = time.time()
+        return [
+            (key, entry[0])
+            for key, entry in list(self._data.get(namespace, {}).items())
+            if entry[1] is None or entry[1] > now
+        ]
+
+    def sweep(self) -> int:
+        now = time.time()
+        swept = 0
+        for entries in self._data.values():
+            for key in [
+                key
+                for key, entry in entries.items()
+                if entry[1] is not None and entry[1] <= now
+            ]:
+                del entries[key]
+                swept += 1
+        return swept
+
+    def snapshot(self) -> dict[str, dict[str, list]]:
+        self.sweep()
+        return {
+            namespace: {key: [*entry] for key, entry in entries.items()}
+            for namespace, entries in self._data.items()
+        }
+
+    def load(self, snapshot: dict[str, dict[str, list]]) -> None:
+        self._data = {
+            namespace: {key: (entry[0], entry[1]) for key, entry in entries.items()}
+            for namespace, entries in snapshot.items()
+        }
+
+
+class EphemeralBackend(ABC):
+    def __init__(self):
+        self.store = MemoryStore()
+        self._subscribers: dict[str, list[Callable[[Any], Any]]] = {}
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        return self.store.get(namespace, key, default)
+
+    def items(self, namespace: str) -> list[tuple[str, Any]]:
+        return self.store.items(namespace)
+
+    def subscribe(self, channel: str, callback: Callable[[Any], Any]) -> None:
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    def _dispatch(self, channel: str, message: Any) -> None:
+        for callback in self._subscribers.get(channel, []):
+            try:
+                result = callback(message)
+                if asyncio.iscoroutine(result):
+                    asyncio.get_running_loop().create_task(result)
+            except Exception:
+                logger.exception(f"[Ephemeral]: Subscriber of {channel} failed")
+
+    @abstractmethod
+    async def set(
+        self, namespace: str, key: str, value: Any, ttl: Optional[float] = None
+    ) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, namespace: str, key: str) -> None:
+        ...
+
+    @abstractmethod
+    async def incr(
+        self, namespace: str, key: str, amount: int = 1, ttl: Optional[float] = None
+    ) -> int:
+        ...
+
+    @abstractmethod
+    async def publish(self, channel: str, message: Any) -> None:
+        ...
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class MemoryBackend(EphemeralBackend):
+    async def set(
+        self, namespace: str, key: str, value: Any, ttl: Optional[float] = None
+    ) -> None:
+        self.store.set(namespace, key, value, time.time() + ttl if ttl else None)
+
+    async def delete(self, namespace: str, key: str) -> None:
+        self.store.delete(namespace, key)
+
+    async def incr(
+        self, namespace: str, key: str, amount: int = 1, ttl: Optional[float] = None
+    ) -> int:
+        return self.store.incr(
+            namespace, key, amount, time.time() + ttl if ttl else None
+        )
+
+    async def publish(self, channel: str, message: Any) -> None:
+        self._dispatch(channel, message)
+
+    async def start(self) -> None:
+        self._sweeper = asyncio.get_running_loop().create_task(self._sweep_task())
+
+    async def stop(self) -> None:
+        self._sweeper.cancel()
+
+    async def _sweep_task(self) -> None:
+        while True:
+            await asyncio.sleep(30)
+            self.store.sweep()
+
+
+class SocketBackend(EphemeralBackend):
+    """
+    Keeps a full replica of the store in the worker so reads never leave the
+    process. Writes are applied locally and sent to the `EphemeralServer`,
+    which relays them to every other worker.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self._path = path
+        self._writer: Union[asyncio.StreamWriter, None] = None
+        self._connected = asyncio.Event()
+
+    async def start(self) -> None:
+        self._reader_task = asyncio.get_running_loop().create_task(self._read_task())
+        try:
+            await asyncio.wait_for(self._connected.wait(), 5)
+        except asyncio.TimeoutError:
+            logger.warning("[Ephemeral]: Shared state server is not reachable yet")
+
+    async def stop(self) -> None:
+        self._reader_task.cancel()
+        if self._writer:
+            self._writer.close()
+
+    async def set(
+        self, namespace: str, key: str, value: Any, ttl: Optional[float] = None
+    ) -> None:
+        expiry = time.time() + ttl if ttl else None
+        self.store.set(namespace, key, value, expiry)
+        await self._send(
+            {"op": "set", "ns": namespace, "key": key, "value": value, "exp": expiry}
+        )
+
+    async def delete(self, namespace: str, key: str) -> None:
+        self.store.delete(namespace, key)
+        await self._send({"op": "delete", "ns": namespace, "key": key})
+
+    async def incr(
+        self, namespace: str, key: str, amount: int = 1, ttl: Optional[float] = None
+    ) -> int:
+        expiry = time.time() + ttl if ttl else None
+        value = self.store.incr(namespace, key, amount, expiry)
+        await self._send(
+            {"op": "incr", "ns": namespace, "key": key, "amount": amount, "exp": expiry}
+        )
+        return value
+
+    async def publish(self, channel: str, message: Any) -> None:
+        self._dispatch(channel, message)
+        await self._send({"op": "publish", "channel": channel, "message": message})
+
+    async def _send(self, op: dict) -> None:
+        if not self._writer:
+            logger.warning(
+                f"[Ephemeral]: Not connected, {op['op']} was only applied locally"
+            )
+            return
+        self._writer.write(ujson.dumps(op).encode() + b"\n")
+        await self._writer.drain()
+
+    def _apply(self, op: dict) -> None:
+        if op["op"] == "set":
+            self.store.set(op["ns"], op["key"], op["value"], op["exp"])
+        elif op["op"] == "delete":
+            self.store.delete(op["ns"], op["key"])
+        elif op["op"] == "incr":
+            self.store.incr(op["ns"], op["key"], op["amount"], op["exp"])
+        elif op["op"] == "publish":
+            self._dispatch(op["channel"], op["message"])
+        elif op["op"] == "snapshot":
+            self.store.load(op["data"])
+            self._connected.set()
+
+    async def _read_task(self) -> None:
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(
+                    self._path, limit=STREAM_LIMIT
+                )
+                while line := await reader.readline():
+                    self._apply(ujson.loads(line))
+                logger.warning("[Ephemeral]: Shared state server closed the connection")
+            except (ConnectionError, FileNotFoundError):
+                pass
+            self._writer = None
+            self._connected.clear()
+            await asyncio.sleep(0.5)
+
+
+class EphemeralServer:
+    def __init__(self, path: str):
+        self._path = path
+        self._process: Union[multiprocessing.process.BaseProcess, None] = None
+
+    def start(self) -> None:
+        if os.path.exists(self._path):
+            os.remove(self._path)
+        self._process = multiprocessing.get_context("fork").Process(
+            target=self._run, name="bunsho-ephemeral", daemon=True
+        )
+        self._process.start()
+        deadline = time.monotonic() + 5
+        while not os.path.exists(self._path):
+            if time.monotonic() > deadline:
+                raise RuntimeError("The shared state server failed to start.")
+            time.sleep(0.01)
+
+    def stop(self) -> None:
+        if self._process and self._process.is_alive():
+            self._process.terminate()
+            self._process.join(5)
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+
+    def _run(self) -> None:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        asyncio.run(self._serve())
+
+    async def _serve(self) -> None:
+        store = MemoryStore()
+        clients: set[asyncio.StreamWriter] = set()
+
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            writer.write(
+                ujson.dumps({"op": "snapshot", "data": store.snapshot()}).encode()
+                + b"\n"
+            )
+            clients.add(writer)
+            try:
+                while line := await reader.readline():
+                    op = ujson.loads(line)
+                    if op["op"] == "set":
+                        store.set(op["ns"], op["key"], op["value"], op["exp"])
+                    elif op["op"] == "delete":
+                        store.delete(op["ns"], op["key"])
+                    elif op["op"] == "incr":
+                        store.incr(op["ns"], op["key"], op["amount"], op["exp"])
+                    for client in [*clients]:
+                        if client is not writer:
+                            client.write(line)
+            except ConnectionError:
+                pass
+            finally:
+                clients.discard(writer)
+                writer.close()
+
+        server = await asyncio.start_unix_server(handle, self._path, limit=STREAM_LIMIT)
+        async with server:
+            while True:
+                await asyncio.sleep(30)
+                store.sweep()
@@ -5,6 +5,51 @@ import ujson
 from auth.passwd import hash_passwd
 
 
+async def upgrade_db(db: aiosqlite.Connection):
+    # Tables added after the first release, created in existing databases too.
+    await db.execute(
+        dedent(
+            """
+            CREATE TABLE IF NOT EXISTS shares (
+                code TEXT NOT NULL PRIMARY KEY,
+                location TEXT NOT NULL,
+                path TEXT NOT NULL,
+                uname TEXT NOT NULL,
+                created INTEGER NOT NULL,
+                expiry INTEGER,
+                max_downloads INTEGER,
+                downloads INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY (uname)
+                REFERENCES auth (uname)
+                    ON UPDATE CASCADE
+                    ON DELETE CASCADE
+            );
+            """
+        )
+    )
+    await db.execute("CREATE INDEX IF NOT EXISTS shares_uname ON shares (uname);")
+    await db.execute("CREATE INDEX IF NOT EXISTS shares_expiry ON shares (expiry);")
+    await db.execute(
+        dedent(
+            """
+            CREATE TABLE IF NOT EXISTS trash (
+                id TEXT NOT NULL PRIMARY KEY,
+                location TEXT NOT NULL,
+                path TEXT NOT NULL,
+                uname TEXT NOT NULL,
+                deleted INTEGER NOT NULL,
+                is_directory INTEGER NOT NULL
+            );
+            """
+        )
+    )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS trash_location ON trash (location, deleted);"
+    )
+    await db.execute("CREATE INDEX IF NOT EXISTS trash_deleted ON trash (deleted);")
+    await db.commit()
+
+
 async def generate_db(path: str):
     async with aiosqlite.connect(path) as db:
         await db.execute(
@@ -8,8 +8,9 @@ import aiofiles
 import aiosqlite
 import ujson
 from aiofiles.os import path as aiopath
+from metrics import timed
 
-from .firstrun import generate_db
+from .firstrun import generate_db, upgrade_db
 
 
 class SQLiteInterface:
@@ -17,15 +18,30 @@ class SQLiteInterface:
         self._db: aiosqlite.Connection = db
         self._lock = asyncio.Lock()
 
+    @staticmethod
+    def path() -> str:
+        return os.path.join(os.path.dirname(os.path.realpath(__file__)), "bunsho.db")
+
     @classmethod
-    async def init(cls):
-        path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "bunsho.db")
+    async def create(cls, path: str = None) -> None:
+        # Runs once in the main process so that workers never race to create
+        # and seed the database.
+        path = path or cls.path()
         if not await aiopath.exists(path):
             await (await aiofiles.open(path, "x")).close()
             await generate_db(path)
 
-        return SQLiteInterface(await aiosqlite.connect(path))
+        async with aiosqlite.connect(path) as db:
+            await db.execute("PRAGMA journal_mode=WAL;")
+            await upgrade_db(db)
+
+    @classmethod
+    async def init(cls, path: str = None):
+        db = await aiosqlite.connect(path or cls.path())
+        await db.execute("PRAGMA busy_timeout=5000;")
+        return SQLiteInterface(db)
 
+    @timed("db")
     async def insert_user(
         self,
         uname: str,
@@ -53,6 +69,7 @@ class SQLiteInterface:
             )
             await self._db.commit()
 
+    @timed("db")
     async def update_user(
         self,
         uname: str,
@@ -88,11 +105,15 @@ class SQLiteInterface:
 
             await self._db.commit()
 
+    @timed("db")
     async def delete_user(self, uname: str) -> None:
         async with self._lock:
             await self._db.execute("DELETE FROM auth WHERE uname=(?);", (uname,))
+            # Foreign keys are not enforced, so the cascade has to be done here.
+            await self._db.execute("DELETE FROM shares WHERE uname=(?);", (uname,))
             await self._db.commit()
 
+    @timed("db")
     async def find_user(self, uname: str) -> Union[list, None]:
         user = []
         async with self._db.execute(
@@ -108,6 +129,7 @@ class SQLiteInterface:
 
         return user
 
+    @timed("db")
     async def find_all_users(self) -> list:
         users = []
         async with self._db.execute("SELECT * FROM auth;") as cursor:
@@ -119,6 +141,7 @@ class SQLiteInterface:
 
         return users
 
+    @timed("db")
     async def insert_refresh_token(self, token: str, expiry: int, uname: str) -> None:
         async with self._lock:
             await self._db.execute(
@@ -130,12 +153,14 @@ class SQLiteInterface:
             )
             await self._db.commit()
 
+    @timed("db")
     async def find_refresh_token(self, by: str, value: str) -> Union[Row, None]:
         async with self._db.execute(
             f"SELECT * FROM refresh_tokens WHERE {by}=(?);", (value,)
         ) as cursor:
             return await cursor.fetchone()
 
+    @timed("db")
     async def delete_refresh_token(self, uname: str) -> None:
         async with self._lock:
             await self._db.execute(
@@ -143,12 +168,170 @@ class SQLiteInterface:
             )
             await self._db.commit()
 
+    @timed("db")
+    async def insert_share(
+        self,
+        code: str,
+        location: str,
+        path: str,
+        uname: str,
+        expiry: Union[int, None],
+        max_downloads: Union[int, None],
+    ) -> None:
+        async with self._lock:
+            await self._db.execute(
+                """
+                INSERT INTO shares (code, location, path, uname, created, expiry, max_downloads)
+                VALUES (?, ?, ?, ?, ?, ?, ?);
+                """,
+                (
+                    code,
+                    location,
+                    path,
+                    uname,
+                    int(datetime.now(tz=timezone.utc).timestamp()),
+                    expiry,
+                    max_downloads,
+                ),
+            )
+            await self._db.commit()
+
+    @timed("db")
+    async def find_share(self, code: str) -> Union[list, None]:
+        # Along with what its owner is currently allowed to access, or `None`
+        # for both when the owner no longer exists.
+        async with self._db.execute(
+            """
+            SELECT shares.*, auth.authorized_locations, auth.permissions
+            FROM shares LEFT JOIN auth ON auth.uname=shares.uname
+            WHERE code=(?);
+            """,
+            (code,),
+        ) as cursor:
+            result = await cursor.fetchone()
+            if not result:
+                return None
+
+            share = [*result]
+            if share[-1] is not None:
+                share[-2] = ujson.loads(share[-2])
+                share[-1] = ujson.loads(share[-1])
+        return share
+
+    @timed("db")
+    async def find_shares(self, uname: Union[str, None]) -> list[Row]:
+        async with self._db.execute(
+            "SELECT * FROM shares ORDER BY created DESC;"
+            if uname is None
+            else "SELECT * FROM shares WHERE uname=(?) ORDER BY created DESC;",
+            () if uname is None else (uname,),
+        ) as cursor:
+            return list(await cursor.fetchall())
+
+    @timed("db")
+    async def delete_share(self, code: str) -> None:
+        async with self._lock:
+            await self._db.execute("DELETE FROM shares WHERE code=(?);", (code,))
+            await self._db.commit()
+
+    @timed("db")
+    async def count_share_download(self, code: str) -> bool:
+        # Atomic, so a download limit holds even across workers.
+        async with self._lock:
+            cursor = await self._db.execute(
+                """
+                UPDATE shares SET downloads=downloads + 1
+                WHERE code=(?) AND (max_downloads IS NULL OR downloads<max_downloads);
+                """,
+                (code,),
+            )
+            await self._db.commit()
+            return cursor.rowcount > 0
+
+    async def add_share_downloads(self, downloads: list[tuple[int, str]]) -> None:
+        async with self._lock:
+            await self._db.executemany(
+                "UPDATE shares SET downloads=downloads + (?) WHERE code=(?);",
+                downloads,
+            )
+            await self._db.commit()
+
+    @timed("db")
+    async def insert_trash(
+        self,
+        item_id: str,
+        location: str,
+        path: str,
+        uname: str,
+        deleted: int,
+        is_directory: bool,
+    ) -> None:
+        async with self._lock:
+            await self._db.execute(
+                """
+                INSERT INTO trash (id, location, path, uname, deleted, is_directory)
+                VALUES (?, ?, ?, ?, ?, ?);
+                """,
+                (item_id, location, path, uname, deleted, is_directory),
+            )
+            await self._db.commit()
+
+    @timed("db")
+    async def find_trash_item(self, item_id: str) -> Union[Row, None]:
+        async with self._db.execute(
+            "SELECT * FROM trash WHERE id=(?);", (item_id,)
+        ) as cursor:
+            return await cursor.fetchone()
+
+    @timed("db")
+    async def find_trash(self, location: str, uname: Union[str, None]) -> list[Row]:
+        async with self._db.execute(
+            "SELECT * FROM trash WHERE location=(?) ORDER BY deleted DESC;"
+            if uname is None
+            else "SELECT * FROM trash WHERE location=(?) AND uname=(?) ORDER BY deleted DESC;",
+            (location,) if uname is None else (location, uname),
+        ) as cursor:
+            return list(await cursor.fetchall())
+
+    async def find_trash_ids(self) -> set[str]:
+        async with self._db.execute("SELECT id FROM trash;") as cursor:
+            return {row[0] for row in await cursor.fetchall()}
+
+    async def find_expired_trash(self, before: int) -> list[Row]:
+        async with self._db.execute(
+            "SELECT * FROM trash WHERE deleted<(?) ORDER BY deleted;", (before,)
+        ) as cursor:
+            return list(await cursor.fetchall())
+
+    @timed("db")
+    async def delete_trash(self, item_id: str) -> bool:
+        # Only one worker purges an item, the one that managed to delete it.
+        async with self._lock:
+            cursor = await self._db.execute(
+                "DELETE FROM trash WHERE id=(?);", (item_id,)
+            )
+            await self._db.commit()
+            return cursor.rowcount > 0
+
+    async def shares_cleanup_task(self) -> None:
+        while True:
+            async with self._lock:
+                await self._db.execute(
+                    "DELETE FROM shares WHERE expiry<(?);",
+                    (int(datetime.now(tz=timezone.utc).timestamp()),),
+                )
+                await self._db.commit()
+
+            await asyncio.sleep(3600)
+
     async def refresh_tokens_cleanup_task(self) -> None:
         while True:
-            async with self._db.execute("SELECT * FROM refresh_tokens;") as cursor:
-                async for row in cursor:
-                    if row[1] < int(datetime.now(tz=timezone.utc).timestamp()):
-                        await self.delete_refresh_token(row[2])
+            async with self._lock:
+                await self._db.execute(
+                    "DELETE FROM refresh_tokens WHERE expiry<(?);",
+                    (int(datetime.now(tz=timezone.utc).timestamp()),),
+                )
+                await self._db.commit()
 
             await asyncio.sleep(60)
 
@@ -1,91 +1,73 @@
-import asyncio
-import os
-from textwrap import dedent
+import time
 from typing import Union
 from uuid import uuid4
 
-import aiosqlite
+from sanic.config import Config
+
+from .ephemeral import EphemeralBackend, MemoryBackend, SocketBackend
+
+# Refresh tokens live for a day, so a blacklist entry can never outlive them.
+BLACKLIST_TTL = 86400
+# The store keeps upload sessions past their expiry for this long, so that the
+# sweeper still sees them and can delete their partial files.
+UPLOAD_SWEEP_GRACE = 3600
 
 
 class TempDBInterface:
-    def __init__(self, db, path):
-        self._path: str = path
-        self._db: aiosqlite.Connection = db
-        self._lock = asyncio.Lock()
+    def __init__(self, backend):
+        self._backend: EphemeralBackend = backend
 
     @classmethod
-    async def init(cls):
-        path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "temp.db")
-        conn = await aiosqlite.connect(path)
-        await conn.execute(
-            dedent(
-                """
-            CREATE TABLE IF NOT EXISTS upload_uuids (
-                uuid TEXT NOT NULL UNIQUE,
-                user TEXT NOT NULL,
-                path TEXT NOT NULL
-            );
-        """
-            )
-        )
-        await conn.execute(
-            dedent(
-                """
-            CREATE TABLE IF NOT EXISTS jwt_blacklist (
-                uname TEXT NOT NULL UNIQUE,
-                iat INTEGER NOT NULL
-            );
-        """
-            )
+    async def init(cls, config: Config, socket_path: str = None):
+        if config.EPHEMERAL_BACKEND == "memory":
+            backend: EphemeralBackend = MemoryBackend()
+        elif config.EPHEMERAL_BACKEND == "socket":
+            backend = SocketBackend(socket_path)
+        else:
+            raise ValueError(f"Unknown ephemeral backend: {config.EPHEMERAL_BACKEND}")
+
+        await backend.start()
+        return TempDBInterface(backend)
+
+    @property
+    def backend(self) -> EphemeralBackend:
+        return self._backend
+
+    async def insert_uuid(self, user: str, path: str, ttl: int) -> str:
+        uuid = str(uuid4())
+        await self._backend.set(
+            "upload_uuids",
+            uuid,
+            [user, path, int(time.time()) + ttl],
+            ttl + UPLOAD_SWEEP_GRACE,
         )
-        await conn.commit()
-        return TempDBInterface(conn, path)
-
-    async def insert_uuid(self, user: str, path: str) -> str:
-        async with self._lock:
-            uuid = str(uuid4())
-            await self._db.execute(
-                "INSERT INTO upload_uuids (uuid, user, path) VALUES (?, ?, ?);",
-                (uuid, user, path),
-            )
-            await self._db.commit()
-            return uuid
-
-    async def find_uuid(self, uuid: str) -> Union[aiosqlite.Row, None]:
-        async with self._db.execute(
-            "SELECT * FROM upload_uuids WHERE uuid=(?);", (uuid,)
-        ) as cursor:
-            result = await cursor.fetchone()
-            if not result:
-                return None
-            return result
+        return uuid
+
+    def find_uuid(self, uuid: str) -> Union[tuple, None]:
+        result = self._backend.get("upload_uuids", uuid)
+        if not result or result[2] <= time.time():
+            return None
+        return (uuid, *result)
+
+    def find_all_uuids(self) -> list[tuple]:
+        return [(uuid, *result) for uuid, result in self._backend.items("upload_uuids")]
 
     async def delete_uuid(self, uuid: str) -> None:
-        async with self._lock:
-            await self._db.execute("DELETE FROM upload_uuids WHERE uuid=(?);", (uuid,))
-            await self._db.commit()
+        await self._backend.delete("upload_uuids", uuid)
+
+    async def delete_expired_uuids(self) -> int:
+        now = time.time()
+        expired = [uuid for uuid, *result in self.find_all_uuids() if result[2] <= now]
+        for uuid in expired:
+            await self._backend.delete("upload_uuids", uuid)
+        return len(expired)
 
     async def blacklist_jwt(self, uname: str, iat: int) -> None:
-        async with self._lock:
-            await self._db.execute(
-                "INSERT INTO jwt_blacklist (uname, iat) VALUES (?, ?);", (uname, iat)
-            )
-            await self._db.commit()
-
-    async def verify_jwt_blacklist(self, uname: str, iat: int) -> bool:
-        async with self._db.execute(
-            "SELECT * FROM jwt_blacklist WHERE uname=(?);", (uname,)
-        ) as cursor:
-            result = await cursor.fetchone()
-            if not result:
-                return False
-            if result[1] > iat:
-                return True
-        return False
+        await self._backend.set("jwt_blacklist", uname, iat, BLACKLIST_TTL)
+
+    def verify_jwt_blacklist(self, uname: str, iat: int) -> bool:
+        blacklisted_at = self._backend.get("jwt_blacklist", uname)
+        return blacklisted_at is not None and blacklisted_at > iat
 
     async def stop(self) -> None:
-        await self._db.close()
-        try:
-            os.remove(self._path)
-        except FileNotFoundError:
-            pass
+        await self._backend.stop()
@@ -1,15 +1,51 @@
 from sanic import Sanic
-from sanic.exceptions import Forbidden, InvalidUsage, Unauthorized, NotFound
+from sanic.exceptions import (
+    Forbidden,
+    InvalidUsage,
+    NotFound,
+    SanicException,
+    ServiceUnavailable,
+    Unauthorized,
+)
 from sanic.request import Request
 from sanic.response import HTTPResponse, json
 
 
+class TooManyRequests(SanicException):
+    status_code = 429
+    quiet = True
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message, 429)
+        self.headers = {"Retry-After": str(retry_after)}
+
+
+class ServerBusy(ServiceUnavailable):
+    quiet = True
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message, 503)
+        self.headers = {"Retry-After": str(retry_after)}
+
+
+class RangeNotSatisfiable(SanicException):
+    status_code = 416
+    quiet = True
+
+    def __init__(self, total: int):
+        super().__init__("The requested range is not satisfiable.", 416)
+        self.headers = {"Content-Range": f"bytes */{total}"}
+
+
 class ExceptionHandlers:
     def __init__(self, app: Sanic):
         app.error_handler.add(InvalidUsage, self.bad_request_handler)
         app.error_handler.add(Unauthorized, self.unauthorized_handler)
         app.error_handler.add(Forbidden, self.forbidden_handler)
         app.error_handler.add(NotFound, self.not_found_handler)
+        app.error_handler.add(RangeNotSatisfiable, self.range_not_satisfiable_handler)
+        app.error_handler.add(TooManyRequests, self.too_many_requests_handler)
+        app.error_handler.add(ServiceUnavailable, self.service_unavailable_handler)
 
     async def bad_request_handler(
         self, _request: Request, exception: InvalidUsage
@@ -30,3 +66,30 @@ class ExceptionHandlers:
         self, _request: Request, exception: NotFound
     ) -> HTTPResponse:
         return json({"error": "Not Found", "error_msg": str(exception)}, 404)
+
+    async def range_not_satisfiable_handler(
+        self, _request: Request, exception: RangeNotSatisfiable
+    ) -> HTTPResponse:
+        return json(
+            {"error": "Range Not Satisfiable", "error_msg": str(exception)},
+            416,
+            headers=exception.headers,
+        )
+
+    async def too_many_requests_handler(
+        self, _request: Request, exception: TooManyRequests
+    ) -> HTTPResponse:
+        return json(
+            {"error": "Too Many Requests", "error_msg": str(exception)},
+            429,
+            headers=exception.headers,
+        )
+
+    async def service_unavailable_handler(
+        self, _request: Request, exception: ServiceUnavailable
+    ) -> HTTPResponse:
+        return json(
+            {"error": "Service Unavailable", "error_msg": str(exception)},
+            503,
+            headers=getattr(exception, "headers", None),
+        )
@@ -0,0 +1,156 @@
+import asyncio
+import errno
+import io
+import os
+import shutil
+import stat
+import tarfile
+import time
+import zipfile
+import zlib
+from typing import IO, Union
+
+from sanic.exceptions import InvalidUsage
+from utils import safe_join
+
+CHUNK_SIZE = 1048576
+# Request body chunks buffered between the request and the extracting thread.
+QUEUE_SIZE = 8
+FORMATS = ("tar", "tar.gz", "zip")
+# Errors caused by a name in the archive that the filesystem does not accept.
+NAME_ERRNOS = {errno.ENAMETOOLONG, errno.EILSEQ, errno.EINVAL}
+
+
+class QueueReader(io.RawIOBase):
+    """
+    Reads, from a thread, the chunks that the event loop puts into `queue`.
+    `None` marks the end of the stream.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+        self._loop = loop
+        self._queue = queue
+        self._buffer = memoryview(b"")
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer:
+            if self._eof:
+                return 0
+            chunk = asyncio.run_coroutine_threadsafe(
+                self._queue.get(), self._loop
+            ).result()
+            if chunk is None:
+                self._eof = True
+                return 0
+            self._buffer = memoryview(chunk)
+
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _write_member(src: IO[bytes], path: str, size: int, mtime: float) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "xb") as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        if dst.tell() != size:
+            raise EOFError()
+    os.utime(path, (mtime, mtime))
+
+
+def _member_error(e: OSError, path: str, is_file: bool) -> Exception:
+    # Tells the client what is wrong with its archive, errors of the server
+    # such as a full disk are left as they are.
+    if isinstance(e, FileExistsError) and is_file and os.path.isfile(path):
+        return InvalidUsage("The archive contains the same file twice.", 400)
+    if isinstance(e, (FileExistsError, NotADirectoryError, IsADirectoryError)):
+        return InvalidUsage(
+            "The archive contains a file and a folder with the same name.", 400
+        )
+    if e.errno in NAME_ERRNOS:
+        return InvalidUsage("The archive contains a name that cannot be used.", 400)
+    return e
+
+
+def extract_tar(fileobj: IO[bytes], staging: str, compressed: bool) -> int:
+    """
+    Extracts a tar stream member by member as it is read. Only files and
+    folders are extracted, links and special files are skipped. Returns the
+    number of files extracted.
+    """
+    files = 0
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r|gz" if compressed else "r|") as tar:
+            for member in tar:
+                path = safe_join(staging, member.name)
+                try:
+                    if member.isdir():
+                        os.makedirs(path, exist_ok=True)
+                    elif member.isfile():
+                        _write_member(
+                            tar.extractfile(member), path, member.size, member.mtime
+                        )
+                        files += 1
+                except OSError as e:
+                    raise _member_error(e, path, member.isfile())
+
+            # Reading a tar stream simply stops where the data does, so a cut
+            # off upload is only told apart by its missing end of archive.
+            if len(tar.fileobj.read(tarfile.BLOCKSIZE)) < tarfile.BLOCKSIZE:
+                raise EOFError()
+    except (tarfile.TarError, EOFError, zlib.error):
+        raise InvalidUsage("The archive could not be read.", 400)
+    return files
+
+
+def extract_zip(path: str, staging: str) -> int:
+    # Zip files keep their index at the end, so they are extracted once
+    # they have been received completely.
+    files = 0
+    try:
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                target = safe_join(staging, info.filename)
+                if stat.S_ISLNK(info.external_attr >> 16):
+                    continue
+                try:
+                    if info.is_dir():
+                        os.makedirs(target, exist_ok=True)
+                    else:
+                        with archive.open(info) as src:
+                            _write_member(
+                                src,
+                                target,
+                                info.file_size,
+                                time.mktime((*info.date_time, 0, 0, -1)),
+                            )
+                        files += 1
+                except OSError as e:
+                    raise _member_error(e, target, not info.is_dir())
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, EOFError, zlib.error):
+        raise InvalidUsage("The archive could not be read.", 400)
+    return files
+
+
+async def feed(queue: asyncio.Queue, chunk: Union[bytes, None], extractor) -> bool:
+    # Gives up once the extracting thread has stopped reading, which it does
+    # when it rejects the archive.
+    put = asyncio.ensure_future(queue.put(chunk))
+    await asyncio.wait({put, extractor}, return_when=asyncio.FIRST_COMPLETED)
+    if not put.done():
+        put.cancel()
+        return False
+    return True
+
+
+def release(queue: asyncio.Queue) -> None:
+    # Cuts the stream short when the upload fails, so that the extracting
+    # thread fails too instead of waiting for data forever.
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait(None)
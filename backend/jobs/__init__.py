@@ -0,0 +1,3 @@
+from .manager import Job, JobCancelled, JobManager
+
+__all__ = ["Job", "JobCancelled", "JobManager"]
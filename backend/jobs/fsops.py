@@ -0,0 +1,262 @@
+import errno
+import fcntl
+import os
+import shutil
+import stat
+from typing import BinaryIO, Callable, Iterator
+
+from .manager import Job, JobCancelled, JobStep
+
+# How many files are unlinked between two progress updates.
+BATCH_SIZE = 512
+CHUNK_SIZE = 1048576
+# _IOW(0x94, 9, int) from linux/fs.h, shares the data blocks of two files.
+FICLONE = 0x40049409
+# Errors meaning a copy method is not supported for this pair of files.
+UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EBADF,
+    errno.ENOTSUP,
+    errno.EOPNOTSUPP,
+    errno.ENOTSOCK,
+    errno.ETXTBSY,
+}
+# Errors meaning a filesystem cannot hard link a file.
+LINK_UNSUPPORTED_ERRNOS = {errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EMLINK}
+
+
+def walk(path: str) -> Iterator[os.DirEntry]:
+    stack = [path]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                yield entry
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+
+
+def tree_size(job: Job, path: str) -> tuple[int, int]:
+    if not os.path.isdir(path) or os.path.islink(path):
+        return 1, os.lstat(path).st_size
+
+    items = 1
+    size = 0
+    for entry in walk(path):
+        items += 1
+        if entry.is_file(follow_symlinks=False):
+            size += entry.stat(follow_symlinks=False).st_size
+        if items % BATCH_SIZE == 0:
+            job.check_cancelled()
+    return items, size
+
+
+def remove_tree(job: Job, path: str) -> None:
+    if not os.path.isdir(path) or os.path.islink(path):
+        os.unlink(path)
+        job.advance()
+        return
+
+    job.start_phase("counting")
+    job.start_phase("deleting", tree_size(job, path)[0])
+    stack = [(path, False)]
+    pending = 0
+    while stack:
+        current, emptied = stack.pop()
+        if emptied:
+            os.rmdir(current)
+            pending += 1
+            continue
+
+        stack.append((current, True))
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, False))
+                    continue
+
+                os.unlink(entry.path)
+                pending += 1
+                if pending >= BATCH_SIZE:
+                    job.advance(pending)
+                    pending = 0
+
+    job.advance(pending)
+
+
+def copy_file(job: Job, src: str, dst: str) -> None:
+    with open(src, "rb") as fsrc, open(dst, "xb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        offset = 0
+        for method in (_reflink, _copy_file_range, _sendfile, _buffered_copy):
+            try:
+                offset = method(job, fsrc, fdst, size, offset)
+                break
+            except OSError as e:
+                # Falling back is only safe while the method has not written
+                # anything yet, or it would have to be undone first.
+                if e.errno not in UNSUPPORTED_ERRNOS or fdst.tell() != offset:
+                    raise
+
+    shutil.copystat(src, dst)
+
+
+def _reflink(job: Job, fsrc: BinaryIO, fdst: BinaryIO, size: int, offset: int) -> int:
+    if offset or not size or not hasattr(fcntl, "ioctl"):
+        raise OSError(errno.ENOTSUP, "Reflinks are not supported")
+
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    fsrc.seek(size)
+    fdst.seek(size)
+    job.advance(size)
+    return size
+
+
+def _copy_file_range(
+    job: Job, fsrc: BinaryIO, fdst: BinaryIO, size: int, offset: int
+) -> int:
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+
+    return _copy_loop(
+        job,
+        offset,
+        lambda offset: os.copy_file_range(
+            fsrc.fileno(), fdst.fileno(), CHUNK_SIZE * 8, offset, offset
+        ),
+        fdst,
+    )
+
+
+def _sendfile(job: Job, fsrc: BinaryIO, fdst: BinaryIO, size: int, offset: int) -> int:
+    return _copy_loop(
+        job,
+        offset,
+        lambda offset: os.sendfile(
+            fdst.fileno(), fsrc.fileno(), offset, CHUNK_SIZE * 8
+        ),
+        fdst,
+    )
+
+
+def _buffered_copy(
+    job: Job, fsrc: BinaryIO, fdst: BinaryIO, size: int, offset: int
+) -> int:
+    fsrc.seek(offset)
+    fdst.seek(offset)
+    while chunk := fsrc.read(CHUNK_SIZE):
+        fdst.write(chunk)
+        offset += len(chunk)
+        job.advance(len(chunk))
+    return offset
+
+
+def _copy_loop(
+    job: Job, offset: int, copy: Callable[[int], int], fdst: BinaryIO
+) -> int:
+    while copied := copy(offset):
+        offset += copied
+        fdst.seek(offset)
+        job.advance(copied)
+    return offset
+
+
+def copy_tree(job: Job, src: str, dst: str) -> None:
+    # Anything at the destination past this check was created by this job,
+    # so it can be discarded again if the copy fails or gets cancelled.
+    if os.path.lexists(dst):
+        raise FileExistsError(errno.EEXIST, "Destination already exists", dst)
+
+    job.start_phase("counting")
+    job.start_phase("copying", tree_size(job, src)[1], "bytes")
+    try:
+        if not os.path.isdir(src) or os.path.islink(src):
+            _copy_entry(job, src, dst, os.lstat(src).st_mode)
+            return
+
+        os.mkdir(dst)
+        directories = [(src, dst)]
+        for entry in walk(src):
+            target = os.path.join(dst, os.path.relpath(entry.path, src))
+            if entry.is_dir(follow_symlinks=False):
+                os.mkdir(target)
+                directories.append((entry.path, target))
+            else:
+                _copy_entry(
+                    job, entry.path, target, entry.stat(follow_symlinks=False).st_mode
+                )
+
+        for source, target in reversed(directories):
+            shutil.copystat(source, target)
+    except (JobCancelled, OSError):
+        discard(dst)
+        raise
+
+
+def rename_noreplace(src: str, dst: str) -> None:
+    """
+    Renames `src` to `dst`, failing with `FileExistsError` instead of
+    replacing whatever is at `dst`. Files are hard linked and unlinked, which
+    cannot replace anything. Folders cannot be linked and are checked right
+    before the rename, as are files on filesystems without hard links.
+    """
+    if not os.path.isdir(src) or os.path.islink(src):
+        try:
+            os.link(src, dst, follow_symlinks=False)
+        except OSError as e:
+            if e.errno not in LINK_UNSUPPORTED_ERRNOS:
+                raise
+        else:
+            os.unlink(src)
+            return
+
+    if os.path.lexists(dst):
+        raise FileExistsError(errno.EEXIST, "Destination already exists", dst)
+    os.rename(src, dst)
+
+
+def move(job: Job, src: str, dst: str) -> None:
+    try:
+        rename_noreplace(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    copy_tree(job, src, dst)
+    remove_tree(job, src)
+
+
+def apply_many(
+    job: Job, phase: str, operation: Callable[..., None], items: list[tuple]
+) -> list[dict]:
+    # Each item is (display path, *operation arguments). Failures are
+    # reported per item instead of aborting the whole batch.
+    job.start_phase(phase, len(items))
+    step = JobStep(job)
+    results = []
+    for path, *args in items:
+        try:
+            operation(step, *args)
+            results.append({"path": path, "status": "OK"})
+        except OSError as e:
+            results.append(
+                {"path": path, "status": "failed", "error": e.strerror or str(e)}
+            )
+        job.advance()
+    return results
+
+
+def discard(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+
+def _copy_entry(job: Job, src: str, dst: str, mode: int) -> None:
+    if stat.S_ISLNK(mode):
+        os.symlink(os.readlink(src), dst)
+    elif stat.S_ISREG(mode):
+        copy_file(job, src, dst)
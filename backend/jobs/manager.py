@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import time
+from typing import Any, Callable, Union
+from uuid import uuid4
+
+from database.ephemeral import EphemeralBackend
+from sanic.log import logger
+
+# Jobs stay queryable for an hour after their last progress update.
+JOB_TTL = 3600
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """
+    A long running filesystem operation. The work function runs in the
+    executor and reports progress through `start_phase` and `advance`, which
+    also raise `JobCancelled` once the job has been cancelled.
+    """
+
+    def __init__(self, kind: str, uname: str, target: str):
+        self.id = uuid4().hex
+        self.kind = kind
+        self.uname = uname
+        self.target = target
+        self.status = "running"
+        self.phase = "starting"
+        self.unit = "items"
+        self.done = 0
+        self.total: Union[int, None] = None
+        self.error: Union[str, None] = None
+        self.result: Any = None
+        self.created = int(time.time())
+        self._cancelled = threading.Event()
+
+    def start_phase(self, phase: str, total: int = None, unit: str = "items") -> None:
+        self.check_cancelled()
+        self.phase = phase
+        self.total = total
+        self.unit = unit
+        self.done = 0
+
+    def advance(self, amount: int = 1) -> None:
+        self.done += amount
+        self.check_cancelled()
+
+    def check_cancelled(self) -> None:
+        if self._cancelled.is_set():
+            raise JobCancelled()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "uname": self.uname,
+            "target": self.target,
+            "status": self.status,
+            "phase": self.phase,
+            "unit": self.unit,
+            "done": self.done,
+            "total": self.total,
+            "error": self.error,
+            "result": self.result,
+            "created": self.created,
+        }
+
+
+class JobStep:
+    """
+    Stands in for a `Job` while a helper handles one item of a bigger job.
+    The helper's own phases and progress are ignored, cancellation is not.
+    """
+
+    def __init__(self, job: Job):
+        self._job = job
+
+    def start_phase(self, phase: str, total: int = None, unit: str = "items") -> None:
+        self._job.check_cancelled()
+
+    def advance(self, amount: int = 1) -> None:
+        self._job.check_cancelled()
+
+    def check_cancelled(self) -> None:
+        self._job.check_cancelled()
+
+
+class JobManager:
+    def __init__(self, backend: EphemeralBackend, publish_interval: float = 0.5):
+        self._backend = backend
+        self._publish_interval = publish_interval
+        self._jobs: dict[str, Job] = {}
+        self._on_finish: list[Callable[[Job], Any]] = []
+        backend.subscribe("job_cancel", self._on_cancel)
+
+    def on_finish(self, callback: Callable[[Job], Any]) -> None:
+        self._on_finish.append(callback)
+
+    async def submit(
+        self, kind: str, uname: str, target: str, func: Callable[..., Any], *args
+    ) -> Job:
+        job = Job(kind, uname, target)
+        self._jobs[job.id] = job
+        await self._publish(job)
+        asyncio.get_running_loop().create_task(self._run(job, func, args))
+        return job
+
+    def get(self, job_id: str) -> Union[dict, None]:
+        return self._backend.get("jobs", job_id)
+
+    def find_all(self, uname: str = None) -> list[dict]:
+        return [
+            job
+            for _, job in self._backend.items("jobs")
+            if uname is None or job["uname"] == uname
+        ]
+
+    async def cancel(self, job_id: str) -> None:
+        await self._backend.publish("job_cancel", job_id)
+
+    async def stop(self) -> None:
+        for job in self._jobs.values():
+            job.cancel()
+
+    def _on_cancel(self, job_id: str) -> None:
+        job = self._jobs.get(job_id)
+        if job:
+            job.cancel()
+
+    async def _publish(self, job: Job) -> None:
+        await self._backend.set("jobs", job.id, job.to_dict(), JOB_TTL)
+
+    async def _run(self, job: Job, func: Callable[..., Any], args: tuple) -> None:
+        future = asyncio.get_running_loop().run_in_executor(None, func, job, *args)
+        while not future.done():
+            await asyncio.wait({future}, timeout=self._publish_interval)
+            await self._publish(job)
+
+        try:
+            job.result = future.result()
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except OSError as e:
+            job.status = "failed"
+            job.error = e.strerror or str(e)
+        except Exception as e:
+            logger.exception(f"[Jobs]: Job {job.id} ({job.kind}) crashed")
+            job.status = "failed"
+            job.error = str(e)
+
+        del self._jobs[job.id]
+        await self._publish(job)
+        for callback in self._on_finish:
+            callback(job)
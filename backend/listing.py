@@ -0,0 +1,115 @@
+from typing import NamedTuple, Union
+
+from sanic.response import HTTPResponse, json, raw
+from utils import parsebytes
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+DEFAULT_TYPE = "application/json"
+COLUMNAR_TYPE = "application/vnd.bunsho.columnar+json"
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+class Entry(NamedTuple):
+    name: str
+    mimetype: Union[str, None]
+    size: Union[int, None]
+    created: int
+    is_directory: bool
+
+
+def listing_types() -> list[str]:
+    # Ordered by preference, so that clients which accept the default as much
+    # as a compact format keep getting the default.
+    media_types = [DEFAULT_TYPE, COLUMNAR_TYPE]
+    if msgpack:
+        media_types.extend(MSGPACK_TYPES)
+    return media_types
+
+
+def _parse_accept(accept: str) -> dict[str, float]:
+    ranges = {}
+    for part in accept.split(","):
+        media_range, *params = part.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges[media_range.strip().lower()] = quality
+    return ranges
+
+
+def negotiate_type(accept: Union[str, None]) -> str:
+    """
+    Picks the listing type that `accept` prefers. Every type takes the
+    quality of the most specific range that matches it, so `application/*`
+    outranks `*/*`. Clients that accept none of them get the default.
+    """
+    if not accept:
+        return DEFAULT_TYPE
+
+    ranges = _parse_accept(accept)
+    best = DEFAULT_TYPE
+    best_quality = 0.0
+    for media_type in listing_types():
+        major = media_type.split("/", 1)[0]
+        for media_range in (media_type, f"{major}/*", "*/*"):
+            if media_range in ranges:
+                if ranges[media_range] > best_quality:
+                    best, best_quality = media_type, ranges[media_range]
+                break
+    return best
+
+
+def columns(entries: list[Entry]) -> dict:
+    """
+    Lays a listing out as parallel arrays, with sizes in bytes and every
+    mimetype named once in `mimetypes` and referred to by its index.
+    """
+    mimetypes: dict[str, int] = {}
+    for entry in entries:
+        if entry.mimetype is not None:
+            mimetypes.setdefault(entry.mimetype, len(mimetypes))
+
+    return {
+        "names": [entry.name for entry in entries],
+        "mimetypes": list(mimetypes),
+        "mimetype": [
+            None if entry.mimetype is None else mimetypes[entry.mimetype]
+            for entry in entries
+        ],
+        "sizes": [entry.size for entry in entries],
+        "created": [entry.created for entry in entries],
+        "is_directory": [entry.is_directory for entry in entries],
+    }
+
+
+def encode_listing(
+    entries: list[Entry], media_type: str, headers: dict
+) -> HTTPResponse:
+    if media_type == COLUMNAR_TYPE:
+        return json(columns(entries), headers=headers, content_type=media_type)
+    if media_type in MSGPACK_TYPES:
+        return raw(
+            msgpack.packb(columns(entries)), headers=headers, content_type=media_type
+        )
+
+    return json(
+        {
+            "listing": [
+                {
+                    **entry._asdict(),
+                    "size": None if entry.size is None else parsebytes(entry.size),
+                }
+                for entry in entries
+            ]
+        },
+        headers=headers,
+    )
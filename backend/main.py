@@ -1,4 +1,9 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Every startup phase is timed from here, including the imports below.
+STARTED = time.perf_counter()
 
 if os.name == "nt":
     raise Exception("Currently Bunsho does not support running on Windows.")
@@ -7,19 +12,44 @@ import uvloop
 from sanic import Sanic
 from sanic.log import logger
 
-from database import SQLiteInterface, TempDBInterface
+from auth.authentication import TokenCache
+from bandwidth import BandwidthScheduler
+from auth.passwd import pool as passwd_pool
+from compression import ResponseCompression
+from coordination import Coordinator
+from database import EphemeralServer, SQLiteInterface, TempDBInterface
+from jobs import JobManager
+from metrics import RequestMetrics, register_queue
+from notifications import ChangeNotifier
+from previews import PreviewService
+from profiling import Profiler
+from ratelimit import RateLimiter
+from search import SearchService
 from exceptions import ExceptionHandlers
-from utils import BunshoConfig
+from utils import BunshoConfig, StartupTimer
 from routes import load_views
+from routes.static import StaticBundle
+from shares import ShareService
+from trash import TrashService
+from uploads import upload_sessions_cleanup_task
+
+startup = StartupTimer(STARTED)
+startup.end_phase("imports")
 
 
 class BunshoApp(Sanic):
     def __init__(self):
         super().__init__("bunsho", config=BunshoConfig())
+        startup.end_phase("config")
 
         load_views(self)
         ExceptionHandlers(self)
+        ResponseCompression(self)
+        self.ctx.metrics = RequestMetrics(self)
+        self.ctx.profiler = Profiler(self)
+        self.ctx.ratelimiter = RateLimiter(self)
         logger.info("[App]: Loaded views, APIs, and error handlers")
+        startup.end_phase("views")
         self.extend(
             config={
                 "cors_origins": "*" if self.config.DEV_MODE else "",
@@ -44,16 +74,20 @@ class BunshoApp(Sanic):
             description="JWT Bearer authentication method",
         )
 
+        startup.end_phase("extensions")
+
         self.register_listener(self.init_app, "main_process_start")
         self.register_listener(self.stop_app, "main_process_stop")
         self.register_listener(self.init_db, "before_server_start")
         self.register_listener(self.stop_db, "before_server_stop")
+        self.register_listener(self.report_ready, "after_server_start")
 
         logger.info("[App]: Starting main server process...")
         self.run(
             host=self.config.HOST,
             port=self.config.PORT,
-            dev=self.config.DEV_MODE,
+            debug=self.config.DEV_MODE,
+            auto_reload=self.config.DEV_MODE,
             ssl=self.config.get("SSL_CERTS_FOLDER"),
             fast=not self.config.DEV_MODE,
             access_log=self.config.DEV_MODE,
@@ -61,37 +95,161 @@ class BunshoApp(Sanic):
         )
 
     async def init_app(self, _app, _) -> None:
-        self.ctx.tmp_folder = os.path.join(
-            os.path.dirname(os.path.realpath(__file__)), "tmp"
+        startup.start_phase()
+        await SQLiteInterface.create(self.config.get("DATABASE_PATH"))
+        passwd_pool.shutdown()
+        startup.end_phase("database")
+        self.ctx.static_bundle = StaticBundle.load(
+            "../frontend/dist",
+            os.path.join(
+                os.path.dirname(os.path.realpath(__file__)), "cache", "static"
+            ),
+        )
+        logger.info("[App]: Loaded and precompressed the frontend")
+        startup.end_phase("frontend")
+        self.ctx.tmp_folder = self.config.get(
+            "TMP_FOLDER",
+            os.path.join(os.path.dirname(os.path.realpath(__file__)), "tmp"),
         )
         os.mkdir(self.ctx.tmp_folder)
-        logger.info("[App]: Created temporary download cache directory")
+        logger.info("[App]: Created temporary directory")
+        self.ctx.ephemeral_socket = os.path.join(self.ctx.tmp_folder, "ephemeral.sock")
+        self.ctx.ephemeral_server = None
+        if self.config.EPHEMERAL_BACKEND == "socket":
+            self.ctx.ephemeral_server = EphemeralServer(self.ctx.ephemeral_socket)
+            self.ctx.ephemeral_server.start()
+            logger.info("[App]: Started shared state server")
+        startup.end_phase("state server")
+
+        logger.info(f"[App]: Main process started in {startup.report()}")
 
     async def stop_app(self, _app, _) -> None:
-        for archive in os.listdir(self.ctx.tmp_folder):
-            os.remove(os.path.join(self.ctx.tmp_folder, archive))
+        if self.ctx.ephemeral_server:
+            self.ctx.ephemeral_server.stop()
+            logger.info("[App]: Stopped shared state server")
+        for name in os.listdir(self.ctx.tmp_folder):
+            os.remove(os.path.join(self.ctx.tmp_folder, name))
         os.rmdir(self.ctx.tmp_folder)
-        logger.info("[App]: Deleted temporary download cache directory")
+        logger.info("[App]: Deleted temporary directory")
 
     async def init_db(self, _app, _) -> None:
-        self.ctx.db = await SQLiteInterface.init()
+        # uvloop hides its default executor, so it is created here to be measured.
+        self.ctx.executor = ThreadPoolExecutor(thread_name_prefix="bunsho-default")
+        self.loop.set_default_executor(self.ctx.executor)
+        register_queue("default", self.ctx.executor._work_queue.qsize)
+        passwd_pool.configure(self.config)
+        self.ctx.db = await SQLiteInterface.init(self.config.get("DATABASE_PATH"))
         self.ext.dependency(self.ctx.db)
         logger.info("[Worker]: Connected to SQLite database")
-        self.ctx.tempdb = await TempDBInterface.init()
+        self.ctx.tempdb = await TempDBInterface.init(
+            self.config, self.ctx.ephemeral_socket
+        )
         self.ext.dependency(self.ctx.tempdb)
-        logger.info("[Worker]: Connected to temporary database")
+        logger.info("[Worker]: Connected to ephemeral state store")
+        self.ctx.coordinator = Coordinator(self, self.ctx.tempdb.backend)
+        self.ctx.profiler.start(self.ctx.tempdb.backend)
+        self.ctx.ratelimiter.start(self.ctx.tempdb.backend)
+        self.ctx.jobs = JobManager(self.ctx.tempdb.backend)
+        self.ctx.notifier = ChangeNotifier(self.config)
+        self.ctx.notifier.start(self.ctx.tempdb.backend)
+        self.ctx.jobs.on_finish(self.ctx.notifier.job_finished)
+        self.add_task(task=self.ctx.notifier.watch_task(), name="watch_task")
+        self.ctx.previews = PreviewService(
+            os.path.join(
+                os.path.dirname(os.path.realpath(__file__)), "cache", "previews"
+            ),
+            self.config,
+        )
         self.add_task(
-            task=self.ctx.db.refresh_tokens_cleanup_task(),
+            task=self.ctx.coordinator.leader_task(
+                "preview_eviction_task", self.ctx.previews.eviction_task
+            ),
+            name="preview_eviction_task",
+        )
+        register_queue("argon2", lambda: passwd_pool.pending)
+        register_queue("previews", lambda: self.ctx.previews.pending)
+        self.ctx.search = SearchService(self.config)
+        register_queue("search", lambda: self.ctx.search.pending)
+        self.add_task(task=self.ctx.metrics.publish_task(), name="metrics_publish_task")
+        self.ctx.token_cache = TokenCache(self.config.get("JWT_CACHE_SIZE", 4096))
+        self.ctx.coordinator.on_invalidate("jwt", self.ctx.token_cache.invalidate)
+        self.ctx.coordinator.on_invalidate(
+            "config", lambda _: self.ctx.token_cache.invalidate()
+        )
+        self.ctx.coordinator.on_invalidate(
+            "config", lambda _: passwd_pool.configure(self.config)
+        )
+        self.ctx.bandwidth = BandwidthScheduler(self.config)
+        self.ctx.coordinator.on_invalidate(
+            "config", lambda _: self.ctx.bandwidth.rebalance()
+        )
+        self.add_task(
+            task=self.ctx.bandwidth.sync_task(self.ctx.tempdb.backend),
+            name="bandwidth_sync_task",
+        )
+        self.ctx.shares = ShareService(
+            self.ctx.db, self.config.get("SHARE_CACHE_SIZE", 4096)
+        )
+        self.ctx.coordinator.on_invalidate("shares", self.ctx.shares.invalidate)
+        self.add_task(task=self.ctx.shares.flush_task(), name="share_flush_task")
+        self.add_task(
+            task=self.ctx.coordinator.leader_task(
+                "shares_cleanup_task", self.ctx.db.shares_cleanup_task
+            ),
+            name="shares_cleanup_task",
+        )
+        self.ctx.trash = TrashService(self.ctx.db, self.config)
+        self.add_task(
+            task=self.ctx.coordinator.leader_task(
+                "trash_purge_task", self.ctx.trash.purge_task
+            ),
+            name="trash_purge_task",
+        )
+        self.add_task(
+            task=self.ctx.coordinator.leader_task(
+                "upload_sessions_cleanup_task",
+                lambda: upload_sessions_cleanup_task(self.config, self.ctx.tempdb),
+            ),
+            name="upload_sessions_cleanup_task",
+        )
+        self.add_task(
+            task=self.ctx.coordinator.leader_task(
+                "refresh_tokens_cleanup_task",
+                self.ctx.db.refresh_tokens_cleanup_task,
+            ),
             name="refresh_tokens_cleanup_task",
         )
 
+    async def report_ready(self, _app, _) -> None:
+        # perf_counter is system wide on Linux, so it carries across the fork.
+        logger.info(
+            f"[Worker]: Ready to serve {(time.perf_counter() - STARTED) * 1000:.0f} ms "
+            "after the server was started"
+        )
+
     async def stop_db(self, _app, _) -> None:
+        await self.cancel_task("refresh_tokens_cleanup_task")
+        await self.cancel_task("preview_eviction_task")
+        await self.cancel_task("metrics_publish_task")
+        await self.cancel_task("share_flush_task")
+        await self.cancel_task("bandwidth_sync_task")
+        await self.cancel_task("shares_cleanup_task")
+        await self.cancel_task("upload_sessions_cleanup_task")
+        await self.cancel_task("trash_purge_task")
+        await self.cancel_task("watch_task")
+        self.purge_tasks()
+        self.ctx.profiler.stop()
+        self.ctx.trash.stop()
+        self.ctx.previews.stop()
+        self.ctx.search.stop()
+        await self.ctx.jobs.stop()
+        await self.ctx.shares.flush()
         await self.ctx.db.stop()
         logger.info("[Worker]: Disconnected from SQLite database")
         await self.ctx.tempdb.stop()
-        logger.info("[Worker]: Disconnected from temporary database")
-        await self.cancel_task("refresh_tokens_cleanup_task")
-        self.purge_tasks()
+        logger.info("[Worker]: Disconnected from ephemeral state store")
+        passwd_pool.shutdown()
+        self.ctx.executor.shutdown(wait=False)
 
 
 if __name__ == "__main__":
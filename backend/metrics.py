@@ -0,0 +1,289 @@
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator, Union
+
+from sanic import Sanic
+from sanic.request import Request
+from sanic.response import HTTPResponse
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+# Worker snapshots older than this are left out of the aggregate.
+SNAPSHOT_TTL = 30
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...]):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.samples: dict[tuple, list] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def snapshot(self) -> dict:
+        return {
+            "type": self.type,
+            "help": self.description,
+            "labels": list(self.labels),
+            "samples": [[*key, values] for key, values in self.samples.items()],
+        }
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        if key in self.samples:
+            self.samples[key][0] += amount
+        else:
+            self.samples[key] = [amount]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...],
+        collect: Callable[[], dict[tuple, float]],
+    ):
+        super().__init__(name, description, labels)
+        self._collect = collect
+
+    def snapshot(self) -> dict:
+        self.samples = {key: [value] for key, value in self._collect().items()}
+        return super().snapshot()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...],
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        # Per bucket counts followed by the sum, made cumulative on render.
+        values = self.samples.get(key)
+        if values is None:
+            values = self.samples[key] = [0] * (len(self.buckets) + 2)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def snapshot(self) -> dict:
+        return {**super().snapshot(), "buckets": list(self.buckets)}
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    @staticmethod
+    def merge(snapshots: list[dict]) -> dict:
+        merged: dict = {}
+        for snapshot in snapshots:
+            for name, metric in snapshot.items():
+                target = merged.setdefault(name, {**metric, "samples": {}})
+                for *key, values in metric["samples"]:
+                    existing = target["samples"].get(tuple(key))
+                    target["samples"][tuple(key)] = (
+                        [a + b for a, b in zip(existing, values)]
+                        if existing
+                        else [*values]
+                    )
+        return merged
+
+    @staticmethod
+    def render(merged: dict) -> str:
+        lines = []
+        for name, metric in sorted(merged.items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for key, values in sorted(metric["samples"].items()):
+                labels = [
+                    f'{label}="{_escape(value)}"'
+                    for label, value in zip(metric["labels"], key)
+                ]
+                if metric["type"] != "histogram":
+                    lines.append(f"{name}{_labels(labels)} {values[0]}")
+                    continue
+
+                cumulative = 0
+                for bound, count in zip([*metric["buckets"], "+Inf"], values[:-1]):
+                    cumulative += count
+                    bucket_labels = _labels([*labels, f'le="{bound}"'])
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {values[-1]}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: object) -> str:
+    # Label values come from the config and from users, and one unescaped
+    # quote would break the whole scrape.
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: list[str]) -> str:
+    return f"{{{','.join(labels)}}}" if labels else ""
+
+
+QUEUES: dict[str, Callable[[], int]] = {}
+
+
+def register_queue(name: str, depth: Callable[[], int]) -> None:
+    QUEUES[name] = depth
+
+
+def _queue_depths() -> dict[tuple, float]:
+    return {(name,): depth() for name, depth in QUEUES.items()}
+
+
+registry = Registry()
+REQUEST_DURATION: Histogram = registry.register(  # type: ignore
+    Histogram(
+        "bunsho_request_duration_seconds",
+        "Time until the response headers were sent.",
+        ("route", "method", "status"),
+    )
+)
+STAGE_DURATION: Histogram = registry.register(  # type: ignore
+    Histogram(
+        "bunsho_stage_duration_seconds",
+        "Time spent in each stage of handling requests.",
+        ("stage",),
+    )
+)
+TRANSFERRED_BYTES: Counter = registry.register(  # type: ignore
+    Counter(
+        "bunsho_transferred_bytes_total",
+        "Bytes uploaded and downloaded per location.",
+        ("direction", "location"),
+    )
+)
+CACHE_REQUESTS: Counter = registry.register(  # type: ignore
+    Counter(
+        "bunsho_cache_requests_total",
+        "Cache lookups by cache and result.",
+        ("cache", "result"),
+    )
+)
+RATE_LIMITED: Counter = registry.register(  # type: ignore
+    Counter(
+        "bunsho_rate_limited_requests_total",
+        "Requests refused by the rate limits, by budget and client kind.",
+        ("budget", "kind"),
+    )
+)
+registry.register(
+    Gauge(
+        "bunsho_executor_queue_depth",
+        "Work items waiting for an executor.",
+        ("executor",),
+        _queue_depths,
+    )
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=name)
+
+
+def timed(name: str):
+    def decorator(func: Callable):
+        @wraps(func)
+        async def decorated_function(*args, **kwargs):
+            with stage(name):
+                return await func(*args, **kwargs)
+
+        return decorated_function
+
+    return decorator
+
+
+def cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+class RequestMetrics:
+    def __init__(self, app: Sanic):
+        self._app = app
+        app.register_middleware(self.start_timer, "request")
+        app.register_middleware(self.observe_request, "response")
+
+    async def start_timer(self, request: Request) -> None:
+        request.ctx.started = time.perf_counter()
+
+    async def observe_request(
+        self, request: Request, response: Union[HTTPResponse, None]
+    ) -> None:
+        # Streamed responses pass through response middleware twice.
+        started = vars(request.ctx).pop("started", None)
+        if started is None or response is None:
+            return
+
+        REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            route=request.route.name if request.route else "unknown",
+            method=request.method,
+            status=response.status,
+        )
+
+    async def publish_task(self) -> None:
+        while True:
+            await self._app.ctx.tempdb.backend.set(
+                "metrics", str(os.getpid()), registry.snapshot(), SNAPSHOT_TTL
+            )
+            await asyncio.sleep(5)
+
+    def collect(self) -> str:
+        snapshots = {
+            pid: snapshot
+            for pid, snapshot in self._app.ctx.tempdb.backend.items("metrics")
+        }
+        snapshots[str(os.getpid())] = registry.snapshot()
+        return Registry.render(Registry.merge(list(snapshots.values())))
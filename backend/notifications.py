@@ -0,0 +1,212 @@
+import asyncio
+import os
+import stat
+import time
+from typing import Union
+
+import ujson
+from sanic.config import Config
+from sanic.log import logger
+from websockets.exceptions import ConnectionClosed
+
+from database.ephemeral import EphemeralBackend
+from jobs import Job
+from utils import visible
+
+# Changes reported within this many seconds of each other are sent together.
+DEBOUNCE = 0.25
+MAX_SUBSCRIPTIONS = 64
+# Messages waiting for a slow client before it is told to list again instead.
+OUTBOX_SIZE = 256
+
+# Entry name to whether it is a folder, its size and its modification time.
+Snapshot = dict[str, tuple[bool, int, int]]
+
+
+def scan(location: str, folder: str) -> Snapshot:
+    snapshot = {}
+    try:
+        with os.scandir(folder) as scanned:
+            entries = {entry.name: entry for entry in scanned}
+    except (FileNotFoundError, NotADirectoryError):
+        return snapshot
+
+    for name in visible(location, folder, entries):
+        try:
+            stats = entries[name].stat()
+        except FileNotFoundError:
+            continue
+        snapshot[name] = (stat.S_ISDIR(stats.st_mode), stats.st_size, stats.st_mtime_ns)
+    return snapshot
+
+
+def diff(old: Snapshot, new: Snapshot) -> list[dict]:
+    changes = []
+    for name, entry in new.items():
+        previous = old.get(name)
+        if previous != entry:
+            changes.append(
+                {
+                    "type": "added" if previous is None else "modified",
+                    "name": name,
+                    "is_directory": entry[0],
+                }
+            )
+    for name in old.keys() - new.keys():
+        changes.append({"type": "removed", "name": name, "is_directory": old[name][0]})
+    return changes
+
+
+class Client:
+    """
+    A WebSocket connection and the folders it watches. Messages go through
+    a bounded outbox so that one slow client never holds up the others.
+    """
+
+    def __init__(self, ws, jwt: dict, verify_jwt):
+        self.ws = ws
+        self.jwt = jwt
+        self.subscriptions: dict[str, tuple[int, str]] = {}
+        self._verify_jwt = verify_jwt
+        self._outbox: asyncio.Queue = asyncio.Queue(OUTBOX_SIZE)
+        self._overflowed = False
+
+    def authorized(self) -> bool:
+        return self.jwt["exp"] > time.time() and not self._verify_jwt(
+            self.jwt["uname"], self.jwt["iat"]
+        )
+
+    def send(self, message: dict) -> None:
+        try:
+            self._outbox.put_nowait(message)
+        except asyncio.QueueFull:
+            self._overflowed = True
+
+    async def send_task(self) -> None:
+        try:
+            while True:
+                message = await self._outbox.get()
+                if not self.authorized():
+                    await self.ws.close(4401, "This token is no longer valid.")
+                    return
+                await self.ws.send(ujson.dumps(message))
+                if self._overflowed and self._outbox.empty():
+                    self._overflowed = False
+                    await self.ws.send(ujson.dumps({"resync": True}))
+        except ConnectionClosed:
+            pass
+
+
+class _Watch:
+    def __init__(self, location: str, path: str, snapshot: Snapshot):
+        self.location = location
+        self.path = path
+        self.snapshot = snapshot
+        self.clients: set[Client] = set()
+        self.lock = asyncio.Lock()
+        self.scheduled: Union[asyncio.TimerHandle, None] = None
+
+
+class ChangeNotifier:
+    """
+    Pushes changes of watched folders to WebSocket clients. Bunsho's own
+    handlers report the paths they change to every worker, which rescans the
+    folders its clients watch and sends what differs from the last scan, so
+    a change is only ever reported once. Changes made outside of Bunsho are
+    found by rescanning every `WATCH_INTERVAL` seconds.
+    """
+
+    def __init__(self, config: Config):
+        self._config = config
+        self._backend: Union[EphemeralBackend, None] = None
+        self._watches: dict[str, _Watch] = {}
+        self._after_jobs: dict[str, tuple[str, ...]] = {}
+
+    def start(self, backend: EphemeralBackend) -> None:
+        self._backend = backend
+        backend.subscribe("changes", self._on_changes)
+
+    async def changed(self, *paths: str) -> None:
+        # Only the folders that contain the paths are listed differently.
+        await self._backend.publish(
+            "changes",
+            sorted({os.path.dirname(os.path.normpath(path)) for path in paths}),
+        )
+
+    def changed_after(self, job: Job, *paths: str) -> None:
+        self._after_jobs[job.id] = paths
+
+    def job_finished(self, job: Job) -> None:
+        paths = self._after_jobs.pop(job.id, None)
+        if paths:
+            asyncio.get_running_loop().create_task(self.changed(*paths))
+
+    async def subscribe(
+        self, client: Client, index: int, folder: str, location: str, path: str
+    ):
+        if path in client.subscriptions:
+            return
+        watch = self._watches.get(path)
+        if watch is None:
+            snapshot = await asyncio.get_running_loop().run_in_executor(
+                None, scan, location, path
+            )
+            # Another client may have started watching it in the meantime.
+            watch = self._watches.setdefault(path, _Watch(location, path, snapshot))
+        watch.clients.add(client)
+        client.subscriptions[path] = (index, folder)
+
+    def unsubscribe(self, client: Client, path: str) -> None:
+        client.subscriptions.pop(path, None)
+        watch = self._watches.get(path)
+        if watch is None:
+            return
+        watch.clients.discard(client)
+        if not watch.clients:
+            if watch.scheduled:
+                watch.scheduled.cancel()
+            del self._watches[path]
+
+    def disconnect(self, client: Client) -> None:
+        for path in list(client.subscriptions):
+            self.unsubscribe(client, path)
+
+    async def watch_task(self) -> None:
+        while True:
+            interval = self._config.get("WATCH_INTERVAL", 5)
+            await asyncio.sleep(interval or 5)
+            if not interval:
+                continue
+            for watch in list(self._watches.values()):
+                await self._rescan(watch)
+
+    def _on_changes(self, folders: list[str]) -> None:
+        loop = asyncio.get_running_loop()
+        for folder in folders:
+            watch = self._watches.get(folder)
+            if watch and not watch.scheduled:
+                watch.scheduled = loop.call_later(DEBOUNCE, self._fire, watch)
+
+    def _fire(self, watch: _Watch) -> None:
+        watch.scheduled = None
+        asyncio.get_running_loop().create_task(self._rescan(watch))
+
+    async def _rescan(self, watch: _Watch) -> None:
+        async with watch.lock:
+            try:
+                snapshot = await asyncio.get_running_loop().run_in_executor(
+                    None, scan, watch.location, watch.path
+                )
+            except OSError:
+                logger.exception(f"[Worker]: Could not rescan {watch.path}")
+                return
+            changes = diff(watch.snapshot, snapshot)
+            watch.snapshot = snapshot
+
+        if changes:
+            for client in list(watch.clients):
+                index, folder = client.subscriptions.get(watch.path, (None, None))
+                if index is not None:
+                    client.send(
+                        {"location": index, "folder": folder, "changes": changes}
+                    )
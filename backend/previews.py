@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Union
+
+from metrics import cache_lookup
+from sanic.config import Config
+from sanic.log import logger
+
+PREVIEW_SIZES = (128, 256, 512, 1024)
+TEXT_PREVIEW_BYTES = 4096
+TEXT_MIMETYPES = {
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/x-sh",
+}
+
+
+class PreviewUnavailable(Exception):
+    pass
+
+
+def preview_kind(mimetype: Union[str, None]) -> Union[str, None]:
+    if not mimetype:
+        return None
+    if mimetype.startswith("image/"):
+        return "image"
+    if mimetype.startswith("video/"):
+        return "video" if shutil.which("ffmpeg") else None
+    if mimetype.startswith("text/") or mimetype in TEXT_MIMETYPES:
+        return "text"
+    return None
+
+
+def _render_image(path: str, size: int) -> tuple[bytes, str]:
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as image:
+        # Lets the JPEG decoder scale down while decoding, which is far
+        # cheaper than decoding the full image and resizing it afterwards.
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+        output = io.BytesIO()
+        image.save(output, "WEBP", quality=80)
+        return output.getvalue(), "image/webp"
+
+
+def _render_video(path: str, size: int) -> tuple[bytes, str]:
+    frame = subprocess.run(
+        [
+            "ffmpeg",
+            "-loglevel",
+            "error",
+            "-ss",
+            "1",
+            "-i",
+            path,
+            "-frames:v",
+            "1",
+            "-vf",
+            f"scale={size}:{size}:force_original_aspect_ratio=decrease",
+            "-f",
+            "image2pipe",
+            "-vcodec",
+            "mjpeg",
+            "-",
+        ],
+        capture_output=True,
+        timeout=30,
+    ).stdout
+    if not frame:
+        raise PreviewUnavailable()
+    return frame, "image/jpeg"
+
+
+def _render_text(path: str, _size: int) -> tuple[bytes, str]:
+    with open(path, "rb") as f:
+        head = f.read(TEXT_PREVIEW_BYTES)
+    return (
+        head.decode("utf-8", errors="replace").encode(),
+        "text/plain; charset=utf-8",
+    )
+
+
+def _render(kind: str, path: str, size: int) -> tuple[bytes, str]:
+    try:
+        return {"image": _render_image, "video": _render_video, "text": _render_text}[
+            kind
+        ](path, size)
+    except PreviewUnavailable:
+        raise
+    except Exception as e:
+        raise PreviewUnavailable() from e
+
+
+class PreviewService:
+    """
+    Renders previews in a process pool and keeps them in an on-disk cache
+    keyed by the file's identity, size and modification time, so an edited
+    file never gets served a stale preview.
+    """
+
+    def __init__(self, folder: str, config: Config):
+        self.folder = folder
+        self.max_size: int = config.get("PREVIEW_CACHE_SIZE", 536870912)
+        self._workers: int = config.get("PREVIEW_WORKERS", 2)
+        self._executor: Union[ProcessPoolExecutor, None] = None
+        self._rendering: dict[str, asyncio.Future] = {}
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def key(stats: os.stat_result, size: int) -> str:
+        return hashlib.sha256(
+            f"{stats.st_dev}:{stats.st_ino}:{stats.st_size}:{stats.st_mtime_ns}:{size}".encode()
+        ).hexdigest()
+
+    @property
+    def pending(self) -> int:
+        return len(self._rendering)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, key[:2], key)
+
+    def _read(self, key: str) -> Union[tuple[bytes, str], None]:
+        try:
+            with open(self._path(key), "rb") as f:
+                mimetype, data = f.read().split(b"\n", 1)
+            # The modification time doubles as the last access for eviction.
+            os.utime(self._path(key))
+            return data, mimetype.decode()
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, key: str, data: bytes, mimetype: str) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp{os.getpid()}", "wb") as f:
+            f.write(mimetype.encode() + b"\n" + data)
+        os.replace(f"{path}.tmp{os.getpid()}", path)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=multiprocessing.get_context("fork"),
+            )
+        return self._executor
+
+    def _reset(self, executor: ProcessPoolExecutor) -> None:
+        # Renders that ran on the same pool all see it break.
+        if self._executor is executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _render_and_write(
+        self, kind: str, path: str, size: int, key: str
+    ) -> tuple[bytes, str]:
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            data, mimetype = await loop.run_in_executor(
+                executor, _render, kind, path, size
+            )
+        except BrokenProcessPool as e:
+            # A render process died, for example when it ran out of memory.
+            # The next preview gets a new pool.
+            self._reset(executor)
+            raise PreviewUnavailable() from e
+
+        # Written once here rather than by every request waiting for it.
+        await loop.run_in_executor(None, self._write, key, data, mimetype)
+        return data, mimetype
+
+    async def get(
+        self, kind: str, path: str, stats: os.stat_result, size: int
+    ) -> tuple[bytes, str, str]:
+        loop = asyncio.get_running_loop()
+        key = self.key(stats, size)
+        cached = await loop.run_in_executor(None, self._read, key)
+        cache_lookup("previews", cached is not None)
+        if cached:
+            return (*cached, key)
+
+        # Concurrent requests for the same preview share a single render.
+        if key not in self._rendering:
+            self._rendering[key] = loop.create_task(
+                self._render_and_write(kind, path, size, key)
+            )
+        try:
+            data, mimetype = await asyncio.shield(self._rendering[key])
+        finally:
+            self._rendering.pop(key, None)
+        return data, mimetype, key
+
+    def evict(self) -> None:
+        entries = []
+        total = 0
+        for prefix in os.scandir(self.folder):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                stats = entry.stat()
+                entries.append((stats.st_mtime, stats.st_size, entry.path))
+                total += stats.st_size
+
+        if total <= self.max_size:
+            return
+
+        entries.sort()
+        evicted = 0
+        for _, size, path in entries:
+            if total <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        logger.info(f"[Previews]: Evicted {evicted} cached previews")
+
+    async def eviction_task(self) -> None:
+        while True:
+            await asyncio.get_running_loop().run_in_executor(None, self.evict)
+            await asyncio.sleep(300)
+
+    def stop(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
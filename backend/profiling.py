@@ -0,0 +1,271 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from typing import Union
+
+from sanic import Sanic
+from sanic.exceptions import ServiceUnavailable
+from sanic.log import logger
+from sanic.request import Request
+from sanic.response import HTTPResponse
+
+from database.ephemeral import EphemeralBackend
+
+PROFILE_INTERVAL = 0.005
+MAX_PROFILE_SECONDS = 60
+PROFILE_TTL = 300
+SLOW_REQUEST_TTL = 3600
+# Slow requests kept per worker, the oldest ones are overwritten.
+SLOW_REQUEST_LOG_SIZE = 100
+
+Frame = tuple[str, str, int]
+Stack = tuple[Frame, ...]
+
+
+def _stack(frame) -> Stack:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+class Sampler(threading.Thread):
+    """
+    Samples the stack of another thread at a fixed interval. Taking a sample
+    only holds the GIL for as long as it takes to walk the frames, so the
+    sampled thread is barely slowed down.
+    """
+
+    def __init__(self, thread_id: int, interval: float, maxlen: int = None):
+        super().__init__(name="bunsho-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self._samples: deque[tuple[float, Stack]] = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                sample = (time.monotonic(), _stack(frame))
+                with self._lock:
+                    self._samples.append(sample)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    @property
+    def samples(self) -> deque[tuple[float, Stack]]:
+        # A copy, the deque cannot be iterated while the thread appends to it.
+        with self._lock:
+            return self._samples.copy()
+
+    def between(self, start: float, end: float) -> list[Stack]:
+        stacks = []
+        for sampled, stack in reversed(self.samples):
+            if sampled < start:
+                break
+            if sampled <= end:
+                stacks.append(stack)
+        return stacks
+
+
+def to_collapsed(stacks: list[Stack]) -> str:
+    counts = Counter(stacks)
+    return "".join(
+        ";".join(
+            f"{name} ({os.path.basename(filename)}:{line})"
+            for name, filename, line in stack
+        )
+        + f" {count}\n"
+        for stack, count in counts.most_common()
+    )
+
+
+def to_speedscope(stacks: list[Stack], interval: float, name: str) -> dict:
+    frames: dict[Frame, int] = {}
+    samples = []
+    weights = []
+    for stack, count in Counter(stacks).most_common():
+        samples.append([frames.setdefault(frame, len(frames)) for frame in stack])
+        weights.append(count * interval)
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {
+            "frames": [
+                {"name": name, "file": filename, "line": line}
+                for name, filename, line in frames
+            ]
+        },
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }
+        ],
+        "exporter": "bunsho",
+    }
+
+
+class Profiler:
+    """
+    Profiles the event loop thread of a worker on request of any other worker,
+    and, when `SLOW_REQUEST_THRESHOLD` is set, keeps sampling it at a low rate
+    so that the stacks seen while a slow request was in flight can be logged.
+    """
+
+    def __init__(self, app: Sanic):
+        self._app = app
+        self._backend: Union[EphemeralBackend, None] = None
+        self._thread_id = 0
+        self._profiles: dict[str, Sampler] = {}
+        self._background: Union[Sampler, None] = None
+        self._slow_requests = 0
+        app.register_middleware(self.start_timer, "request")
+        app.register_middleware(self.log_slow_request, "response")
+
+    def start(self, backend: EphemeralBackend) -> None:
+        self._backend = backend
+        # Called from the worker's event loop, which is what gets profiled.
+        self._thread_id = threading.get_ident()
+        backend.subscribe("profiler", self._on_message)
+
+        threshold = self._app.config.get("SLOW_REQUEST_THRESHOLD")
+        if threshold:
+            interval = self._app.config.get("SLOW_REQUEST_SAMPLE_INTERVAL", 0.01)
+            # Enough samples to cover a request that took 30 s.
+            self._background = Sampler(self._thread_id, interval, int(30 / interval))
+            self._background.start()
+
+    def stop(self) -> None:
+        for sampler in self._profiles.values():
+            sampler.stop()
+        if self._background:
+            self._background.stop()
+
+    def workers(self) -> list[int]:
+        # Every worker publishes its metrics, which doubles as a worker list.
+        pids = {int(pid) for pid, _ in self._backend.items("metrics")}
+        pids.add(os.getpid())
+        return sorted(pids)
+
+    async def profile(self, pid: int, seconds: float, output: str) -> Union[str, dict]:
+        profile_id = uuid.uuid4().hex
+        await self._backend.publish(
+            "profiler",
+            {
+                "action": "start",
+                "id": profile_id,
+                "pid": pid,
+                "seconds": seconds,
+                "output": output,
+            },
+        )
+
+        deadline = time.monotonic() + seconds + 10
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.25)
+            profile = self._backend.get("profiles", profile_id)
+            if profile is not None:
+                return profile
+
+        raise ServiceUnavailable("The worker did not return the profile in time.", 503)
+
+    async def stop_profiles(self, pid: int) -> None:
+        await self._backend.publish("profiler", {"action": "stop", "pid": pid})
+
+    def slow_requests(self) -> list[dict]:
+        return sorted(
+            (entry for _, entry in self._backend.items("slow_requests")),
+            key=lambda entry: entry["time"],
+            reverse=True,
+        )
+
+    def _on_message(self, message: dict) -> None:
+        if message["pid"] != os.getpid():
+            return
+        if message["action"] == "stop":
+            for sampler in self._profiles.values():
+                sampler.stop()
+            return
+
+        asyncio.get_running_loop().create_task(
+            self._run(message["id"], message["seconds"], message["output"])
+        )
+
+    async def _run(self, profile_id: str, seconds: float, output: str) -> None:
+        sampler = Sampler(self._thread_id, PROFILE_INTERVAL)
+        self._profiles[profile_id] = sampler
+        logger.info(f"[Profiler]: Profiling this worker for {seconds} seconds")
+        sampler.start()
+        deadline = time.monotonic() + seconds
+        try:
+            while not sampler.stopped and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+        finally:
+            sampler.stop()
+            del self._profiles[profile_id]
+
+        stacks = [stack for _, stack in sampler.samples]
+        await self._backend.set(
+            "profiles",
+            profile_id,
+            to_speedscope(stacks, PROFILE_INTERVAL, f"Bunsho worker {os.getpid()}")
+            if output == "speedscope"
+            else to_collapsed(stacks),
+            PROFILE_TTL,
+        )
+
+    async def start_timer(self, request: Request) -> None:
+        if self._background:
+            request.ctx.profiled_since = time.monotonic()
+
+    async def log_slow_request(
+        self, request: Request, response: Union[HTTPResponse, None]
+    ) -> None:
+        # Streamed responses pass through response middleware twice.
+        started = vars(request.ctx).pop("profiled_since", None)
+        if started is None or response is None:
+            return
+
+        ended = time.monotonic()
+        duration = ended - started
+        if duration < self._app.config.SLOW_REQUEST_THRESHOLD:
+            return
+
+        logger.warning(
+            f"[Profiler]: {request.method} {request.path} took {duration:.3f} seconds"
+        )
+        self._slow_requests = (self._slow_requests + 1) % SLOW_REQUEST_LOG_SIZE
+        await self._backend.set(
+            "slow_requests",
+            f"{os.getpid()}:{self._slow_requests}",
+            {
+                "pid": os.getpid(),
+                "time": int(time.time()),
+                "method": request.method,
+                "path": request.path,
+                "status": response.status,
+                "duration": duration,
+                "stacks": to_collapsed(self._background.between(started, ended)),
+            },
+            SLOW_REQUEST_TTL,
+        )
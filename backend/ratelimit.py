@@ -0,0 +1,109 @@
+import math
+import time
+from typing import Union
+
+from sanic import Sanic
+from sanic.request import Request
+
+from database.ephemeral import EphemeralBackend
+from exceptions import TooManyRequests
+from metrics import RATE_LIMITED
+
+# Requests allowed per window of seconds, separately for every client address
+# and every user. `RATE_LIMITS` in the config overrides these per budget.
+DEFAULT_LIMITS = {
+    "auth": (20, 60),
+    "listing": (300, 60),
+    "transfer": (300, 60),
+}
+BUDGET_PREFIXES = (
+    ("/api/auth/", "auth"),
+    ("/api/core/ls/", "listing"),
+    ("/api/core/grep/", "listing"),
+    ("/api/watch", "listing"),
+    ("/api/download/", "transfer"),
+    ("/api/upload/", "transfer"),
+    ("/api/batch/download/", "transfer"),
+    ("/s/", "transfer"),
+)
+
+
+class RateLimiter:
+    """
+    Sliding window rate limits, approximated from the counts of the current
+    and the previous fixed window. The counts live in the ephemeral store,
+    whose increments reach every worker, so reading them never leaves the
+    process. Clients are limited by address before anything else runs, and
+    by username once the request is authenticated.
+    """
+
+    def __init__(self, app: Sanic):
+        self._app = app
+        self._backend: Union[EphemeralBackend, None] = None
+        app.register_middleware(self.limit_address, "request")
+
+    def start(self, backend: EphemeralBackend) -> None:
+        self._backend = backend
+
+    def budget(self, path: str) -> Union[str, None]:
+        for prefix, budget in BUDGET_PREFIXES:
+            if path.startswith(prefix):
+                return budget
+        return None
+
+    def limits(self, budget: str) -> Union[tuple[int, int], None]:
+        limits = self._app.config.get("RATE_LIMITS", {})
+        if budget not in limits:
+            return DEFAULT_LIMITS[budget]
+        # A budget set to null or a limit of 0 is not limited at all.
+        if not limits[budget] or not limits[budget][0]:
+            return None
+        return tuple(limits[budget])
+
+    async def limit_address(self, request: Request) -> None:
+        budget = self.budget(request.path)
+        if budget is not None:
+            await self._hit(budget, "address", request.remote_addr or request.ip)
+
+    async def limit_user(self, request: Request, uname: str) -> None:
+        budget = self.budget(request.path)
+        if budget is not None:
+            await self._hit(budget, "user", uname)
+
+    async def limit_login(self, request: Request, uname: str) -> None:
+        # Runs before the password is checked, so it is keyed on the address
+        # too, or anyone could lock a user out just by knowing their name.
+        budget = self.budget(request.path)
+        if budget is not None:
+            await self._hit(
+                budget, "login", f"{uname}@{request.remote_addr or request.ip}"
+            )
+
+    async def _hit(self, budget: str, kind: str, client: str) -> None:
+        limits = self.limits(budget)
+        if limits is None:
+            return
+
+        allowed, window = limits
+        now = time.time()
+        current = int(now // window)
+        elapsed = now - current * window
+        key = f"{budget}:{kind}:{client}:"
+        previous_count = self._backend.get("ratelimit", f"{key}{current - 1}", 0)
+        current_count = self._backend.get("ratelimit", f"{key}{current}", 0)
+        weight = 1 - elapsed / window
+        if previous_count * weight + current_count >= allowed:
+            RATE_LIMITED.inc(budget=budget, kind=kind)
+            # When the previous window has faded enough, or else when this one
+            # has become the previous window and faded enough in turn.
+            if current_count < allowed and previous_count:
+                wait = (1 - (allowed - current_count) / previous_count) * window
+                wait -= elapsed
+            else:
+                wait = window - elapsed + window * (1 - allowed / current_count)
+            raise TooManyRequests(
+                "Too many requests, please try again later.",
+                max(1, math.ceil(wait)),
+            )
+
+        await self._backend.incr("ratelimit", f"{key}{current}", 1, window * 2)
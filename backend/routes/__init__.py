@@ -1,17 +1,38 @@
 from sanic import Blueprint, Sanic
 
-from . import static
-from .apis import auth_api, core_api, download_api, upload_api
+from . import share, static
+from .apis import (
+    auth_api,
+    batch_api,
+    core_api,
+    download_api,
+    jobs_api,
+    metrics_api,
+    preview_api,
+    profiler_api,
+    share_api,
+    trash_api,
+    upload_api,
+    watch_api,
+)
 
 
 def load_views(app: Sanic) -> None:
-    app.blueprint([static.blueprint])
+    app.blueprint([share.blueprint, static.blueprint])
     app.blueprint(
         Blueprint.group(
             auth_api.blueprint,
+            batch_api.blueprint,
             core_api.blueprint,
             download_api.blueprint,
+            jobs_api.blueprint,
+            metrics_api.blueprint,
+            preview_api.blueprint,
+            profiler_api.blueprint,
+            share_api.blueprint,
+            trash_api.blueprint,
             upload_api.blueprint,
+            watch_api.blueprint,
             url_prefix="/api",
         )
     )
@@ -59,7 +59,7 @@ async def api_auth_access_token(
             key=request.app.config.REFRESH_TOKEN_SECRET,
             algorithms=["HS256"],
         )
-        is_blacklisted: bool = await tempdb.verify_jwt_blacklist(
+        is_blacklisted: bool = tempdb.verify_jwt_blacklist(
             decoded["uname"], decoded["iat"]
         )
         if decoded["iss"] != "Bunsho":
@@ -144,6 +144,9 @@ async def api_auth_refresh_token(request: Request, db: SQLiteInterface) -> HTTPR
     credentials: dict = request.json
     if not credentials or ["uname", "passwd"] != list(credentials.keys()):
         raise InvalidUsage("Credentials were not provided.", 400)
+    # Counted per account and address before the password is checked, on top
+    # of the limit every address has for all of authentication.
+    await request.app.ctx.ratelimiter.limit_login(request, credentials["uname"])
 
     fetched_credentials = await db.find_user(credentials["uname"])
     if not fetched_credentials:
@@ -240,6 +243,7 @@ async def api_auth_logout_all(
     await tempdb.blacklist_jwt(
         jwt["uname"], int(datetime.now(tz=timezone.utc).timestamp())
     )
+    await request.app.ctx.coordinator.invalidate("jwt", jwt["uname"])
     return json({"status": "OK"})
 
 
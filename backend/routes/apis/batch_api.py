@@ -0,0 +1,328 @@
+import os
+
+from archive import stream_archive
+from auth.authentication import JWTDict, check_authorized_dirs, require_jwt
+from jobs import fsops
+from sanic import Blueprint
+from sanic.exceptions import InvalidUsage, NotFound
+from sanic.request import Request
+from sanic.response import HTTPResponse, ResponseStream, json
+from trash import TrashService
+from utils import safe_join
+
+blueprint = Blueprint("api_batch", url_prefix="/batch")
+
+
+def _get_paths(request: Request) -> list[str]:
+    try:
+        paths = request.json["paths"]
+    except (KeyError, TypeError):
+        raise InvalidUsage("Bad argument values were provided.", 400)
+
+    if not isinstance(paths, list) or not all(isinstance(i, str) for i in paths):
+        raise InvalidUsage("Bad argument values were provided.", 400)
+    if not paths or len(paths) > request.app.config.get("BATCH_MAX_ITEMS", 1000):
+        raise InvalidUsage("Too many or too few paths were provided.", 400)
+    return paths
+
+
+def _resolve(request: Request, path: str) -> str:
+    full_path = safe_join(request.ctx.location.dir, path)
+    if full_path == os.path.normpath(request.ctx.location.dir):
+        raise InvalidUsage("The root of a location cannot be used here.", 400)
+    if not os.path.lexists(full_path):
+        raise NotFound("File or folder was not found.", 404)
+    return full_path
+
+
+@blueprint.post("/mv/<index:int>")
+@require_jwt(return_value=True)
+@check_authorized_dirs(permission="move")
+async def api_batch_mv(request: Request, index: int, jwt: JWTDict) -> HTTPResponse:
+    """
+    Batch Move Endpoint
+
+    This endpoint moves several files or folders into one folder in a single
+    background job. Paths that cannot be moved are reported right away, the
+    others are reported in the job's result.
+
+    openapi:
+    ---
+    tags:
+        - batch
+    security:
+        - token: []
+    parameters:
+        - in: path
+          name: index
+          schema:
+              type: integer
+              example: 0
+          required: true
+          description: Index of a location from the config array of locations.
+    requestBody:
+        description: Configuration.
+        required: true
+        content:
+            application/json:
+                schema:
+                    type: object
+                    properties:
+                        paths:
+                            type: array
+                            items:
+                                type: string
+                        new_path:
+                            type: string
+                    example:
+                        paths: [essay.txt, work]
+                        new_path: ./other/folder
+    responses:
+        "202":
+            description: A background job was started to move the files/folders.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            status:
+                                type: string
+                            job:
+                                type: string
+                                nullable: true
+                            results:
+                                type: array
+                                items:
+                                    type: object
+                        example:
+                            status: Accepted
+                            job: 0f8fad5bd9cb469fa16570867728950e
+                            results:
+                                - path: missing.txt
+                                  status: failed
+                                  error: File or folder was not found.
+    """
+    paths = _get_paths(request)
+    try:
+        folder = safe_join(request.ctx.location.dir, request.json["new_path"])
+    except (KeyError, TypeError):
+        raise InvalidUsage("Bad argument values were provided.", 400)
+    if not os.path.isdir(folder):
+        raise NotFound("The destination folder was not found.", 404)
+
+    moves = []
+    destinations = set()
+    results = []
+    for path in paths:
+        try:
+            full_path = _resolve(request, path)
+            destination = os.path.join(folder, os.path.basename(full_path))
+            if os.path.lexists(destination):
+                raise InvalidUsage(
+                    "There is already a file/folder with the same name at the destination."
+                )
+            if destination in destinations:
+                raise InvalidUsage(
+                    "Another path in this batch is moved to the same name."
+                )
+            destinations.add(destination)
+            moves.append((path, full_path, destination))
+        except (InvalidUsage, NotFound) as e:
+            results.append({"path": path, "status": "failed", "error": str(e)})
+
+    job = None
+    if moves:
+        job = await request.app.ctx.jobs.submit(
+            "batch-mv",
+            jwt["uname"],
+            request.json["new_path"],
+            fsops.apply_many,
+            "moving",
+            fsops.move,
+            moves,
+        )
+        request.app.ctx.notifier.changed_after(
+            job, *(path for move in moves for path in move[1:])
+        )
+    return json(
+        {"status": "Accepted", "job": job.id if job else None, "results": results},
+        202,
+    )
+
+
+@blueprint.post("/rm/<index:int>")
+@require_jwt(return_value=True)
+@check_authorized_dirs(permission="delete")
+async def api_batch_rm(request: Request, index: int, jwt: JWTDict) -> HTTPResponse:
+    """
+    Batch Delete Endpoint
+
+    This endpoint deletes several files or folders in a single background job.
+    Paths that cannot be deleted are reported right away, the others are
+    reported in the job's result. When the trash is enabled, paths moved to
+    the trash are reported right away as well, along with their trash IDs.
+
+    openapi:
+    ---
+    tags:
+        - batch
+    security:
+        - token: []
+    parameters:
+        - in: path
+          name: index
+          schema:
+              type: integer
+              example: 0
+          required: true
+          description: Index of a location from the config array of locations.
+    requestBody:
+        description: Configuration.
+        required: true
+        content:
+            application/json:
+                schema:
+                    type: object
+                    properties:
+                        paths:
+                            type: array
+                            items:
+                                type: string
+                    example:
+                        paths: [essay.txt, work]
+    responses:
+        "202":
+            description: A background job was started to delete the files/folders.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            status:
+                                type: string
+                            job:
+                                type: string
+                                nullable: true
+                            results:
+                                type: array
+                                items:
+                                    type: object
+                        example:
+                            status: Accepted
+                            job: 0f8fad5bd9cb469fa16570867728950e
+                            results: []
+    """
+    trash: TrashService = request.app.ctx.trash
+    removals = []
+    trashed = []
+    results = []
+    for path in _get_paths(request):
+        try:
+            full_path = _resolve(request, path)
+            item = None
+            if trash.enabled:
+                item = await trash.trash(request.ctx.location, full_path, jwt["uname"])
+        except (InvalidUsage, NotFound) as e:
+            results.append({"path": path, "status": "failed", "error": str(e)})
+            continue
+        except OSError as e:
+            results.append(
+                {"path": path, "status": "failed", "error": e.strerror or str(e)}
+            )
+            continue
+
+        if item:
+            results.append({"path": path, "status": "trashed", "trash": item.id})
+            trashed.append(full_path)
+        else:
+            removals.append((path, full_path))
+
+    job = None
+    if removals:
+        job = await request.app.ctx.jobs.submit(
+            "batch-rm",
+            jwt["uname"],
+            request.ctx.location.name,
+            fsops.apply_many,
+            "deleting",
+            fsops.remove_tree,
+            removals,
+        )
+        request.app.ctx.notifier.changed_after(
+            job, *(full_path for _, full_path in removals)
+        )
+    if trashed:
+        await request.app.ctx.notifier.changed(*trashed)
+    return json(
+        {"status": "Accepted", "job": job.id if job else None, "results": results},
+        202,
+    )
+
+
+@blueprint.post("/download/<index:int>")
+@require_jwt(return_value=True)
+@check_authorized_dirs
+async def api_batch_download(
+    request: Request, index: int, jwt: JWTDict
+) -> ResponseStream:
+    """
+    Batch Download Endpoint
+
+    This endpoint streams the selected files and folders as a single archive
+    while it is being built. The user can specify wheather to use Zip
+    compression or Tar with GZip.
+
+    openapi:
+    ---
+    tags:
+        - batch
+    security:
+        - token: []
+    parameters:
+        - in: path
+          name: index
+          schema:
+              type: integer
+              example: 0
+          required: true
+          description: Index of a location from the config array of locations.
+    requestBody:
+        description: Configuration.
+        required: true
+        content:
+            application/json:
+                schema:
+                    type: object
+                    properties:
+                        paths:
+                            type: array
+                            items:
+                                type: string
+                        ext:
+                            type: string
+                            enum: [zip, tar.gz]
+                    example:
+                        paths: [essay.txt, work]
+                        ext: zip
+    responses:
+        "200":
+            description: The archive of the selected files and folders.
+            content:
+                application/octet-stream:
+                    schema:
+                        type: string
+                        format: binary
+    """
+    ext = request.json.get("ext") if isinstance(request.json, dict) else None
+    if ext not in ("zip", "tar.gz"):
+        raise InvalidUsage("Invalid archive type was requested.", 400)
+
+    paths = [_resolve(request, path) for path in _get_paths(request)]
+    return stream_archive(
+        request.ctx.location.dir,
+        paths,
+        ext,
+        f"{request.ctx.location.name}-selection.{ext}",
+        request.ctx.location.name,
+        request.app.ctx.bandwidth.transfer(jwt),
+    )
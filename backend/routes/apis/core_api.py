@@ -1,13 +1,22 @@
+import errno
 import os
-import shutil
+import stat
 
+import aiofiles.os
+import ujson
 from aiofiles.os import path as aiopath
 from auth.authentication import JWTDict, check_authorized_dirs, require_jwt
+from jobs import fsops
+from listing import Entry, encode_listing, negotiate_type
+from metrics import stage
 from sanic import Blueprint
 from sanic.exceptions import Forbidden, InvalidUsage, NotFound
 from sanic.request import Request
-from sanic.response import HTTPResponse, json
-from utils import BunshoConfig, getmimetype, parsebytes
+from sanic.response import HTTPResponse, ResponseStream, empty, json
+from search import MAX_QUERY_LENGTH, SearchService
+from transfer import directory_etag, etag_matches
+from trash import TrashService
+from utils import filemimetype, safe_join, visible
 
 blueprint = Blueprint("api_core", url_prefix="/core")
 
@@ -21,7 +30,14 @@ async def api_core_ls(
     """
     List Directory Endpoint
 
-    This endpoint lists the contents of a directory.
+    This endpoint lists the contents of a directory. Listings carry an ETag
+    that changes when entries are added, removed or renamed, so an unchanged
+    folder can be revalidated with `If-None-Match`.
+
+    Clients that list large folders can ask for a compact format through
+    `Accept`: `application/vnd.bunsho.columnar+json` or, when msgpack is
+    installed, `application/msgpack`. Both lay the listing out as parallel
+    arrays with sizes in bytes and every mimetype named once.
 
     openapi:
     ---
@@ -79,37 +95,198 @@ async def api_core_ls(
                                   mimetype: null
                                   size: null
                                   is_directory: true
+                application/vnd.bunsho.columnar+json:
+                    schema:
+                        type: object
+                        properties:
+                            names:
+                                type: array
+                                items:
+                                    type: string
+                            mimetypes:
+                                type: array
+                                items:
+                                    type: string
+                            mimetype:
+                                type: array
+                                items:
+                                    type: integer
+                                    nullable: true
+                            sizes:
+                                type: array
+                                items:
+                                    type: integer
+                                    nullable: true
+                            created:
+                                type: array
+                                items:
+                                    type: integer
+                            is_directory:
+                                type: array
+                                items:
+                                    type: boolean
+                        example:
+                            names: [essay.txt, work]
+                            mimetypes: [text/plain]
+                            mimetype: [0, null]
+                            sizes: [1024, null]
+                            created: [1644796800, 1644796800]
+                            is_directory: [false, true]
+        "304":
+            description: The folder has not changed since the given ETag.
     """
-    body = []
+    entries = []
+    folder_path = safe_join(request.ctx.location.dir, folder)
     try:
-        folder_path = os.path.join(
-            request.app.config.LOCATIONS[int(index)]["dir"], folder
-        )
-        dirlist = os.listdir(folder_path)
-    except (FileNotFoundError, IndexError, NotADirectoryError):
+        stats = os.stat(folder_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise InvalidUsage("Bad argument values were provided.", 400)
+    if not stat.S_ISDIR(stats.st_mode):
+        raise InvalidUsage("Bad argument values were provided.", 400)
+
+    # Revisiting an unchanged folder costs this one stat.
+    media_type = negotiate_type(request.headers.get("Accept"))
+    etag = directory_etag(
+        stats, "&".join([media_type, *sorted(request.query_string.split("&"))])
+    )
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept"}
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return empty(304, headers=headers)
+
+    try:
+        with stage("filesystem"):
+            dirlist = visible(
+                request.ctx.location.dir, folder_path, os.listdir(folder_path)
+            )
+    except (FileNotFoundError, NotADirectoryError):
         raise InvalidUsage("Bad argument values were provided.", 400)
 
     for item in dirlist:
-        is_directory = await aiopath.isdir(os.path.join(folder_path, item))
-        size = None
-        if not is_directory:
-            size = parsebytes(await aiopath.getsize(os.path.join(folder_path, item)))
-        body.append(
-            {
-                "name": item,
-                "mimetype": await getmimetype(os.path.join(folder_path, item)),
-                "size": size,
-                "created": int(await aiopath.getctime(os.path.join(folder_path, item))),
-                "is_directory": is_directory,
-            }
+        item_path = os.path.join(folder_path, item)
+        item_stats = await aiofiles.os.stat(item_path)
+        is_directory = stat.S_ISDIR(item_stats.st_mode)
+        entries.append(
+            Entry(
+                item,
+                None if is_directory else await filemimetype(item_path),
+                None if is_directory else item_stats.st_size,
+                int(item_stats.st_ctime),
+                is_directory,
+            )
         )
 
-    return json({"listing": body})
+    with stage("encode"):
+        return encode_listing(entries, media_type, headers)
 
 
-@blueprint.patch("/mv/<index:int>/<filepath:path>")
+@blueprint.get("/grep/<index:int>/<folder:path>")
 @require_jwt(return_value=True)
 @check_authorized_dirs
+async def api_core_grep(
+    request: Request, index: int, folder: str, jwt: JWTDict
+) -> ResponseStream:
+    """
+    Search File Contents Endpoint
+
+    This endpoint searches the text files in a folder and its subfolders for
+    a phrase, and streams every matching line back as a line of JSON while
+    the search runs. The last line counts the files searched and those that
+    could not be read, and tells why the search was cut short, if it was:
+    `matches` once `limit` lines were found, `time` or `bytes` once the
+    search ran out of its time or size budget.
+
+    openapi:
+    ---
+    tags:
+        - filesystem
+    security:
+        - token: []
+    parameters:
+        - in: path
+          name: index
+          schema:
+              type: integer
+              example: 0
+          required: true
+          description: Index of a location from the config array of locations.
+        - in: path
+          name: folder
+          schema:
+              type: string
+              example: /path/to/folder
+          required: true
+          description: The folder to search in.
+        - in: query
+          name: q
+          schema:
+              type: string
+              example: quarterly report
+          required: true
+          description: The phrase to search for.
+        - in: query
+          name: ignore_case
+          schema:
+              type: boolean
+          description: Whether to ignore the case of ASCII letters.
+        - in: query
+          name: limit
+          schema:
+              type: integer
+              example: 100
+          description: The most lines to return, at most 1000.
+    responses:
+        "200":
+            description: The matching lines, followed by a summary.
+            content:
+                application/x-ndjson:
+                    schema:
+                        type: object
+                        properties:
+                            path:
+                                type: string
+                            line:
+                                type: integer
+                            text:
+                                type: string
+                        example:
+                            path: work/essay.txt
+                            line: 12
+                            text: the quarterly report is due
+    """
+    query = request.args.get("q", "")
+    try:
+        limit = int(request.args.get("limit", 100))
+    except ValueError:
+        raise InvalidUsage("Bad argument values were provided.", 400)
+    if not query or "\n" in query or len(query) > MAX_QUERY_LENGTH or limit < 1:
+        raise InvalidUsage("Bad argument values were provided.", 400)
+
+    path = safe_join(request.ctx.location.dir, folder)
+    if not os.path.isdir(path):
+        raise InvalidUsage("Bad argument values were provided.", 400)
+
+    search: SearchService = request.app.ctx.search
+
+    async def streaming_fn(response) -> None:
+        async def send(result: dict) -> None:
+            await response.write(ujson.dumps(result) + "\n")
+
+        with stage("search"):
+            await search.search(
+                request.ctx.location.dir,
+                path,
+                query,
+                request.args.get("ignore_case") == "true",
+                min(limit, 1000),
+                send,
+            )
+
+    return ResponseStream(streaming_fn, content_type="application/x-ndjson")
+
+
+@blueprint.patch("/mv/<index:int>/<filepath:path>")
+@require_jwt(return_value=True)
+@check_authorized_dirs(permission="move")
 async def api_core_mv(
     request: Request, index: int, filepath: str, jwt: JWTDict
 ) -> HTTPResponse:
@@ -118,6 +295,8 @@ async def api_core_mv(
 
     This endpoint moves the specified file or folder. If the request JSON has
     the `rename` key set to `true`, it will rename the file or folder instead.
+    Moves across filesystems are copied and then deleted by a background job,
+    in which case the job ID is returned with status 202.
 
     openapi:
     ---
@@ -167,50 +346,178 @@ async def api_core_mv(
                                 type: string
                         example:
                             status: OK
+        "202":
+            description: A background job was started to move the file/folder.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            status:
+                                type: string
+                            job:
+                                type: string
+                        example:
+                            status: Accepted
+                            job: 0f8fad5bd9cb469fa16570867728950e
     """
-    if not jwt["permissions"]["move"]:
-        raise Forbidden("Insufficient permissions to move files.", 403)
-
     try:
-        location = request.app.config.LOCATIONS[int(index)]["dir"]
-        file_path = os.path.join(location, filepath)
-        full_path = os.path.normpath(os.path.join(location, request.json["new_path"]))
-        full_path += (
-            "/" if (not full_path.endswith("/") and not request.json["rename"]) else ""
-        )
-    except (IndexError, KeyError):
+        location = request.ctx.location.dir
+        file_path = safe_join(location, filepath)
+        full_path = safe_join(location, request.json["new_path"])
+        rename = bool(request.json["rename"])
+    except (KeyError, TypeError):
         raise InvalidUsage("Bad argument values were provided.", 400)
+    if file_path == os.path.normpath(location):
+        raise InvalidUsage("The root of a location cannot be used here.", 400)
 
+    destination = (
+        full_path if rename else os.path.join(full_path, os.path.basename(file_path))
+    )
     if not await aiopath.exists(file_path) or (
-        not await aiopath.exists(full_path) and not request.json["rename"]
+        not await aiopath.exists(full_path) and not rename
     ):
         raise NotFound("File or folder was not found.", 404)
-    if not full_path.startswith(location):
+    if await aiopath.exists(destination):
         raise InvalidUsage(
-            "Directory traversal outside of the root location is not allowed.", 400
+            "There is already a file/folder with the same name at the destination.", 400
         )
-    if await aiopath.exists(os.path.join(full_path, os.path.basename(filepath))):
+    if destination.startswith(file_path + os.sep):
+        raise InvalidUsage("A folder cannot be moved into itself.", 400)
+
+    try:
+        fsops.rename_noreplace(file_path, destination)
+        await request.app.ctx.notifier.changed(file_path, destination)
+        return json({"status": "OK"})
+    except FileExistsError:
         raise InvalidUsage(
             "There is already a file/folder with the same name at the destination.", 400
         )
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
 
-    if not request.json["rename"]:
-        os.rename(file_path, os.path.join(full_path, os.path.basename(filepath)))
-    else:
-        os.rename(file_path, full_path)
-    return json({"status": "OK"})
+    job = await request.app.ctx.jobs.submit(
+        "mv", jwt["uname"], filepath, fsops.move, file_path, destination
+    )
+    request.app.ctx.notifier.changed_after(job, file_path, destination)
+    return json({"status": "Accepted", "job": job.id}, 202)
 
 
-@blueprint.delete("/rm/<index:int>/<filepath:path>")
+@blueprint.post("/cp/<index:int>/<filepath:path>")
 @require_jwt(return_value=True)
 @check_authorized_dirs
+async def api_core_cp(
+    request: Request, index: int, filepath: str, jwt: JWTDict
+) -> HTTPResponse:
+    """
+    Copy File/Folder Endpoint
+
+    This endpoint copies the specified file or folder in a background job and
+    returns the job ID. The copy can go to another location by setting the
+    `index` key. If the request JSON has the `rename` key set to `true`,
+    `new_path` is the path of the copy instead of the folder to copy into.
+    Requires write permissions on the destination location.
+
+    openapi:
+    ---
+    tags:
+        - filesystem
+    security:
+        - token: []
+    parameters:
+        - in: path
+          name: index
+          schema:
+              type: integer
+              example: 0
+          required: true
+          description: Index of a location from the config array of locations.
+        - in: path
+          name: filepath
+          schema:
+              type: string
+              example: /path/to/file_or_folder
+          required: true
+          description: The path to the file or folder to copy.
+    requestBody:
+        description: Configuration.
+        required: true
+        content:
+            application/json:
+                schema:
+                    type: object
+                    properties:
+                        new_path:
+                            type: string
+                        rename:
+                            type: boolean
+                        index:
+                            type: integer
+                    example:
+                        new_path: ./other/folder
+                        rename: false
+                        index: 1
+    responses:
+        "202":
+            description: A background job was started to copy the file/folder.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            status:
+                                type: string
+                            job:
+                                type: string
+                        example:
+                            status: Accepted
+                            job: 0f8fad5bd9cb469fa16570867728950e
+    """
+    try:
+        destination_location = request.app.config.LOCATION_INDEX.authorize(
+            jwt, int(request.json.get("index", index)), "write"
+        )
+        file_path = safe_join(request.ctx.location.dir, filepath)
+        full_path = safe_join(destination_location.dir, request.json["new_path"])
+        rename = bool(request.json["rename"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        raise InvalidUsage("Bad argument values were provided.", 400)
+
+    destination = (
+        full_path if rename else os.path.join(full_path, os.path.basename(file_path))
+    )
+    if not await aiopath.exists(file_path) or (
+        not await aiopath.exists(full_path) and not rename
+    ):
+        raise NotFound("File or folder was not found.", 404)
+    if os.path.lexists(destination):
+        raise InvalidUsage(
+            "There is already a file/folder with the same name at the destination.", 400
+        )
+    if destination == file_path or destination.startswith(file_path + os.sep):
+        raise InvalidUsage("A folder cannot be copied into itself.", 400)
+
+    job = await request.app.ctx.jobs.submit(
+        "cp", jwt["uname"], filepath, fsops.copy_tree, file_path, destination
+    )
+    request.app.ctx.notifier.changed_after(job, destination)
+    return json({"status": "Accepted", "job": job.id}, 202)
+
+
+@blueprint.delete("/rm/<index:int>/<filepath:path>")
+@require_jwt(return_value=True)
+@check_authorized_dirs(permission="delete")
 async def api_core_rm(
     request: Request, index: int, filepath: str, jwt: JWTDict
 ) -> HTTPResponse:
     """
     Delete File/Folder Endpoint
 
-    This endpoint deletes the specified file or folder.
+    This endpoint deletes the specified file or folder. Folders are deleted by
+    a background job, whose ID is returned with status 202. When the trash is
+    enabled, the file or folder is moved to the trash instead and the ID of
+    the trash item is returned.
 
     openapi:
     ---
@@ -243,21 +550,50 @@ async def api_core_rm(
                         properties:
                             status:
                                 type: string
+                            trash:
+                                type: string
+                                nullable: true
                         example:
                             status: OK
+                            trash: 5f2b9c61d0c84e6b8f0d9f1e2c3a4b5d
+        "202":
+            description: A background job was started to delete the folder.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            status:
+                                type: string
+                            job:
+                                type: string
+                        example:
+                            status: Accepted
+                            job: 0f8fad5bd9cb469fa16570867728950e
     """
-    if not jwt["permissions"]["delete"]:
-        raise Forbidden("Insufficient permissions to delete files.", 403)
-
-    path = os.path.join(request.app.config.LOCATIONS[int(index)]["dir"], filepath)
-    if not await aiopath.exists(path):
+    path = safe_join(request.ctx.location.dir, filepath)
+    if path == os.path.normpath(request.ctx.location.dir):
+        raise InvalidUsage("The root of a location cannot be deleted.", 400)
+    if not os.path.lexists(path):
         raise NotFound("File or folder was not found.", 404)
 
-    if await aiopath.isfile(path):
+    trash: TrashService = request.app.ctx.trash
+    if trash.enabled:
+        item = await trash.trash(request.ctx.location, path, jwt["uname"])
+        if item:
+            await request.app.ctx.notifier.changed(path)
+            return json({"status": "OK", "trash": item.id})
+
+    if not await aiopath.isdir(path) or os.path.islink(path):
         os.remove(path)
-    else:
-        shutil.rmtree(path)
-    return json({"status": "OK"})
+        await request.app.ctx.notifier.changed(path)
+        return json({"status": "OK", "trash": None})
+
+    job = await request.app.ctx.jobs.submit(
+        "rm", jwt["uname"], filepath, fsops.remove_tree, path
+    )
+    request.app.ctx.notifier.changed_after(job, path)
+    return json({"status": "Accepted", "job": job.id}, 202)
 
 
 @blueprint.post("/update-cfg")
@@ -267,7 +603,7 @@ async def api_core_update_cfg(request: Request, jwt: JWTDict) -> HTTPResponse:
     Update Configuration Endpoint
 
     This endpoint when requested, will update the server's configuration from
-    the `config.json` file. Requires admin permissions.
+    the `config.json` file on every worker. Requires admin permissions.
 
     openapi:
     ---
@@ -289,7 +625,10 @@ async def api_core_update_cfg(request: Request, jwt: JWTDict) -> HTTPResponse:
                             status: OK
     """
     if jwt["permissions"]["admin"]:
-        request.app.update_config(BunshoConfig())
+        try:
+            await request.app.ctx.coordinator.reload_config()
+        except (OSError, ValueError) as e:
+            raise InvalidUsage(f"The configuration could not be loaded: {e}", 400)
         return json({"status": "OK"})
 
     raise Forbidden("Insufficient permissions to perform administrator actions.", 403)
@@ -1,15 +1,14 @@
-import asyncio
 import os
-import shutil
 
 from aiofiles.os import path as aiopath
-from aiofiles.os import stat
+from archive import stream_archive
 from auth.authentication import JWTDict, check_authorized_dirs, require_jwt
 from sanic import Blueprint
 from sanic.exceptions import InvalidUsage, NotFound
 from sanic.request import Request
-from sanic.response import ResponseStream, file_stream
-from utils import getmimetype
+from sanic.response import ResponseStream
+from transfer import send_file
+from utils import getmimetype, safe_join, visible
 
 blueprint = Blueprint("api_download", url_prefix="/download")
 
@@ -24,6 +23,7 @@ async def api_download_single(
     Download Single File Endpoint
 
     This endpoint will stream the file requested by the user to be downloaded.
+    Single byte ranges are supported, so interrupted downloads can be resumed.
 
     openapi:
     ---
@@ -55,20 +55,19 @@ async def api_download_single(
                         type: string
                         format: binary
     """
-    path = os.path.join(request.app.config.LOCATIONS[int(index)]["dir"], filepath)
+    path = safe_join(request.ctx.location.dir, filepath)
     if not await aiopath.exists(path):
         raise NotFound("File or folder was not found.", 404)
     if not await aiopath.isfile(path):
         raise InvalidUsage("Folders cannot be downloaded by this endpoint.", 400)
 
-    return await file_stream(
-        location=path,
-        chunk_size=1048576,
-        mime_type=await getmimetype(path),
-        headers={
-            "Content-Disposition": f'Attachment; filename="{os.path.basename(path)}"',
-            "Content-Length": str((await stat(path)).st_size),
-        },
+    return await send_file(
+        request,
+        path,
+        os.path.basename(path),
+        request.ctx.location.name,
+        request.app.ctx.bandwidth.transfer(jwt),
+        await getmimetype(path),
     )
 
 
@@ -121,8 +120,7 @@ async def api_download_folder(
                         type: string
                         format: binary
     """
-    path = os.path.join(request.app.config.LOCATIONS[int(index)]["dir"], folder)
-    archive_path = f"{os.path.join(request.app.ctx.tmp_folder, path.replace('/', '_'))}"
+    path = safe_join(request.ctx.location.dir, folder)
     ext = request.args.get("ext")
     if not await aiopath.exists(path):
         raise NotFound("File or folder was not found.", 404)
@@ -130,21 +128,18 @@ async def api_download_folder(
         raise InvalidUsage("Files cannot be downloaded by this endpoint.", 400)
     if ext not in ("zip", "tar.gz"):
         raise InvalidUsage("Invalid archive type was requested.", 400)
-    if not await aiopath.exists(f"{archive_path}.{ext}"):
-        await asyncio.get_running_loop().run_in_executor(
-            None,
-            shutil.make_archive,
-            archive_path,
-            ext if ext != "tar.gz" else "gztar",
-            path,
-        )
 
-    return await file_stream(
-        location=f"{archive_path}.{ext}",
-        chunk_size=1048576,
-        mime_type=await getmimetype(f"{archive_path}.{ext}"),
-        headers={
-            "Content-Disposition": f'Attachment; filename="{os.path.basename(archive_path)}.{ext}"',
-            "Content-Length": str((await stat(f"{archive_path}.{ext}")).st_size),
-        },
+    # Built while it is sent, so it can never be served half written or stale.
+    return stream_archive(
+        path,
+        [
+            os.path.join(path, name)
+            for name in sorted(
+                visible(request.ctx.location.dir, path, os.listdir(path))
+            )
+        ],
+        ext,
+        f"{os.path.basename(path) if folder.strip('/') else request.ctx.location.name}.{ext}",
+        request.ctx.location.name,
+        request.app.ctx.bandwidth.transfer(jwt),
     )
@@ -0,0 +1,153 @@
+from auth.authentication import JWTDict, require_jwt
+from sanic import Blueprint
+from sanic.exceptions import NotFound
+from sanic.request import Request
+from sanic.response import HTTPResponse, json
+
+blueprint = Blueprint("api_jobs", url_prefix="/jobs")
+
+
+def _find_job(request: Request, job_id: str, jwt: JWTDict) -> dict:
+    job = request.app.ctx.jobs.get(job_id)
+    if not job or (job["uname"] != jwt["uname"] and not jwt["permissions"]["admin"]):
+        raise NotFound("The specified job was not found.", 404)
+    return job
+
+
+@blueprint.get("/")
+@require_jwt(return_value=True)
+async def api_jobs_list(request: Request, jwt: JWTDict) -> HTTPResponse:
+    """
+    List Jobs Endpoint
+
+    This endpoint lists the user's running and recently finished background
+    jobs. Administrators can see the jobs of every user.
+
+    openapi:
+    ---
+    tags:
+        - jobs
+    security:
+        - token: []
+    responses:
+        "200":
+            description: The user's jobs.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            jobs:
+                                type: array
+                                items:
+                                    type: object
+    """
+    return json(
+        {
+            "jobs": request.app.ctx.jobs.find_all(
+                None if jwt["permissions"]["admin"] else jwt["uname"]
+            )
+        }
+    )
+
+
+@blueprint.get("/<job_id:[0-9a-f]{32}>")
+@require_jwt(return_value=True)
+async def api_jobs_status(request: Request, job_id: str, jwt: JWTDict) -> HTTPResponse:
+    """
+    Job Status Endpoint
+
+    This endpoint returns the status and progress of a background job.
+
+    openapi:
+    ---
+    tags:
+        - jobs
+    security:
+        - token: []
+    parameters:
+        - in: path
+          name: job_id
+          schema:
+              type: string
+          required: true
+          description: The job ID returned by the endpoint that started the job.
+    responses:
+        "200":
+            description: The job's status and progress.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            id:
+                                type: string
+                            kind:
+                                type: string
+                            status:
+                                type: string
+                                enum: [running, done, cancelled, failed]
+                            phase:
+                                type: string
+                            unit:
+                                type: string
+                                enum: [items, bytes]
+                            done:
+                                type: integer
+                            total:
+                                type: integer
+                                nullable: true
+                            error:
+                                type: string
+                                nullable: true
+                        example:
+                            id: 0f8fad5bd9cb469fa16570867728950e
+                            kind: rm
+                            status: running
+                            phase: deleting
+                            unit: items
+                            done: 51200
+                            total: 1000000
+                            error: null
+    """
+    return json(_find_job(request, job_id, jwt))
+
+
+@blueprint.delete("/<job_id:[0-9a-f]{32}>")
+@require_jwt(return_value=True)
+async def api_jobs_cancel(request: Request, job_id: str, jwt: JWTDict) -> HTTPResponse:
+    """
+    Cancel Job Endpoint
+
+    This endpoint cancels a running background job. Work that was already done
+    is kept, except for partially copied files which are removed.
+
+    openapi:
+    ---
+    tags:
+        - jobs
+    security:
+        - token: []
+    parameters:
+        - in: path
+          name: job_id
+          schema:
+              type: string
+          required: true
+          description: The job ID returned by the endpoint that started the job.
+    responses:
+        "200":
+            description: The job was asked to stop.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            status:
+                                type: string
+                        example:
+                            status: OK
+    """
+    _find_job(request, job_id, jwt)
+    await request.app.ctx.jobs.cancel(job_id)
+    return json({"status": "OK"})
@@ -0,0 +1,42 @@
+from auth.authentication import JWTDict, require_jwt
+from sanic import Blueprint
+from sanic.exceptions import Forbidden
+from sanic.request import Request
+from sanic.response import HTTPResponse, text
+
+blueprint = Blueprint("api_metrics", url_prefix="/metrics")
+
+
+@blueprint.get("/")
+@require_jwt(return_value=True)
+async def api_metrics(request: Request, jwt: JWTDict) -> HTTPResponse:
+    """
+    Metrics Endpoint
+
+    This endpoint returns request latencies, time spent per stage, transferred
+    bytes, cache hit rates and executor queue depths of every worker in the
+    Prometheus text format. Only administrators can access this endpoint.
+
+    openapi:
+    ---
+    tags:
+        - admin
+    security:
+        - token: []
+    responses:
+        "200":
+            description: The metrics of all workers.
+            content:
+                text/plain:
+                    schema:
+                        type: string
+    """
+    if not jwt["permissions"]["admin"]:
+        raise Forbidden(
+            "Insufficient permissions to perform administrator actions.", 403
+        )
+
+    return text(
+        request.app.ctx.metrics.collect(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
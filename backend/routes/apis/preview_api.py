@@ -0,0 +1,113 @@
+import os
+
+from auth.authentication import JWTDict, check_authorized_dirs, require_jwt
+from previews import PREVIEW_SIZES, PreviewService, PreviewUnavailable, preview_kind
+from sanic import Blueprint
+from sanic.exceptions import InvalidUsage, NotFound
+from sanic.request import Request
+from sanic.response import HTTPResponse, empty, raw
+from transfer import etag_matches
+from utils import getmimetype, safe_join
+
+blueprint = Blueprint("api_preview", url_prefix="/preview")
+
+
+@blueprint.get("/<index:int>/<filepath:path>")
+@require_jwt(return_value=True)
+@check_authorized_dirs
+async def api_preview(
+    request: Request, index: int, filepath: str, jwt: JWTDict
+) -> HTTPResponse:
+    """
+    File Preview Endpoint
+
+    This endpoint returns a downscaled preview of an image, the first frame of
+    a video or the beginning of a text file. When the `v` query parameter is
+    set, for example to the file's modification time, the preview is cached by
+    the browser for a year.
+
+    openapi:
+    ---
+    tags:
+        - download
+    security:
+        - token: []
+    parameters:
+        - in: path
+          name: index
+          schema:
+              type: integer
+              example: 0
+          required: true
+          description: Index of a location from the config array of locations.
+        - in: path
+          name: filepath
+          schema:
+              type: string
+              example: /path/to/photo.jpg
+          required: true
+          description: The path to the file to preview.
+        - in: query
+          name: size
+          schema:
+              type: integer
+              enum: [128, 256, 512, 1024]
+          required: false
+          description: The longest side of the preview in pixels, 256 by default.
+        - in: query
+          name: v
+          schema:
+              type: string
+          required: false
+          description: A version string that allows the preview to be cached.
+    responses:
+        "200":
+            description: The preview.
+            content:
+                image/webp:
+                    schema:
+                        type: string
+                        format: binary
+                image/jpeg:
+                    schema:
+                        type: string
+                        format: binary
+                text/plain:
+                    schema:
+                        type: string
+        "304":
+            description: The cached preview is still valid.
+    """
+    try:
+        size = int(request.args.get("size", 256))
+    except ValueError:
+        size = 0
+    if size not in PREVIEW_SIZES:
+        raise InvalidUsage("Invalid preview size was requested.", 400)
+
+    path = safe_join(request.ctx.location.dir, filepath)
+    if not os.path.isfile(path):
+        raise NotFound("File was not found.", 404)
+
+    kind = preview_kind(await getmimetype(path))
+    if not kind:
+        raise InvalidUsage("Previews are not available for this file type.", 400)
+
+    previews: PreviewService = request.app.ctx.previews
+    stats = os.stat(path)
+    etag = f'"{previews.key(stats, size)}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=31536000, immutable"
+        if request.args.get("v")
+        else "private, no-cache",
+    }
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return empty(304, headers=headers)
+
+    try:
+        data, mimetype, _ = await previews.get(kind, path, stats, size)
+    except PreviewUnavailable:
+        raise InvalidUsage("A preview could not be generated for this file.", 400)
+
+    return raw(data, content_type=mimetype, headers=headers)
@@ -0,0 +1,198 @@
+from auth.authentication import JWTDict, require_jwt
+from profiling import MAX_PROFILE_SECONDS, Profiler
+from sanic import Blueprint
+from sanic.exceptions import Forbidden, InvalidUsage, NotFound
+from sanic.request import Request
+from sanic.response import HTTPResponse, json, text
+
+blueprint = Blueprint("api_profiler", url_prefix="/profiler")
+
+
+def _require_admin(jwt: JWTDict) -> None:
+    if not jwt["permissions"]["admin"]:
+        raise Forbidden(
+            "Insufficient permissions to perform administrator actions.", 403
+        )
+
+
+def _find_worker(request: Request, pid: int) -> Profiler:
+    profiler: Profiler = request.app.ctx.profiler
+    if pid not in profiler.workers():
+        raise NotFound("The specified worker was not found.", 404)
+    return profiler
+
+
+@blueprint.get("/workers")
+@require_jwt(return_value=True)
+async def api_profiler_workers(request: Request, jwt: JWTDict) -> HTTPResponse:
+    """
+    List Workers Endpoint
+
+    This endpoint lists the process IDs of the workers that can be profiled.
+    Requires admin permissions.
+
+    openapi:
+    ---
+    tags:
+        - admin
+    security:
+        - token: []
+    responses:
+        "200":
+            description: The process IDs of the workers.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            workers:
+                                type: array
+                                items:
+                                    type: integer
+                        example:
+                            workers: [1234, 1235]
+    """
+    _require_admin(jwt)
+    return json({"workers": request.app.ctx.profiler.workers()})
+
+
+@blueprint.post("/<pid:int>")
+@require_jwt(return_value=True)
+async def api_profiler_start(request: Request, pid: int, jwt: JWTDict) -> HTTPResponse:
+    """
+    Profile Worker Endpoint
+
+    This endpoint samples the stacks of a worker's event loop for the given
+    number of seconds and returns the profile, either as collapsed stacks for
+    flame graph tools or in the speedscope format. Requires admin permissions.
+
+    openapi:
+    ---
+    tags:
+        - admin
+    security:
+        - token: []
+    parameters:
+        - in: path
+          name: pid
+          schema:
+              type: integer
+          required: true
+          description: The process ID of the worker to profile.
+    requestBody:
+        description: How long to profile for and the output format.
+        content:
+            application/json:
+                schema:
+                    type: object
+                    properties:
+                        seconds:
+                            type: number
+                        output:
+                            type: string
+                            enum: [collapsed, speedscope]
+                example:
+                    seconds: 10
+                    output: speedscope
+    responses:
+        "200":
+            description: The profile.
+            content:
+                text/plain:
+                    schema:
+                        type: string
+                application/json:
+                    schema:
+                        type: object
+    """
+    _require_admin(jwt)
+    profiler = _find_worker(request, pid)
+    body = request.json if isinstance(request.json, dict) else {}
+    seconds = body.get("seconds", 10)
+    output = body.get("output", "collapsed")
+    if (
+        not isinstance(seconds, (int, float))
+        or not 0 < seconds <= MAX_PROFILE_SECONDS
+        or output not in ("collapsed", "speedscope")
+    ):
+        raise InvalidUsage("Bad argument values were provided.", 400)
+
+    profile = await profiler.profile(pid, seconds, output)
+    if output == "speedscope":
+        return json(profile)
+    return text(profile)
+
+
+@blueprint.delete("/<pid:int>")
+@require_jwt(return_value=True)
+async def api_profiler_stop(request: Request, pid: int, jwt: JWTDict) -> HTTPResponse:
+    """
+    Stop Profiling Endpoint
+
+    This endpoint stops a running profile of a worker early, in which case the
+    profile endpoint returns what was sampled so far. Requires admin
+    permissions.
+
+    openapi:
+    ---
+    tags:
+        - admin
+    security:
+        - token: []
+    parameters:
+        - in: path
+          name: pid
+          schema:
+              type: integer
+          required: true
+          description: The process ID of the profiled worker.
+    responses:
+        "200":
+            description: Profiling was stopped.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            status:
+                                type: string
+                        example:
+                            status: OK
+    """
+    _require_admin(jwt)
+    await _find_worker(request, pid).stop_profiles(pid)
+    return json({"status": "OK"})
+
+
+@blueprint.get("/slow-requests")
+@require_jwt(return_value=True)
+async def api_profiler_slow_requests(request: Request, jwt: JWTDict) -> HTTPResponse:
+    """
+    Slow Requests Endpoint
+
+    This endpoint lists the requests of the last hour that took longer than
+    `SLOW_REQUEST_THRESHOLD` seconds, newest first, with the collapsed stacks
+    that were sampled from the event loop while they were in flight. Requires
+    admin permissions.
+
+    openapi:
+    ---
+    tags:
+        - admin
+    security:
+        - token: []
+    responses:
+        "200":
+            description: The slow requests.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            requests:
+                                type: array
+                                items:
+                                    type: object
+    """
+    _require_admin(jwt)
+    return json({"requests": request.app.ctx.profiler.slow_requests()})
@@ -0,0 +1,200 @@
+import os
+from datetime import datetime, timezone
+
+from auth.authentication import JWTDict, check_authorized_dirs, require_jwt
+from database import SQLiteInterface
+from sanic import Blueprint
+from sanic.exceptions import InvalidUsage, NotFound
+from sanic.request import Request
+from sanic.response import HTTPResponse, json
+from shares import SHARE_CODE_PATTERN, Share
+from utils import generateshare, safe_join
+
+blueprint = Blueprint("api_share", url_prefix="/share")
+
+
+def _positive_int(body: dict, key: str):
+    value = body.get(key)
+    if value is not None and (
+        not isinstance(value, int) or isinstance(value, bool) or value <= 0
+    ):
+        raise InvalidUsage("Bad argument values were provided.", 400)
+    return value
+
+
+@blueprint.post("/<index:int>/<filepath:path>")
+@require_jwt(return_value=True)
+@check_authorized_dirs(permission="share")
+async def api_share_create(
+    request: Request, index: int, filepath: str, db: SQLiteInterface, jwt: JWTDict
+) -> HTTPResponse:
+    """
+    Create Share Link Endpoint
+
+    This endpoint creates a public link to a file that can be downloaded
+    without logging in. The link can expire after a number of seconds and be
+    limited to a number of downloads.
+
+    openapi:
+    ---
+    tags:
+        - share
+    security:
+        - token: []
+    parameters:
+        - in: path
+          name: index
+          schema:
+              type: integer
+              example: 0
+          required: true
+          description: Index of a location from the config array of locations.
+        - in: path
+          name: filepath
+          schema:
+              type: string
+              example: /path/to/file.pdf
+          required: true
+          description: The path to the file to share.
+    requestBody:
+        description: Optional limits of the link.
+        content:
+            application/json:
+                schema:
+                    type: object
+                    properties:
+                        expires_in:
+                            type: integer
+                            nullable: true
+                        max_downloads:
+                            type: integer
+                            nullable: true
+                example:
+                    expires_in: 604800
+                    max_downloads: 10
+    responses:
+        "200":
+            description: The share link was created.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            code:
+                                type: string
+                            url:
+                                type: string
+                            expiry:
+                                type: integer
+                                nullable: true
+                        example:
+                            code: 3Zb2xq8Y_wZ1mTfA
+                            url: /s/3Zb2xq8Y_wZ1mTfA
+                            expiry: 1650000000
+    """
+    body = request.json if isinstance(request.json, dict) else {}
+    expires_in = _positive_int(body, "expires_in")
+    max_downloads = _positive_int(body, "max_downloads")
+
+    path = safe_join(request.ctx.location.dir, filepath)
+    if not os.path.isfile(path):
+        raise NotFound("File was not found.", 404)
+
+    code = generateshare()
+    expiry = (
+        int(datetime.now(tz=timezone.utc).timestamp()) + expires_in
+        if expires_in
+        else None
+    )
+    await db.insert_share(
+        code,
+        request.ctx.location.name,
+        os.path.relpath(path, request.ctx.location.dir),
+        jwt["uname"],
+        expiry,
+        max_downloads,
+    )
+    return json({"code": code, "url": f"/s/{code}", "expiry": expiry})
+
+
+@blueprint.get("/")
+@require_jwt(return_value=True)
+async def api_share_list(
+    request: Request, db: SQLiteInterface, jwt: JWTDict
+) -> HTTPResponse:
+    """
+    List Share Links Endpoint
+
+    This endpoint lists the user's share links, newest first. Administrators
+    can see the share links of every user. Download counts can lag behind by
+    a few seconds.
+
+    openapi:
+    ---
+    tags:
+        - share
+    security:
+        - token: []
+    responses:
+        "200":
+            description: The user's share links.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            shares:
+                                type: array
+                                items:
+                                    type: object
+    """
+    rows = await db.find_shares(None if jwt["permissions"]["admin"] else jwt["uname"])
+    return json({"shares": [Share(*row).to_dict() for row in rows]})
+
+
+@blueprint.delete(f"/<code:{SHARE_CODE_PATTERN}>")
+@require_jwt(return_value=True)
+async def api_share_delete(
+    request: Request, code: str, db: SQLiteInterface, jwt: JWTDict
+) -> HTTPResponse:
+    """
+    Delete Share Link Endpoint
+
+    This endpoint deletes a share link, after which it stops working on every
+    worker.
+
+    openapi:
+    ---
+    tags:
+        - share
+    security:
+        - token: []
+    parameters:
+        - in: path
+          name: code
+          schema:
+              type: string
+          required: true
+          description: The code of the share link.
+    responses:
+        "200":
+            description: The share link was deleted.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            status:
+                                type: string
+                        example:
+                            status: OK
+    """
+    row = await db.find_share(code)
+    if not row or (
+        Share(*row[:8]).uname != jwt["uname"] and not jwt["permissions"]["admin"]
+    ):
+        raise NotFound("The specified share link was not found.", 404)
+
+    await db.delete_share(code)
+    await request.app.ctx.coordinator.invalidate("shares", code)
+    return json({"status": "OK"})
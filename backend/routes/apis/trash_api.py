@@ -0,0 +1,120 @@
+from auth.authentication import JWTDict, check_authorized_dirs, require_jwt
+from sanic import Blueprint
+from sanic.exceptions import InvalidUsage, NotFound
+from sanic.request import Request
+from sanic.response import HTTPResponse, json
+from trash import TrashService
+from utils import safe_join
+
+blueprint = Blueprint("api_trash", url_prefix="/trash")
+
+
+@blueprint.get("/<index:int>")
+@require_jwt(return_value=True)
+@check_authorized_dirs(permission="delete")
+async def api_trash_list(request: Request, index: int, jwt: JWTDict) -> HTTPResponse:
+    """
+    List Trash Endpoint
+
+    This endpoint lists what the user moved to the trash of a location, most
+    recently deleted first. Administrators can see the items of every user.
+    Items are purged for good once they expire.
+
+    openapi:
+    ---
+    tags:
+        - trash
+    security:
+        - token: []
+    parameters:
+        - in: path
+          name: index
+          schema:
+              type: integer
+              example: 0
+          required: true
+          description: Index of a location from the config array of locations.
+    responses:
+        "200":
+            description: The items in the trash.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            trash:
+                                type: array
+                                items:
+                                    type: object
+    """
+    trash: TrashService = request.app.ctx.trash
+    items = await trash.find_all(
+        request.ctx.location, None if jwt["permissions"]["admin"] else jwt["uname"]
+    )
+    return json({"trash": [item.to_dict(trash.retention) for item in items]})
+
+
+@blueprint.post("/<index:int>/<item_id:[0-9a-f]{32}>")
+@require_jwt(return_value=True)
+@check_authorized_dirs(permission="delete")
+async def api_trash_restore(
+    request: Request, index: int, item_id: str, jwt: JWTDict
+) -> HTTPResponse:
+    """
+    Restore From Trash Endpoint
+
+    This endpoint moves an item in the trash back to where it was deleted
+    from. Folders that no longer exist on the way there are created again.
+
+    openapi:
+    ---
+    tags:
+        - trash
+    security:
+        - token: []
+    parameters:
+        - in: path
+          name: index
+          schema:
+              type: integer
+              example: 0
+          required: true
+          description: Index of a location from the config array of locations.
+        - in: path
+          name: item_id
+          schema:
+              type: string
+          required: true
+          description: The ID of the item in the trash.
+    responses:
+        "200":
+            description: The item was restored.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            status:
+                                type: string
+                        example:
+                            status: OK
+    """
+    trash: TrashService = request.app.ctx.trash
+    item = await trash.find(item_id)
+    if (
+        not item
+        or item.location != request.ctx.location.name
+        or (item.uname != jwt["uname"] and not jwt["permissions"]["admin"])
+    ):
+        raise NotFound("The specified item was not found in the trash.", 404)
+
+    destination = safe_join(request.ctx.location.dir, item.path)
+    try:
+        await trash.restore(request.ctx.location, item, destination)
+    except FileExistsError:
+        raise InvalidUsage(
+            "There is already a file/folder with the same name at the destination.",
+            400,
+        )
+    await request.app.ctx.notifier.changed(destination)
+    return json({"status": "OK"})
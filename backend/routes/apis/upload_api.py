@@ -1,13 +1,35 @@
+import asyncio
+import io
 import os
 
 import aiofiles
 from aiofiles.os import path as aiopath
 from auth.authentication import JWTDict, require_jwt
+from auth.authorization import LocationIndex
 from database import TempDBInterface
+from extract import (
+    CHUNK_SIZE,
+    FORMATS,
+    QUEUE_SIZE,
+    QueueReader,
+    extract_tar,
+    extract_zip,
+    feed,
+    release,
+)
+from metrics import TRANSFERRED_BYTES
 from sanic import Blueprint
 from sanic.exceptions import Forbidden, InvalidUsage, NotFound
 from sanic.request import Request
 from sanic.response import HTTPResponse, json
+from uploads import (
+    UPLOADS_FOLDER,
+    commit_partial,
+    commit_partial_tree,
+    partial_path,
+    remove_partial,
+)
+from utils import safe_join
 
 blueprint = Blueprint("api_upload", url_prefix="/upload")
 
@@ -57,12 +79,10 @@ async def api_upload_file_metadata(request: Request, jwt: JWTDict) -> HTTPRespon
                             uuid:
                                 type: string
     """
-    if not jwt["permissions"]["write"]:
+    location_index: LocationIndex = request.app.config.LOCATION_INDEX
+    if not location_index.has_permission(jwt, "write"):
         raise Forbidden("Insufficient permissions to write files.", 403)
 
-    cfg = request.app.config
-    valid_locations = [l["name"] for l in cfg.LOCATIONS]
-    authorized = False
     try:
         location = request.json["location"]
         folder = request.json["folder"]
@@ -70,41 +90,32 @@ async def api_upload_file_metadata(request: Request, jwt: JWTDict) -> HTTPRespon
     except KeyError:
         raise InvalidUsage("Bad argument values were provided.", 400)
 
-    if location not in valid_locations:
+    if location not in location_index.by_name:
         raise NotFound("The provided location was not found.", 404)
 
-    if jwt["authorized_locations"] == "all":
-        authorized = True
-    for authorized_location in jwt["authorized_locations"]:
-        if authorized_location in valid_locations:
-            authorized = True
-
-    if authorized:
-        location_dir = next((i for i in cfg.LOCATIONS if i["name"] == location))["dir"]
-        full_location = os.path.normpath(
-            os.path.join(location_dir, folder, os.path.basename(filename))
+    location_dir = location_index.authorize(
+        jwt, location_index.by_name[location].index
+    ).dir
+    full_location = safe_join(location_dir, folder, os.path.basename(filename))
+    if not await aiopath.exists(os.path.dirname(full_location)):
+        raise InvalidUsage(
+            "Directory traversal outside of the root location is not allowed.", 400
         )
-        if not full_location.startswith(location_dir) or not await aiopath.exists(
-            os.path.dirname(full_location)
-        ):
-            raise InvalidUsage(
-                "Directory traversal outside of the root location is not allowed.", 400
-            )
-        if await aiopath.exists(full_location):
-            raise InvalidUsage(
-                "There is already a file/folder with the same name at the destination.",
-                400,
-            )
-
-        return json(
-            {
-                "uuid": await request.app.ctx.tempdb.insert_uuid(
-                    jwt["uname"], full_location
-                ),
-            }
+    if await aiopath.exists(full_location):
+        raise InvalidUsage(
+            "There is already a file/folder with the same name at the destination.",
+            400,
         )
 
-    raise Forbidden("Insufficient permissions to access this location.", 403)
+    return json(
+        {
+            "uuid": await request.app.ctx.tempdb.insert_uuid(
+                jwt["uname"],
+                full_location,
+                request.app.config.get("UPLOAD_SESSION_TTL", 86400),
+            ),
+        }
+    )
 
 
 @blueprint.put("/file", stream=True)
@@ -151,20 +162,201 @@ async def api_upload_file(
                         example:
                             status: OK
     """
-    if not jwt["permissions"]["write"]:
+    if not request.app.config.LOCATION_INDEX.has_permission(jwt, "write"):
         raise Forbidden("Insufficient permissions to write files.", 403)
 
-    entry: tuple = await tempdb.find_uuid(request.args.get("uuid"))
+    entry: tuple = tempdb.find_uuid(request.args.get("uuid"))
     if entry:
-        async with aiofiles.open(entry[2], "wb") as filepath:
-            while True:
-                body = await request.stream.read()  # type: ignore
-                if body is None:
-                    break
+        location = request.app.config.LOCATION_INDEX.locate(entry[2])
+        if location is None:
+            raise NotFound("The location of this upload no longer exists.", 404)
+
+        # The file only appears at its destination once it is complete.
+        part = partial_path(location.dir, entry[0])
+        await aiofiles.os.makedirs(
+            os.path.join(location.dir, UPLOADS_FOLDER), exist_ok=True
+        )
+        uploaded = 0
+        loop = asyncio.get_running_loop()
+        transfer = request.app.ctx.bandwidth.transfer(jwt)
+        try:
+            async with transfer, aiofiles.open(part, "wb") as filepath:
+                while True:
+                    body = await request.stream.read()  # type: ignore
+                    if body is None:
+                        break
 
-                await filepath.write(body)
+                    await filepath.write(body)
+                    await transfer.throttle(len(body))
+                    uploaded += len(body)
 
-        await tempdb.delete_uuid(request.args.get("uuid"))
+            await loop.run_in_executor(None, commit_partial, part, entry[2])
+            await request.app.ctx.notifier.changed(entry[2])
+        except FileExistsError:
+            await loop.run_in_executor(None, remove_partial, part)
+            raise InvalidUsage(
+                "There is already a file/folder with the same name at the destination.",
+                400,
+            )
+        except BaseException:
+            await loop.run_in_executor(None, remove_partial, part)
+            raise
+        finally:
+            TRANSFERRED_BYTES.inc(uploaded, direction="upload", location=location.name)
+
+        await tempdb.delete_uuid(entry[0])
         return json({"status": "OK"})
 
     raise NotFound("The specified UUID was not found.", 404)
+
+
+@blueprint.put("/archive", stream=True)
+@require_jwt(return_value=True)
+async def api_upload_archive(
+    request: Request, tempdb: TempDBInterface, jwt: JWTDict
+) -> HTTPResponse:
+    """
+    Upload Archive Endpoint
+
+    This endpoint takes a tar, tar.gz or zip archive and extracts it into the
+    destination folder, so a whole tree can be uploaded in one request. Tar
+    archives are extracted while they are being uploaded. Zip archives are
+    extracted once the upload is complete. Only files and folders are
+    extracted. The tree only appears in the destination once it was
+    extracted completely.
+
+    openapi:
+    ---
+    tags:
+        - upload
+    security:
+        - token: []
+    parameters:
+        - in: query
+          name: location
+          schema:
+              type: string
+          required: true
+          description: The name of the location to extract to.
+        - in: query
+          name: folder
+          schema:
+              type: string
+          required: false
+          description: The folder to extract to, the root of the location by default.
+        - in: query
+          name: format
+          schema:
+              type: string
+              enum: [tar, tar.gz, zip]
+          required: true
+          description: The format of the archive.
+    requestBody:
+        description: The archive to be extracted.
+        content:
+            application/octet-stream:
+                schema:
+                    type: string
+                    format: binary
+    responses:
+        "200":
+            description: The archive was extracted successfully.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            status:
+                                type: string
+                            files:
+                                type: integer
+                        example:
+                            status: OK
+                            files: 100000
+    """
+    location_index: LocationIndex = request.app.config.LOCATION_INDEX
+    if not location_index.has_permission(jwt, "write"):
+        raise Forbidden("Insufficient permissions to write files.", 403)
+
+    archive_format = request.args.get("format")
+    if "location" not in request.args or archive_format not in FORMATS:
+        raise InvalidUsage("Bad argument values were provided.", 400)
+    if request.args.get("location") not in location_index.by_name:
+        raise NotFound("The provided location was not found.", 404)
+
+    location = location_index.authorize(
+        jwt, location_index.by_name[request.args.get("location")].index
+    )
+    destination = safe_join(location.dir, request.args.get("folder", ""))
+    if not await aiopath.isdir(destination):
+        raise InvalidUsage("The destination folder does not exist.", 400)
+
+    # A session keeps the sweeper away from the partial tree.
+    uuid = await tempdb.insert_uuid(
+        jwt["uname"],
+        destination,
+        request.app.config.get("UPLOAD_SESSION_TTL", 86400),
+    )
+    staging = partial_path(location.dir, uuid)
+    await aiofiles.os.makedirs(staging)
+    loop = asyncio.get_running_loop()
+    transfer = request.app.ctx.bandwidth.transfer(jwt)
+    uploaded = 0
+    try:
+        if archive_format == "zip":
+            spool = partial_path(location.dir, uuid, ".zip")
+            try:
+                async with transfer, aiofiles.open(spool, "wb") as f:
+                    while True:
+                        body = await request.stream.read()  # type: ignore
+                        if body is None:
+                            break
+
+                        await f.write(body)
+                        await transfer.throttle(len(body))
+                        uploaded += len(body)
+
+                files = await loop.run_in_executor(None, extract_zip, spool, staging)
+            finally:
+                await loop.run_in_executor(None, remove_partial, spool)
+        else:
+            queue: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+            extractor = loop.run_in_executor(
+                None,
+                extract_tar,
+                io.BufferedReader(QueueReader(loop, queue), CHUNK_SIZE),
+                staging,
+                archive_format == "tar.gz",
+            )
+            try:
+                async with transfer:
+                    while True:
+                        body = await request.stream.read()  # type: ignore
+                        if not await feed(queue, body, extractor) or body is None:
+                            break
+
+                        await transfer.throttle(len(body))
+                        uploaded += len(body)
+            except BaseException:
+                release(queue)
+                await asyncio.gather(extractor, return_exceptions=True)
+                raise
+            files = await extractor
+
+        added = [os.path.join(destination, name) for name in os.listdir(staging)]
+        await loop.run_in_executor(None, commit_partial_tree, staging, destination)
+        await request.app.ctx.notifier.changed(*added)
+    except FileExistsError:
+        await loop.run_in_executor(None, remove_partial, staging)
+        raise InvalidUsage(
+            "There is already a file/folder with the same name at the destination.",
+            400,
+        )
+    except BaseException:
+        await loop.run_in_executor(None, remove_partial, staging)
+        raise
+    finally:
+        TRANSFERRED_BYTES.inc(uploaded, direction="upload", location=location.name)
+        await tempdb.delete_uuid(uuid)
+
+    return json({"status": "OK", "files": files})
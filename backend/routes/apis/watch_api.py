@@ -0,0 +1,98 @@
+import os
+import time
+
+import ujson
+from auth.authentication import authenticate
+from notifications import MAX_SUBSCRIPTIONS, ChangeNotifier, Client
+from sanic import Blueprint
+from sanic.exceptions import InvalidUsage, SanicException
+from sanic.request import Request
+from utils import safe_join
+
+blueprint = Blueprint("api_watch", url_prefix="/watch")
+
+# Seconds a client has to send its token when it did not send it as a header.
+AUTH_TIMEOUT = 10
+
+
+async def _authenticate(request: Request, ws):
+    if request.token:
+        return await authenticate(request)
+
+    message = await ws.recv(AUTH_TIMEOUT)
+    if message is None:
+        raise InvalidUsage("No token was sent.", 400)
+    try:
+        token = ujson.loads(message)["token"]
+    except (ValueError, KeyError, TypeError):
+        raise InvalidUsage("The first message must carry the token.", 400)
+    return await authenticate(request, str(token))
+
+
+async def _handle(request: Request, client: Client, message) -> dict:
+    notifier: ChangeNotifier = request.app.ctx.notifier
+    try:
+        body = ujson.loads(message)
+        action = "subscribe" if "subscribe" in body else "unsubscribe"
+        index = int(body[action]["location"])
+        folder = str(body[action].get("folder", ""))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise InvalidUsage("Bad argument values were provided.", 400)
+
+    location = request.app.config.LOCATION_INDEX.authorize(client.jwt, index, None)
+    path = safe_join(location.dir, folder)
+    if action == "unsubscribe":
+        notifier.unsubscribe(client, path)
+        return {"unsubscribed": {"location": index, "folder": folder}}
+
+    if not os.path.isdir(path):
+        raise InvalidUsage("Bad argument values were provided.", 400)
+    if len(client.subscriptions) >= MAX_SUBSCRIPTIONS:
+        raise InvalidUsage(
+            f"A connection can watch at most {MAX_SUBSCRIPTIONS} folders.", 400
+        )
+    await notifier.subscribe(client, index, folder, location.dir, path)
+    return {"subscribed": {"location": index, "folder": folder}}
+
+
+@blueprint.websocket("/")
+async def api_watch(request: Request, ws) -> None:
+    """
+    Watch Folders Endpoint
+
+    This WebSocket pushes the changes of the folders a client subscribes to,
+    so that listings can be kept up to date without polling. The token is
+    sent in the Authorization header or, from browsers, as the first message:
+    `{"token": "..."}`. Folders are then watched with
+    `{"subscribe": {"location": 0, "folder": "path/to/folder"}}` and no longer
+    watched with the same message using `unsubscribe`.
+
+    Changes arrive as `{"location": 0, "folder": "path/to/folder", "changes":
+    [{"type": "added", "name": "essay.txt", "is_directory": false}]}`, where
+    the type is one of `added`, `removed` or `modified`. A `{"resync": true}`
+    message means that changes were dropped because the client read them too
+    slowly, and that it should list its folders again. The connection is
+    closed with code 4401 once the token expires or is invalidated.
+    """
+    try:
+        jwt = await _authenticate(request, ws)
+    except SanicException as e:
+        await ws.close(4401 if e.status_code == 401 else 4400, str(e))
+        return
+
+    notifier: ChangeNotifier = request.app.ctx.notifier
+    client = Client(ws, jwt, request.app.ctx.tempdb.verify_jwt_blacklist)
+    sender = request.app.loop.create_task(client.send_task())
+    try:
+        while True:
+            message = await ws.recv(max(0, jwt["exp"] - time.time()))
+            if message is None or not client.authorized():
+                await ws.close(4401, "This token is no longer valid.")
+                return
+            try:
+                client.send(await _handle(request, client, message))
+            except SanicException as e:
+                client.send({"error": str(e)})
+    finally:
+        sender.cancel()
+        notifier.disconnect(client)
@@ -0,0 +1,61 @@
+import mimetypes
+import os
+import stat
+
+from auth.authorization import LocationIndex
+from sanic import Blueprint
+from sanic.exceptions import NotFound
+from sanic.request import Request
+from sanic.response import ResponseStream
+from shares import SHARE_CODE_PATTERN, ShareService
+from transfer import requested_range, send_file
+from utils import safe_join
+
+blueprint = Blueprint("share")
+
+
+@blueprint.get(f"/s/<code:{SHARE_CODE_PATTERN}>")
+async def shared_file(request: Request, code: str) -> ResponseStream:
+    # Public, so neither a token nor, for links without a download limit, the
+    # database is involved once the code is cached.
+    shares: ShareService = request.app.ctx.shares
+    share = await shares.get(code)
+    if not share or share.expired:
+        raise NotFound("This share link does not exist or has expired.", 404)
+
+    # Links are only as good as their owner's access to the location.
+    location_index: LocationIndex = request.app.config.LOCATION_INDEX
+    location = location_index.by_name.get(share.location)
+    if (
+        not location
+        or not share.owner
+        or not location_index.location_mask(share.owner["authorized_locations"])
+        & (1 << location.index)
+        or not location_index.has_permission(share.owner, "share")
+    ):
+        raise NotFound("This share link does not exist or has expired.", 404)
+    path = safe_join(location.dir, share.path)
+    try:
+        stats = os.stat(path)
+    except OSError:
+        stats = None
+    if not stats or not stat.S_ISREG(stats.st_mode):
+        raise NotFound("The shared file no longer exists.", 404)
+
+    # A resumed download is counted once, when it started. Anything sent from
+    # the first byte on counts as a download of its own.
+    byte_range = requested_range(request, stats)
+    if (byte_range is None or byte_range[0] == 0) and not await shares.count_download(
+        share
+    ):
+        raise NotFound("This share link has reached its download limit.", 404)
+
+    filename = os.path.basename(path)
+    return await send_file(
+        request,
+        path,
+        filename,
+        location.name,
+        request.app.ctx.bandwidth.transfer(None),
+        mimetypes.guess_type(filename)[0],
+    )
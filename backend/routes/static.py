@@ -1,12 +1,137 @@
+import hashlib
+import mimetypes
+import os
+from typing import NamedTuple, Union
+
+from compression import available_encodings, compress, is_compressible, negotiate
+from metrics import cache_lookup
 from sanic import Blueprint
+from sanic.exceptions import NotFound
+from sanic.log import logger
 from sanic.request import Request
-from sanic.response import HTTPResponse, file
+from sanic.response import HTTPResponse, empty, raw
+from transfer import etag_matches
 
 blueprint = Blueprint("static")
-blueprint.static("/assets", "../frontend/dist/assets", name="static_assets")
+
+
+class StaticFile(NamedTuple):
+    content_type: str
+    etag: str
+    variants: dict[str, bytes]
+
+
+class StaticBundle:
+    """
+    The built frontend held in memory. Loaded once in the main process, so
+    the workers share it, with every compressible file compressed ahead of
+    time at the highest level of each available encoding. The compressed
+    variants are kept on disk by content hash, so only files that changed
+    since the last start are compressed again.
+    """
+
+    def __init__(self, index: Union[StaticFile, None], assets: dict[str, StaticFile]):
+        self.index = index
+        self.assets = assets
+
+    @staticmethod
+    def _compress(data: bytes, digest: str, encoding: str, cache: str) -> bytes:
+        path = os.path.join(cache, f"{digest}.{encoding}")
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+
+        compressed = compress(data, encoding, best=True)
+        with open(f"{path}.tmp{os.getpid()}", "wb") as f:
+            f.write(compressed)
+        os.replace(f"{path}.tmp{os.getpid()}", path)
+        return compressed
+
+    @classmethod
+    def _load_file(cls, path: str, cache: str) -> tuple[StaticFile, str]:
+        with open(path, "rb") as f:
+            data = f.read()
+
+        digest = hashlib.sha256(data).hexdigest()
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        variants = {"identity": data}
+        if is_compressible(content_type):
+            for encoding in available_encodings():
+                compressed = cls._compress(data, digest, encoding, cache)
+                if len(compressed) < len(data):
+                    variants[encoding] = compressed
+
+        return StaticFile(content_type, f'"{digest[:32]}"', variants), digest
+
+    @classmethod
+    def load(cls, dist: str, cache: str) -> "StaticBundle":
+        if not os.path.isfile(os.path.join(dist, "index.html")):
+            logger.warning("[App]: The frontend has not been built yet")
+            return cls(None, {})
+
+        os.makedirs(cache, exist_ok=True)
+        digests = set()
+        assets = {}
+        for current, _, files in os.walk(os.path.join(dist, "assets")):
+            for name in files:
+                path = os.path.join(current, name)
+                static_file, digest = cls._load_file(path, cache)
+                assets[
+                    os.path.relpath(path, os.path.join(dist, "assets"))
+                ] = static_file
+                digests.add(digest)
+        index, digest = cls._load_file(os.path.join(dist, "index.html"), cache)
+        digests.add(digest)
+
+        # Variants of files from earlier builds are never served again.
+        for name in os.listdir(cache):
+            if name.split(".", 1)[0] not in digests:
+                os.remove(os.path.join(cache, name))
+
+        return cls(index, assets)
+
+
+def _serve(
+    request: Request, static_file: StaticFile, cache_control: str
+) -> HTTPResponse:
+    headers = {
+        "ETag": static_file.etag,
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+    }
+    revalidated = etag_matches(request.headers.get("If-None-Match"), static_file.etag)
+    cache_lookup("static", revalidated)
+    if revalidated:
+        return empty(304, headers=headers)
+
+    encoding = negotiate(
+        request.headers.get("Accept-Encoding"),
+        [i for i in available_encodings() if i in static_file.variants],
+    )
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return raw(
+        static_file.variants[encoding or "identity"],
+        content_type=static_file.content_type,
+        headers=headers,
+    )
+
+
+@blueprint.get("/assets/<filename:path>")
+async def static_assets(request: Request, filename: str) -> HTTPResponse:
+    # Vite puts a content hash in every asset name, so they never change.
+    static_file = request.app.ctx.static_bundle.assets.get(filename)
+    if not static_file:
+        raise NotFound("Requested asset was not found.", 404)
+    return _serve(request, static_file, "public, max-age=31536000, immutable")
 
 
 @blueprint.get("/")  # type: ignore
 @blueprint.get(r"/<path:[^/api].*?>")
-async def static_root(_request: Request, path: str = None) -> HTTPResponse:
-    return await file("../frontend/dist/index.html")
+async def static_root(request: Request, path: str = None) -> HTTPResponse:
+    static_file = request.app.ctx.static_bundle.index
+    if not static_file:
+        raise NotFound("The frontend has not been built yet.", 404)
+    return _serve(request, static_file, "no-cache")
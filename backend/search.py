@@ -0,0 +1,269 @@
+import asyncio
+import mmap
+import multiprocessing
+import os
+import re
+import stat
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Awaitable, Callable, Union
+
+from previews import preview_kind
+from sanic.config import Config
+from utils import visible
+
+# Bytes of a file searched between two looks at the deadline.
+WINDOW = 16777216
+# Characters of the line kept on either side of a match.
+CONTEXT = 80
+MAX_QUERY_LENGTH = 1024
+
+
+class OverBudget(Exception):
+    pass
+
+
+def _mimetype(path: str) -> Union[str, None]:
+    import magic
+
+    try:
+        return magic.from_file(path, mime=True)
+    except Exception:
+        return None
+
+
+def _collect(
+    root: str, folder: str, deadline: float
+) -> tuple[list[tuple[str, int]], Union[str, None]]:
+    # The files that may be searched and their sizes, in walking order.
+    files = []
+    for current, dirs, names in os.walk(folder):
+        dirs[:] = visible(root, current, dirs)
+        for name in names:
+            path = os.path.join(current, name)
+            try:
+                stats = os.stat(path, follow_symlinks=False)
+            except OSError:
+                continue
+            if not stat.S_ISREG(stats.st_mode):
+                continue
+
+            files.append((path, stats.st_size))
+        if time.time() > deadline:
+            return files, "time"
+    return files, None
+
+
+def search_file(
+    path: str,
+    query: str,
+    ignore_case: bool,
+    limit: int,
+    deadline: float,
+    max_bytes: int,
+) -> Union[list[dict], None]:
+    """
+    Returns up to `limit` lines of a text file that contain `query`, or
+    `None` when the file is not text. Text files larger than `max_bytes`
+    raise `OverBudget`. The file is mapped instead of read, so it is
+    searched without being copied, one window at a time until the deadline.
+    """
+    if preview_kind(_mimetype(path)) != "text":
+        return None
+
+    needle = query.encode()
+    pattern = re.compile(re.escape(needle), re.IGNORECASE if ignore_case else 0)
+    matches: list[dict] = []
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size > max_bytes:
+            raise OverBudget()
+        if not size:
+            return matches
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            line = 1
+            counted = 0
+            start = 0
+            while start < size and len(matches) < limit and time.time() < deadline:
+                end = min(size, start + WINDOW)
+                # Overlaps the next window so that matches across the edge count.
+                match = pattern.search(data, start, min(size, end + len(needle) - 1))
+                if match is None:
+                    start = end
+                    continue
+
+                position = match.start()
+                line += data[counted:position].count(b"\n")
+                counted = position
+                line_start = data.rfind(b"\n", 0, position) + 1
+                line_end = data.find(b"\n", position)
+                if line_end == -1:
+                    line_end = size
+                matches.append(
+                    {
+                        "line": line,
+                        "text": data[
+                            max(line_start, position - CONTEXT) : min(
+                                line_end, match.end() + CONTEXT
+                            )
+                        ].decode("utf-8", errors="replace"),
+                    }
+                )
+                # Like grep, every line is reported once.
+                start = line_end + 1
+    return matches
+
+
+class SearchService:
+    """
+    Searches the contents of text files in a process pool. Every search has
+    a deadline and a budget of bytes, keeps no more files in flight than
+    there are processes so that concurrent searches take turns, and stops
+    as soon as it has found enough matches.
+    """
+
+    def __init__(self, config: Config):
+        self._config = config
+        self._workers: int = config.get("SEARCH_WORKERS", 2)
+        self._executor: Union[ProcessPoolExecutor, None] = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=multiprocessing.get_context("fork"),
+            )
+        return self._executor
+
+    async def search(
+        self,
+        root: str,
+        folder: str,
+        query: str,
+        ignore_case: bool,
+        limit: int,
+        send: Callable[[dict], Awaitable],
+    ) -> None:
+        """
+        Sends every match, with its path relative to `root`, followed by a
+        summary saying whether and why the search was cut short.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = time.time() + self._config.get("SEARCH_TIMEOUT", 10)
+        files, truncated = await loop.run_in_executor(
+            None, _collect, root, folder, deadline
+        )
+
+        # Only text files are charged to the budget. Files being searched have
+        # their size reserved until it is known whether they were text, and a
+        # file that does not fit next to them waits for them to finish.
+        budget = self._config.get("SEARCH_MAX_BYTES", 268435456)
+        remaining = iter(files)
+        waiting = None
+        running: dict[asyncio.Future, tuple[str, int, ProcessPoolExecutor]] = {}
+        searched = 0
+        failed = 0
+        found = 0
+        try:
+            while True:
+                while len(running) < self._workers and found < limit:
+                    path, size = waiting or next(remaining, (None, 0))
+                    waiting = None
+                    if path is None:
+                        break
+                    free = budget - sum(reserved for _, reserved, _ in running.values())
+                    if size > budget:
+                        # Never fits, but only counts as cut short if it is text.
+                        reserved, max_bytes = 0, budget
+                    elif size > free:
+                        waiting = (path, size)
+                        break
+                    else:
+                        reserved, max_bytes = size, size
+                    executor = self._get_executor()
+                    future = loop.run_in_executor(
+                        executor,
+                        search_file,
+                        path,
+                        query,
+                        ignore_case,
+                        limit - found,
+                        deadline,
+                        max_bytes,
+                    )
+                    running[future] = (path, reserved, executor)
+                    self._pending += 1
+                if not running:
+                    break
+
+                done, _ = await asyncio.wait(
+                    running,
+                    timeout=max(0, deadline - time.time()),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    truncated = "time"
+                    break
+
+                for future in done:
+                    path, size, executor = running.pop(future)
+                    self._pending -= 1
+                    try:
+                        matches = future.result()
+                    except OverBudget:
+                        truncated = "bytes"
+                        continue
+                    except BrokenProcessPool:
+                        # A process died, for example from SIGBUS when a mapped
+                        # file was truncated. The next file gets a new pool.
+                        self._reset(executor)
+                        failed += 1
+                        continue
+                    except (OSError, ValueError):
+                        failed += 1
+                        continue
+                    if matches is None:
+                        continue
+
+                    budget -= size
+                    searched += 1
+                    for match in matches[: limit - found]:
+                        await send({"path": os.path.relpath(path, root), **match})
+                        found += 1
+                if found >= limit:
+                    truncated = "matches"
+                    break
+            if time.time() > deadline and truncated is None:
+                truncated = "time"
+        finally:
+            # Files already being searched stop at the deadline on their own.
+            for future in running:
+                future.cancel()
+            self._pending -= len(running)
+
+        await send(
+            {
+                "done": True,
+                "files": searched,
+                "failed": failed,
+                "matches": found,
+                "truncated": truncated,
+            }
+        )
+
+    def _reset(self, executor: ProcessPoolExecutor) -> None:
+        # Searches that ran on the same pool all see it break.
+        if self._executor is executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stop(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
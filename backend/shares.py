@@ -0,0 +1,104 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Union
+
+from database import SQLiteInterface
+from metrics import cache_lookup
+
+SHARE_CODE_PATTERN = r"[A-Za-z0-9_-]{16}"
+# Unknown codes are remembered for a while so guessing does not reach the DB.
+MISSING_TTL = 30
+# How long a known code is trusted before its owner's access is checked again.
+SHARE_TTL = 60
+
+
+class Share(NamedTuple):
+    code: str
+    location: str
+    path: str
+    uname: str
+    created: int
+    expiry: Union[int, None]
+    max_downloads: Union[int, None]
+    downloads: int
+    # The owner's `authorized_locations` and `permissions`, shaped like a JWT.
+    owner: Union[dict, None] = None
+
+    @property
+    def expired(self) -> bool:
+        return self.expiry is not None and self.expiry <= time.time()
+
+    def to_dict(self) -> dict:
+        share = self._asdict()
+        del share["owner"]
+        return share
+
+
+class ShareService:
+    """
+    Resolves share codes through a bounded LRU in front of the `shares` table.
+    Entries are only trusted for `SHARE_TTL` seconds, so a link stops working
+    soon after its owner loses access to the file.
+    Downloads of links without a limit are counted in memory and written in
+    batches, so serving them needs no database round trip at all. Links with
+    a download limit are counted in the database as they are downloaded.
+    """
+
+    def __init__(self, db: SQLiteInterface, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._db = db
+        self._entries: OrderedDict[
+            str, tuple[Union[Share, None], float]
+        ] = OrderedDict()
+        self._downloads: dict[str, int] = {}
+
+    async def get(self, code: str) -> Union[Share, None]:
+        entry = self._entries.get(code)
+        if entry is not None and entry[1] > time.monotonic():
+            cache_lookup("shares", True)
+            self._entries.move_to_end(code)
+            return entry[0]
+
+        cache_lookup("shares", False)
+        row = await self._db.find_share(code)
+        share = None
+        if row:
+            share = Share(
+                *row[:8],
+                None
+                if row[9] is None
+                else {"authorized_locations": row[8], "permissions": row[9]},
+            )
+        self._entries[code] = (
+            share,
+            time.monotonic() + (SHARE_TTL if share else MISSING_TTL),
+        )
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return share
+
+    def invalidate(self, code: Union[str, None] = None) -> None:
+        if code is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(code, None)
+
+    async def count_download(self, share: Share) -> bool:
+        if share.max_downloads is not None:
+            return await self._db.count_share_download(share.code)
+
+        self._downloads[share.code] = self._downloads.get(share.code, 0) + 1
+        return True
+
+    async def flush(self) -> None:
+        if self._downloads:
+            downloads, self._downloads = self._downloads, {}
+            await self._db.add_share_downloads(
+                [(count, code) for code, count in downloads.items()]
+            )
+
+    async def flush_task(self) -> None:
+        while True:
+            await asyncio.sleep(10)
+            await self.flush()
@@ -0,0 +1,136 @@
+import os
+import zlib
+from email.utils import formatdate
+from typing import Union
+
+import aiofiles
+from aiofiles.os import stat
+from bandwidth import Transfer
+from exceptions import RangeNotSatisfiable
+from metrics import TRANSFERRED_BYTES
+from sanic.request import Request
+from sanic.response import ResponseStream
+
+CHUNK_SIZE = 1048576
+
+
+def file_etag(stats: os.stat_result) -> str:
+    return f'"{stats.st_ino:x}-{stats.st_size:x}-{stats.st_mtime_ns:x}"'
+
+
+def directory_etag(stats: os.stat_result, options: str = "") -> str:
+    # A directory's mtime changes whenever an entry is added, removed or
+    # renamed, but not when a file in it is written to. The tag is weak, as
+    # listings are compressed differently depending on the client.
+    tag = f"{stats.st_dev:x}-{stats.st_ino:x}-{stats.st_mtime_ns:x}"
+    if options:
+        tag += f"-{zlib.crc32(options.encode()):x}"
+    return f'W/"{tag}"'
+
+
+def etag_matches(header: Union[str, None], etag: str) -> bool:
+    # The weak comparison that If-None-Match calls for.
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in (
+        candidate.strip().removeprefix("W/") for candidate in header.split(",")
+    )
+
+
+def parse_range(header: Union[str, None], total: int) -> Union[tuple[int, int], None]:
+    """
+    Parses a single `bytes` range into inclusive offsets. Headers that cannot
+    be parsed or ask for several ranges are ignored, so the whole file is sent,
+    as RFC 7233 allows.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else total - 1
+        elif last:
+            if int(last) == 0:
+                raise RangeNotSatisfiable(total)
+            start = max(total - int(last), 0)
+            end = total - 1
+        else:
+            return None
+    except ValueError:
+        return None
+
+    if start >= total:
+        raise RangeNotSatisfiable(total)
+    if start > end:
+        return None
+    return start, min(end, total - 1)
+
+
+def requested_range(
+    request: Request, stats: os.stat_result
+) -> Union[tuple[int, int], None]:
+    # A range is only honoured while the file is the one it was asked of.
+    if request.headers.get("If-Range", file_etag(stats)) != file_etag(stats):
+        return None
+    return parse_range(request.headers.get("Range"), stats.st_size)
+
+
+async def send_file(
+    request: Request,
+    path: str,
+    filename: str,
+    location: str,
+    transfer: Transfer,
+    mimetype: Union[str, None] = None,
+) -> ResponseStream:
+    """
+    Streams a file as a download, honouring `Range` and `If-Range`, so that
+    interrupted downloads can be resumed. The bytes actually sent are counted
+    as downloaded from `location`, at the rate `transfer` allows.
+    """
+    stats = await stat(path)
+    etag = file_etag(stats)
+    headers = {
+        "Content-Disposition": f'Attachment; filename="{filename}"',
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": formatdate(stats.st_mtime, usegmt=True),
+    }
+
+    byte_range = requested_range(request, stats)
+    start, end = byte_range or (0, stats.st_size - 1)
+    length = end - start + 1
+    headers["Content-Length"] = str(length)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{stats.st_size}"
+
+    async def streaming_fn(response) -> None:
+        remaining = length
+        try:
+            async with transfer, aiofiles.open(path, "rb") as f:
+                await f.seek(start)
+                while remaining > 0:
+                    chunk = await f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    await transfer.throttle(len(chunk))
+                    await response.write(chunk)
+                    remaining -= len(chunk)
+        finally:
+            TRANSFERRED_BYTES.inc(
+                length - remaining, direction="download", location=location
+            )
+
+    return ResponseStream(
+        streaming_fn,
+        status=206 if byte_range else 200,
+        headers=headers,
+        content_type=mimetype or "application/octet-stream",
+    )
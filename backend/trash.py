@@ -0,0 +1,193 @@
+import asyncio
+import errno
+import os
+import threading
+import time
+from typing import NamedTuple, Union
+from uuid import uuid4
+
+from auth.authorization import Location
+from database import SQLiteInterface
+from jobs import JobCancelled, fsops
+from sanic.config import Config
+from sanic.log import logger
+
+# Trashed items are renamed into this folder at the root of their location,
+# named by their ID.
+TRASH_FOLDER = ".bunsho-trash"
+PURGE_INTERVAL = 600
+
+
+class TrashItem(NamedTuple):
+    id: str
+    location: str
+    path: str
+    uname: str
+    deleted: int
+    is_directory: bool
+
+    def to_dict(self, retention: int) -> dict:
+        return {
+            **self._asdict(),
+            "is_directory": bool(self.is_directory),
+            "expires": self.deleted + retention,
+        }
+
+
+class _Purge:
+    """
+    Stands in for a `Job` while the purger deletes a trashed tree, sleeping
+    between batches so that it never removes more than `rate` items a second.
+    """
+
+    def __init__(self, rate: int, stopped: threading.Event):
+        self._rate = rate
+        self._stopped = stopped
+        self._started = time.monotonic()
+        self._done = 0
+
+    def start_phase(self, *_args, **_kwargs) -> None:
+        self.check_cancelled()
+
+    def advance(self, amount: int = 1) -> None:
+        self._done += amount
+        if self._rate:
+            ahead = self._done / self._rate - (time.monotonic() - self._started)
+            if ahead > 0:
+                self._stopped.wait(ahead)
+        self.check_cancelled()
+
+    def check_cancelled(self) -> None:
+        if self._stopped.is_set():
+            raise JobCancelled()
+
+
+class TrashService:
+    """
+    Moves deleted files and folders into the trash of their location with a
+    single rename, so deleting takes the same time no matter how big the tree
+    is. Items older than `TRASH_RETENTION` are purged in the background.
+    """
+
+    def __init__(self, db: SQLiteInterface, config: Config):
+        self._db = db
+        self._config = config
+        self._stopped = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._config.get("TRASH", False))
+
+    @property
+    def retention(self) -> int:
+        return self._config.get("TRASH_RETENTION", 604800)
+
+    def path(self, location: Location, item_id: str) -> str:
+        return os.path.join(location.dir, TRASH_FOLDER, item_id)
+
+    async def trash(
+        self, location: Location, path: str, uname: str
+    ) -> Union[TrashItem, None]:
+        """
+        Returns `None` without touching anything when `path` is on another
+        filesystem than its location, which a rename cannot move it across.
+        """
+        item = TrashItem(
+            uuid4().hex,
+            location.name,
+            os.path.relpath(path, location.dir),
+            uname,
+            int(time.time()),
+            os.path.isdir(path) and not os.path.islink(path),
+        )
+        try:
+            os.makedirs(os.path.join(location.dir, TRASH_FOLDER), exist_ok=True)
+            os.rename(path, self.path(location, item.id))
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                return None
+            raise
+
+        await self._db.insert_trash(*item)
+        return item
+
+    def _expired(self, row) -> bool:
+        # Expired items may already be being purged, so they are out of reach.
+        return row[4] < int(time.time()) - self.retention
+
+    async def find(self, item_id: str) -> Union[TrashItem, None]:
+        row = await self._db.find_trash_item(item_id)
+        if not row or self._expired(row):
+            return None
+        return TrashItem(*row)
+
+    async def find_all(
+        self, location: Location, uname: Union[str, None]
+    ) -> list[TrashItem]:
+        return [
+            TrashItem(*row)
+            for row in await self._db.find_trash(location.name, uname)
+            if not self._expired(row)
+        ]
+
+    async def restore(
+        self, location: Location, item: TrashItem, destination: str
+    ) -> None:
+        # Moved out before the row goes, so the purger, which only looks at
+        # items without a row, never sees it half restored. Raises
+        # `FileExistsError` rather than replacing something at `destination`.
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        fsops.rename_noreplace(self.path(location, item.id), destination)
+        await self._db.delete_trash(item.id)
+
+    async def purge_task(self) -> None:
+        while True:
+            for row in await self._db.find_expired_trash(
+                int(time.time()) - self.retention
+            ):
+                await self.purge(TrashItem(*row))
+            await self._purge_orphans()
+
+            await asyncio.sleep(PURGE_INTERVAL)
+
+    async def purge(self, item: TrashItem) -> None:
+        location = self._config.LOCATION_INDEX.by_name.get(item.location)
+        if not location or not await self._db.delete_trash(item.id):
+            return
+        await self._remove(self.path(location, item.id))
+
+    async def _purge_orphans(self) -> None:
+        # Items whose row is gone but whose files are not, because the server
+        # stopped while purging them or while trashing them.
+        known = await self._db.find_trash_ids()
+        cutoff = time.time() - PURGE_INTERVAL
+        for location in self._config.LOCATION_INDEX.locations:
+            try:
+                entries = list(os.scandir(os.path.join(location.dir, TRASH_FOLDER)))
+            except FileNotFoundError:
+                continue
+
+            for entry in entries:
+                if (
+                    entry.name not in known
+                    and entry.stat(follow_symlinks=False).st_ctime < cutoff
+                ):
+                    await self._remove(entry.path)
+
+    async def _remove(self, path: str) -> None:
+        if not os.path.lexists(path):
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                fsops.remove_tree,
+                _Purge(self._config.get("TRASH_PURGE_RATE", 1000), self._stopped),
+                path,
+            )
+        except JobCancelled:
+            pass
+        except OSError:
+            logger.exception(f"[Worker]: Could not purge {path} from the trash")
+
+    def stop(self) -> None:
+        self._stopped.set()
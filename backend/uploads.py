@@ -0,0 +1,112 @@
+import asyncio
+import os
+import shutil
+import time
+from typing import Iterable
+
+from sanic.config import Config
+from sanic.log import logger
+
+from database import TempDBInterface
+from jobs import fsops
+
+# Partial uploads are kept in this folder at the root of their location, so
+# they can be moved into place without copying and swept without a tree walk.
+UPLOADS_FOLDER = ".bunsho-uploads"
+PARTIAL_SUFFIX = ".part"
+# A partial file written to this recently belongs to an upload still running,
+# even if its session has expired in the meantime.
+ACTIVE_WINDOW = 120
+SWEEP_INTERVAL = 60
+
+
+def partial_path(location_dir: str, uuid: str, suffix: str = "") -> str:
+    return os.path.join(location_dir, UPLOADS_FOLDER, f"{uuid}{suffix}{PARTIAL_SUFFIX}")
+
+
+def commit_partial(part: str, path: str) -> None:
+    # A hard link fails instead of replacing a file created at the destination
+    # while the upload was running.
+    try:
+        os.link(part, path)
+    except FileExistsError:
+        raise
+    except OSError:
+        if os.path.lexists(path):
+            raise FileExistsError(path)
+        shutil.move(part, path)
+        return
+    os.unlink(part)
+
+
+def commit_partial_tree(staging: str, folder: str) -> None:
+    # Checked up front so that a conflict leaves the folder untouched, and
+    # again by every rename, so that nothing created since gets replaced.
+    names = os.listdir(staging)
+    for name in names:
+        if os.path.lexists(os.path.join(folder, name)):
+            raise FileExistsError(os.path.join(folder, name))
+    for name in names:
+        fsops.rename_noreplace(os.path.join(staging, name), os.path.join(folder, name))
+    os.rmdir(staging)
+
+
+def remove_partial(part: str) -> None:
+    try:
+        if os.path.isdir(part) and not os.path.islink(part):
+            shutil.rmtree(part)
+        else:
+            os.unlink(part)
+    except FileNotFoundError:
+        pass
+
+
+def _sweep(folders: Iterable[str], live: set[str]) -> int:
+    removed = 0
+    now = time.time()
+    for folder in folders:
+        try:
+            entries = list(os.scandir(folder))
+        except FileNotFoundError:
+            continue
+
+        for entry in entries:
+            if not entry.name.endswith(PARTIAL_SUFFIX):
+                continue
+            # Named after the upload's UUID, with an optional suffix.
+            if entry.name.split(".", 1)[0] in live:
+                continue
+            try:
+                if now - entry.stat(follow_symlinks=False).st_mtime < ACTIVE_WINDOW:
+                    continue
+                remove_partial(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+async def upload_sessions_cleanup_task(config: Config, tempdb: TempDBInterface) -> None:
+    """
+    Deletes expired upload sessions, then every partial file that neither
+    belongs to a live session nor is still being written to. Sessions do not
+    survive a restart, so this also catches uploads cut off by one.
+    """
+    while True:
+        expired = await tempdb.delete_expired_uuids()
+        removed = await asyncio.get_running_loop().run_in_executor(
+            None,
+            _sweep,
+            [
+                os.path.join(location.dir, UPLOADS_FOLDER)
+                for location in config.LOCATION_INDEX.locations
+            ],
+            {uuid for uuid, *_ in tempdb.find_all_uuids()},
+        )
+        if expired or removed:
+            logger.info(
+                f"[Worker]: Swept {expired} expired upload sessions and "
+                f"{removed} partial files"
+            )
+
+        await asyncio.sleep(SWEEP_INTERVAL)
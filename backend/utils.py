@@ -1,59 +1,135 @@
 import asyncio
 import math
-import random
-from typing import Union
+import os
+import secrets
+import time
+from typing import Iterable, Union
 
-import magic
 import ujson
 from aiofiles.os import path as aiopath
+from auth.authorization import LocationIndex
+from metrics import stage
 from sanic.config import Config
+from sanic.exceptions import InvalidUsage
+from trash import TRASH_FOLDER
+from uploads import UPLOADS_FOLDER
+
+
+REQUIRED_KEYS = (
+    "DEV_MODE",
+    "ENABLE_OPENAPI",
+    "HOST",
+    "PORT",
+    "ACCESS_TOKEN_SECRET",
+    "REFRESH_TOKEN_SECRET",
+    "LOCATIONS",
+)
+# Folders Bunsho keeps at the root of locations for itself, which never show
+# up in listings or archives.
+INTERNAL_FOLDERS = frozenset({TRASH_FOLDER, UPLOADS_FOLDER})
+
+
+def load_config() -> dict:
+    with open(
+        os.environ.get("BUNSHO_CONFIG", "./config.json"), "r", encoding="utf8"
+    ) as f:
+        config = ujson.load(f)
+    if not isinstance(config, dict) or not all(key in config for key in REQUIRED_KEYS):
+        raise ValueError(
+            "The configuration for Bunsho is incomplete. Please refer to the README instructions."
+        )
+    return config
 
 
 class BunshoConfig(Config):
-    def __init__(self):
+    """
+    Built from `config.json` once in the main process, which the forked
+    workers inherit. On reloads a single worker parses the file and passes
+    the result to the others.
+    """
+
+    def __init__(self, config: dict = None):
         super().__init__()
 
-        with open("./config.json", "r", encoding="utf8") as f:
-            config = ujson.load(f)
-            if not all(
-                key in config
-                for key in (
-                    "DEV_MODE",
-                    "ENABLE_OPENAPI",
-                    "HOST",
-                    "PORT",
-                    "ACCESS_TOKEN_SECRET",
-                    "REFRESH_TOKEN_SECRET",
-                    "LOCATIONS",
-                )
-            ):
-                raise ValueError(
-                    "The configuration for Bunsho is incomplete. Please refer to the README instructions."
-                )
-
-            self.update_config(config)
+        self.update_config(config if config is not None else load_config())
+        self.LOCATION_INDEX = LocationIndex(self.LOCATIONS)
+        if "EPHEMERAL_BACKEND" not in self:
+            self.EPHEMERAL_BACKEND = "memory" if self.DEV_MODE else "socket"
+
+
+class StartupTimer:
+    def __init__(self, started: float):
+        self.started = started
+        self.phases: dict[str, float] = {}
+        self._phase_started = started
+
+    def start_phase(self) -> None:
+        self._phase_started = time.perf_counter()
+
+    def end_phase(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases[phase] = now - self._phase_started
+        self._phase_started = now
+
+    def report(self) -> str:
+        return (
+            f"{sum(self.phases.values()) * 1000:.0f} ms ("
+            + ", ".join(
+                f"{phase} {seconds * 1000:.0f} ms"
+                for phase, seconds in self.phases.items()
+            )
+            + ")"
+        )
+
+
+def safe_join(root: str, *paths: str) -> str:
+    root = os.path.normpath(root)
+    path = os.path.normpath(os.path.join(root, *paths))
+    if os.path.commonpath([root, path]) != root:
+        raise InvalidUsage(
+            "Directory traversal outside of the root location is not allowed.", 400
+        )
+    if os.path.relpath(path, root).split(os.sep, 1)[0] in INTERNAL_FOLDERS:
+        raise InvalidUsage("This folder is reserved for Bunsho itself.", 400)
+    return path
+
+
+def visible(location: str, folder: str, names: Iterable[str]) -> list[str]:
+    # Only reserved at the root, folders of the same name further down belong
+    # to the user.
+    if os.path.normpath(folder) != os.path.normpath(location):
+        return list(names)
+    return [name for name in names if name not in INTERNAL_FOLDERS]
 
 
 def generateshare() -> str:
-    return "".join(
-        random.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz")
-        for _ in range(6)
-    )
+    # 16 URL safe characters carrying 96 random bits.
+    return secrets.token_urlsafe(12)
 
 
-async def getmimetype(file: str) -> Union[str, None]:
-    def _getmimetype(file: str) -> str:
-        return magic.from_file(file, mime=True)
+def _filemimetype(file: str) -> str:
+    # Loading libmagic is slow, and only workers that list files need it.
+    import magic
 
-    if not await aiopath.isdir(file):
+    return magic.from_file(file, mime=True)
+
+
+async def filemimetype(file: str) -> str:
+    # For paths already known not to be folders.
+    with stage("mimetype"):
         return await asyncio.get_running_loop().run_in_executor(
-            None, _getmimetype, file
+            None, _filemimetype, file
         )
+
+
+async def getmimetype(file: str) -> Union[str, None]:
+    if not await aiopath.isdir(file):
+        return await filemimetype(file)
     return None
 
 
 def parsebytes(b: int) -> str:
-    multiple = math.trunc(math.log2(b) / math.log2(1000))
+    multiple = math.trunc(math.log2(b) / math.log2(1000)) if b else 0
     value = b / math.pow(1000, multiple)
     return (
         f'{value:.2f} {["B", "kB", "MB", "GB", "TB", "PB", "EB", "ZB", "YB"][multiple]}'